@@ -1,14 +1,26 @@
-from turtle import end_poly
-from flask import Flask
+from flask import Flask, g
 from flask_restx import Api
 
+from app.commands import indexes_cli, migrate_cli, questionnaires_cli
+from app.common.hashing import password_hasher
+from app.common.validators import validator_cache
+from app.db import close_db, definition_cache, get_db, revocation_list, user_cache
+from app.indexes import ensure_indexes
+from app.metrics import init_metrics
+from app.purger import init_purger
+
 from app.resources.auth import Auth
 from app.resources.logout import Logout
 from app.resources.refresh import Refresh
 from app.resources.user import User
 from app.resources.questionnaire import Questionnaire
+from app.resources.questionnaire_import import QuestionnaireImport
 from app.resources.question import Question
 from app.resources.answer import Answer
+from app.resources.response import Response
+from app.resources.results import Results
+from app.resources.stats import Stats
+from app.resources.export import Export
 
 def create_app(settings_module):
     """
@@ -52,5 +64,79 @@ def create_app(settings_module):
     api.add_resource(Question, '/questions/<string:question_id>', endpoint='question')
     api.add_resource(Answer, '/answers/<string:answer_id>', endpoint='answer')
 
+    # Endpoint to import complete questionnaires with all their questions.
+    api.add_resource(QuestionnaireImport, '/questionnaires/import', endpoint='import_questionnaires')
+
+    # Endpoint to submit all the answers of a filled-out questionnaire at once.
+    api.add_resource(Response, '/questionnaires/<string:questner_id>/responses', endpoint='responses')
+
+    # Endpoint to get the answer counts of the choice questions of a questionnaire.
+    api.add_resource(Results, '/questionnaires/<string:questner_id>/results', endpoint='results')
+
+    # Endpoint to get the statistics of every question of a questionnaire, kept up to date by every answer.
+    api.add_resource(Stats, '/questionnaires/<string:questner_id>/stats', endpoint='stats')
+
+    # Endpoint to export all the answers of a questionnaire as CSV or Parquet.
+    api.add_resource(Export, '/questionnaires/<string:questner_id>/export', endpoint='export')
+
+    # Configure the cache of the users loaded by token_required()
+    user_cache.configure(
+        maxsize=app.config.get('USER_CACHE_SIZE', 1024),
+        ttl=app.config.get('USER_CACHE_TTL', 5)
+    )
+
+    # Configure the cache of the questionnaire and question definitions
+    definition_cache.configure(
+        maxsize=app.config.get('DEFINITION_CACHE_SIZE', 4096),
+        ttl=app.config.get('DEFINITION_CACHE_TTL', 2),
+        shared_path=app.config.get('DEFINITION_CACHE_SHARED_PATH', ''),
+        shared_ttl=app.config.get('DEFINITION_CACHE_SHARED_TTL', 60)
+    )
+
+    # Configure the cache of the compiled validators of the answers
+    validator_cache.configure(
+        maxsize=app.config.get('ANSWER_VALIDATOR_CACHE_SIZE', 4096),
+        ttl=app.config.get('ANSWER_VALIDATOR_CACHE_TTL', 300)
+    )
+
+    # Configure how often the list of revoked Access Tokens is reloaded
+    revocation_list.configure(interval=app.config.get('REVOCATION_SYNC_INTERVAL', 5))
+
+    # Configure the limits of the password hashing
+    password_hasher.configure(
+        workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+        queue_depth=app.config.get('PASSWORD_HASH_QUEUE_DEPTH', 16),
+        method=app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256'),
+        salt_length=app.config.get('PASSWORD_SALT_LENGTH', 16),
+        retry_after=app.config.get('PASSWORD_HASH_RETRY_AFTER', 1)
+    )
+
+    # Store the database name in Flask's global variable before every request,
+    # since the user may come from the user cache without touching the database.
+    @app.before_request
+    def set_db_name():
+        g._db_name = app.config['QUEST_DB_NAME']
+
+    # Record the request latency and serve the metrics at "/metrics".
+    if app.config.get('QUEST_METRICS_ENABLED', True):
+        init_metrics(app)
+
+    # Purge the deleted questionnaires in the background, if enabled.
+    init_purger(app)
+
+    # Register the CLI commands
+    app.cli.add_command(indexes_cli)
+    app.cli.add_command(questionnaires_cli)
+    app.cli.add_command(migrate_cli)
+
+    # Create the missing indexes at startup, if enabled.
+    if app.config.get('QUEST_DB_ENSURE_INDEXES', False):
+        with app.app_context():
+            ensure_indexes(get_db()[app.config['QUEST_DB_NAME']])
+
+        # Close the client used to create the indexes, so the workers
+        # don't inherit it and open their own after the fork.
+        close_db()
+
     # Return app object with all the configuration
     return app
\ No newline at end of file
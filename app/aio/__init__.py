@@ -0,0 +1,89 @@
+from quart import Quart
+from werkzeug.utils import import_string
+
+from app.aio.db import close_db, definition_cache, revocation_list, user_cache
+from app.aio.views import Answer, Auth, Logout, Question, Questionnaire, Refresh, User
+from app.common.hashing import password_hasher
+from app.common.validators import validator_cache
+
+def create_async_app(settings_module):
+    """
+    Function to create the ASGI app based on the given "settings_module".
+
+    It serves the authentication routes and the routes to create, get and
+    delete the users, questionnaires, questions and answers of create_app(),
+    with async handlers and the async Mongo driver (Motor), so a single process
+    can wait on many requests at once. The other routes of create_app() are
+    not served (see the README). It has to be run with an ASGI server,
+    e.g. "hypercorn asgi:app".
+    """
+
+    # Set the instance_relative_config parameter to True
+    # so Quart knows that the directory /instance is at the same same level as the /app directory
+    app = Quart(__name__, instance_relative_config=True)
+
+    # Load the configuration from the settings_module file. Unlike Flask,
+    # Quart doesn't import modules given by name, so it is imported here.
+    app.config.from_object(import_string(settings_module))
+
+    # Check if we are in a testing environment or production environment
+    if app.config.get('TESTING', False):
+        app.config.from_pyfile('config-testing.py', silent=True)
+    else:
+        app.config.from_pyfile('config.py', silent=True)
+
+    # Configure the cache of the users loaded by token_required()
+    user_cache.configure(
+        maxsize=app.config.get('USER_CACHE_SIZE', 1024),
+        ttl=app.config.get('USER_CACHE_TTL', 5)
+    )
+
+    # Configure the cache of the question definitions
+    definition_cache.configure(
+        maxsize=app.config.get('DEFINITION_CACHE_SIZE', 4096),
+        ttl=app.config.get('DEFINITION_CACHE_TTL', 2),
+        shared_path=app.config.get('DEFINITION_CACHE_SHARED_PATH', ''),
+        shared_ttl=app.config.get('DEFINITION_CACHE_SHARED_TTL', 60)
+    )
+
+    # Configure the cache of the compiled validators of the answers
+    validator_cache.configure(
+        maxsize=app.config.get('ANSWER_VALIDATOR_CACHE_SIZE', 4096),
+        ttl=app.config.get('ANSWER_VALIDATOR_CACHE_TTL', 300)
+    )
+
+    # Configure how often the list of revoked Access Tokens is reloaded
+    revocation_list.configure(interval=app.config.get('REVOCATION_SYNC_INTERVAL', 5))
+
+    # Configure the limits of the password hashing
+    password_hasher.configure(
+        workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+        queue_depth=app.config.get('PASSWORD_HASH_QUEUE_DEPTH', 16),
+        method=app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256'),
+        salt_length=app.config.get('PASSWORD_SALT_LENGTH', 16),
+        retry_after=app.config.get('PASSWORD_HASH_RETRY_AFTER', 1)
+    )
+
+    # Authentication, logout and Access Token refresh.
+    app.add_url_rule('/auth', view_func=Auth.as_view('auth'))
+    app.add_url_rule('/logout', view_func=Logout.as_view('logout'))
+    app.add_url_rule('/refresh', view_func=Refresh.as_view('refresh'))
+
+    # Endpoints to "add" resources.
+    app.add_url_rule('/users', view_func=User.as_view('add_user'))
+    app.add_url_rule('/questionnaires', view_func=Questionnaire.as_view('add_questionnare'))
+    app.add_url_rule('/questions', view_func=Question.as_view('add_question'))
+    app.add_url_rule('/answers', view_func=Answer.as_view('add_answer'))
+
+    # Endpoints to get and delete resources with a given ID.
+    app.add_url_rule('/questionnaires/<string:questner_id>', view_func=Questionnaire.as_view('questionnaire'))
+    app.add_url_rule('/questions/<string:question_id>', view_func=Question.as_view('question'))
+    app.add_url_rule('/answers/<string:answer_id>', view_func=Answer.as_view('answer'))
+
+    # Close the shared connection pool when the server stops.
+    @app.after_serving
+    async def close_connection_pool():
+        close_db()
+
+    # Return app object with all the configuration
+    return app
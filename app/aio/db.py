@@ -0,0 +1,678 @@
+import os
+import time
+
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.results import DeleteResult, InsertOneResult
+from quart import current_app, g
+
+from app.common.cache import TTLCache, TwoTierCache
+from app.common.hashing import password_hasher
+from app.common.revocations import RevocationList, new_revocation
+from app.common.sessions import new_session, rotation_update, session_filter
+from app.common.stats import stats_operations
+from app.common.validators import validate_answer
+from app.documents import (
+    CACHED_USER_PROJECTION, DEFINITION_PROJECTION, definition_cache_key, deletion_update, new_answer, new_question,
+    new_questionnaire, new_user, project_fields, question_not_found, questionnaire_not_found, session_user, split_page,
+    user_query
+)
+from app.pipelines import (
+    INCLUDE_ALL, accepts_answers, counters_update, not_deleted, questionnaire_pipeline, questionnaire_summaries_pipeline,
+    questionnaires_pipeline
+)
+
+
+# Async counterpart of app.db, used by the ASGI application (app.aio).
+# Every function has the same name, arguments and result as the one in app.db,
+# but it is a coroutine that uses Motor instead of PyMongo. The documents,
+# queries and pipelines come from app.documents and app.pipelines, so only
+# the round trips to the database are written twice.
+
+# Process-wide Motor client shared by every request handled by this process,
+# and the PID of the process that created it.
+_client = None
+_client_pid = None
+
+
+def get_client():
+    """
+    Function to return the process-wide Motor client.
+
+    The client is created lazily on first use, from inside the event loop that
+    will use it, and again if the process has been forked.
+    """
+
+    global _client, _client_pid
+
+    if _client is None or _client_pid != os.getpid():
+
+        # Get the connection and pool parameters from the config object.
+        config = current_app.config
+
+        _client = AsyncIOMotorClient(
+            config["QUEST_DB_URI"],
+            tls=True,
+            tlsAllowInvalidCertificates=True,
+            maxPoolSize=config.get("QUEST_DB_MAX_POOL_SIZE", 100),
+            maxIdleTimeMS=config.get("QUEST_DB_MAX_IDLE_TIME_MS", 60000),
+            serverSelectionTimeoutMS=config.get("QUEST_DB_SERVER_SELECTION_TIMEOUT_MS", 5000)
+        )
+        _client_pid = os.getpid()
+
+    return _client
+
+
+def close_db():
+    """
+    Function to close the process-wide Motor client, if this process owns one.
+    """
+
+    global _client, _client_pid
+
+    if _client is not None and _client_pid == os.getpid():
+        _client.close()
+
+    _client = None
+    _client_pid = None
+
+
+def get_database():
+    """
+    Function to return the database to be used.
+    """
+
+    return get_client()[current_app.config["QUEST_DB_NAME"]]
+
+
+def embedded_questions():
+    """
+    Function to check if the Questions are stored embedded in their Questionnaire.
+    """
+
+    return current_app.config.get('QUEST_EMBEDDED_QUESTIONS', False)
+
+
+# USER MANAGEMENT
+async def create_new_user(email, username, password):
+    """
+    Function to create a new user and save it to the database.
+    """
+
+    # Hash the password in the hashing pool, outside of the event loop.
+    password_hash = await password_hasher.hash_password_async(password)
+
+    # Save the new user in the database and return the result.
+    return await get_database().users.insert_one(new_user(email, username, password_hash))
+
+
+async def get_user(email=None, username=None) -> dict:
+    """
+    Function to return from the database the user with the
+    given 'email', and/or 'username'.
+    """
+
+    # Look for the user with the given 'email' and/or 'username'.
+    return await get_database().users.find_one(user_query(email, username))
+
+
+# Cache of the users loaded by token_required(), keyed by username.
+user_cache = TTLCache()
+
+
+async def get_cached_user(username):
+    """
+    Function to return the user with the given 'username', from the user cache
+    if possible, or from the database otherwise.
+    """
+
+    # Look for the user in the cache first.
+    user = user_cache.get(username)
+
+    if user is None:
+
+        # Only fetch the fields needed to identify the user.
+        user = await get_database().users.find_one({'username': username}, CACHED_USER_PROJECTION)
+
+        if user is not None:
+            user_cache.set(username, user)
+
+    return user
+
+
+# Access Tokens revoked by sign_out_all(), synced from the "revocations" collection.
+revocation_list = RevocationList()
+
+
+async def is_token_revoked(username, issued_at):
+    """
+    Function to check if an Access Token of the given 'username', issued at
+    'issued_at', has been revoked, against the in-memory revocation list.
+    """
+
+    if revocation_list.needs_sync():
+        revocation_list.update(await get_database().revocations.find({}, {'revoked_at': 1}).to_list(None))
+
+    return revocation_list.is_revoked(username, issued_at)
+
+
+async def get_user_with_rt(refresh_token=None):
+    """
+    Function to get the user to which the given 'refresh_token' belongs.
+    """
+
+    return session_user(await get_database().sessions.find_one(session_filter(refresh_token)))
+
+
+async def sign_out_all(username=None):
+    """
+    Function to remove all the sessions from a user, and revoke their Access Tokens.
+    """
+
+    if username is not None:
+        revoked_at = time.time()
+        await get_database().revocations.replace_one({'_id': username}, new_revocation(username, revoked_at), upsert=True)
+        revocation_list.revoke(username, revoked_at)
+
+        result = await get_database().sessions.delete_many({'username': username})
+
+        return result if result.acknowledged else None
+
+
+async def sign_out_session(username=None, session=None):
+    """
+    Function to sign out the user from a specific session.
+    """
+
+    if (username is not None) and (session is not None):
+        result = await get_database().sessions.delete_one(dict(session_filter(session), username=username))
+
+        return result if result.acknowledged else None
+
+    return None
+
+
+async def rotate_session(username=None, refresh_token=None, new_refresh_token=None):
+    """
+    Function to replace the given 'refresh_token' of a session by the
+    'new_refresh_token', in a single operation.
+
+    Returns the user of the session, or None if the token is not the current one.
+    """
+
+    session = await get_database().sessions.find_one_and_update(
+        dict(session_filter(refresh_token), username=username),
+        rotation_update(new_refresh_token),
+        {'username': 1, 'user_id': 1}
+    )
+
+    return session_user(session)
+
+
+async def user_exists(username=None, email=None) -> bool:
+    """
+    Function to return true or false if the user already exists
+    with the given 'email' or 'username'.
+    """
+
+    return True if await get_user(username=username, email=email) else False
+
+
+async def add_session(username=None, refresh_token=None, user_id=None):
+    """
+    Function to save a new session with the given Refresh Token for the user with the given 'username'.
+    """
+
+    database = get_database()
+
+    # Get the ID of the user, if it wasn't given.
+    if user_id is None:
+        user = await database.users.find_one({'username': username}, {'_id': True})
+
+        if user is None:
+            return None
+
+        user_id = user.get('_id')
+
+    result = await database.sessions.insert_one(new_session(username, user_id, refresh_token))
+
+    return result if result.acknowledged else None
+
+
+# Cache of the Question definitions, with the same keys as the one of app.db,
+# so both can share the same shared tier.
+definition_cache = TwoTierCache()
+
+
+def definition_key(kind, object_id):
+    """
+    Function to build the key of a definition in the definition cache.
+    """
+
+    return definition_cache_key(current_app.config["QUEST_DB_NAME"], kind, object_id)
+
+
+# QUESTIONNAIRE MANAGEMENT
+async def create_questionnaire(title, user_id):
+    """
+    Function to create a new questionnaire and save it to the database.
+    """
+
+    return await get_database().questionnaires.insert_one(new_questionnaire(title, user_id))
+
+
+async def get_questionnaires(limit, after=None, include=INCLUDE_ALL, fields=None, summary=False):
+    """
+    Function to get a page of the Questionnaires that belong to the user that's
+    sending the request, or their summaries ('summary').
+
+    Returns a tuple with the list of Questionnaires and the cursor of the next page.
+    """
+
+    # One extra Questionnaire is requested to know if there is a next page.
+    if summary:
+        pipeline = questionnaire_summaries_pipeline(g._current_user.get('username'), after, limit + 1)
+    else:
+        pipeline = questionnaires_pipeline(
+            g._current_user.get('username'), embedded_questions(), after, limit + 1, include, fields
+        )
+
+    questionnaires = await get_database().questionnaires.aggregate(pipeline).to_list(None)
+
+    return split_page(questionnaires, limit)
+
+
+async def get_questionnaire(questner_id, include=INCLUDE_ALL, fields=None):
+    """
+    Function to get a Questionnaire from the database with its given ID, with
+    only the linked elements in 'include' and the given 'fields'.
+    """
+
+    questionnaire = await get_database().questionnaires.aggregate(
+        questionnaire_pipeline(questner_id, embedded_questions(), include, fields)
+    ).to_list(1)
+
+    return questionnaire[0] if questionnaire else None
+
+
+async def get_questionnaire_definition(questner_id):
+    """
+    Function to get a Questionnaire with its given ID, and its Questions but not
+    their Answers, from the definition cache if possible.
+    """
+
+    key = definition_key('questionnaire', questner_id)
+
+    questionnaire = definition_cache.get(key)
+
+    if questionnaire is not None:
+        return questionnaire
+
+    lease = definition_cache.lease()
+    database = get_database()
+
+    questionnaire = await database.questionnaires.find_one(not_deleted({'_id': ObjectId(questner_id)}), DEFINITION_PROJECTION)
+
+    if questionnaire is None:
+        return None
+
+    # Get its Questions from the "questions" collection, if they are not embedded.
+    if not embedded_questions():
+        questionnaire['questions'] = await database.questions.find({'questionnaire_id': questionnaire.get('_id')}).to_list(None)
+
+    definition_cache.set(key, questionnaire, lease)
+
+    return questionnaire
+
+
+async def bump_version(questner_id, questions=0, answers=0):
+    """
+    Function to increase the version of the Questionnaire with the given ID, and
+    add the given number of 'questions' and 'answers' to its counters.
+    """
+
+    await get_database().questionnaires.update_one({'_id': ObjectId(questner_id)}, {'$inc': counters_update(questions, answers)})
+
+
+async def count_new_question(questner_id):
+    """
+    Function to add a new Question to the counters of the Questionnaire with the
+    given ID, only if it hasn't been deleted. Returns False if it doesn't exist anymore.
+    """
+
+    result = await get_database().questionnaires.update_one(
+        not_deleted({'_id': ObjectId(questner_id)}),
+        {'$inc': counters_update(questions=1)}
+    )
+
+    return result.matched_count == 1
+
+
+async def count_new_answers(questner_id, question_ids, answers):
+    """
+    Function to add the given number of new 'answers' to the counters of the
+    Questionnaire with the given ID, only if neither it nor any of the Questions
+    with the given IDs have been deleted. Returns False if they can't be saved.
+    """
+
+    result = await get_database().questionnaires.update_one(
+        accepts_answers(questner_id, question_ids, embedded_questions()),
+        {'$inc': counters_update(answers=answers)}
+    )
+
+    return result.matched_count == 1
+
+
+def forget_definitions(questner_id, question_ids):
+    """
+    Function to remove the stale definitions of a Questionnaire and the given Questions.
+    """
+
+    definition_cache.invalidate(
+        definition_key('questionnaire', questner_id),
+        *[definition_key('question', question_id) for question_id in question_ids]
+    )
+
+
+async def get_questionnaire_version(questner_id):
+    """
+    Function to get the version of the Questionnaire with the given ID, or None if it doesn't exist.
+    """
+
+    questionnaire = await get_database().questionnaires.find_one(not_deleted({'_id': ObjectId(questner_id)}), {'version': 1})
+
+    return None if questionnaire is None else questionnaire.get('version', 0)
+
+
+async def get_question_version(question_id):
+    """
+    Function to get the version of the Questionnaire of the Question with the given ID,
+    or None if the Question doesn't exist.
+    """
+
+    database = get_database()
+
+    if embedded_questions():
+        questionnaire = await database.questionnaires.find_one(
+            not_deleted({'questions._id': ObjectId(question_id)}),
+            {'version': 1}
+        )
+
+        return None if questionnaire is None else questionnaire.get('version', 0)
+
+    question = await database.questions.find_one({'_id': ObjectId(question_id)}, {'questionnaire_id': 1})
+
+    return None if question is None else await get_questionnaire_version(question.get('questionnaire_id'))
+
+
+async def delete_questionnaire(questner_id):
+    """
+    Function to mark a Questionnaire as deleted, if it belongs to the user sending the request.
+
+    Its Questions and Answers are removed later by purge_deleted_questionnaires() of app.db.
+    """
+
+    database = get_database()
+
+    questionnaire = await database.questionnaires.find_one_and_update(
+        not_deleted({'_id': ObjectId(questner_id), 'user_id': g._current_user.get('username')}),
+        deletion_update(),
+        {'questions._id': 1}
+    )
+
+    if questionnaire is None:
+        return None
+
+    question_ids = [question['_id'] for question in questionnaire.get('questions', [])]
+    question_ids.extend([
+        question['_id'] async for question in database.questions.find({'questionnaire_id': ObjectId(questner_id)}, {'_id': 1})
+    ])
+
+    definition_cache.invalidate(
+        definition_key('questionnaire', questner_id),
+        *[definition_key('question', question_id) for question_id in question_ids]
+    )
+
+    return {'message': 'Questionnaire deleted!'}
+
+
+# QUESTION MANAGEMENT
+async def create_question(questionnaire_id, text, type, options=None):
+    """
+    Function to create a new question and save it to the database, if the
+    questionnaire with the given 'questionnaire_id' exists.
+    """
+
+    database = get_database()
+
+    # In embedded mode, add the question to the questionnaire's array.
+    if embedded_questions():
+        question = dict(new_question(text, type, options), _id=ObjectId())
+
+        result = await database.questionnaires.update_one(
+            not_deleted({'_id': ObjectId(questionnaire_id)}),
+            {'$push': {'questions': question}, '$inc': counters_update(questions=1)}
+        )
+
+        if result.matched_count == 1:
+            definition_cache.invalidate(definition_key('questionnaire', questionnaire_id))
+            return InsertOneResult(question['_id'], result.acknowledged)
+
+        return questionnaire_not_found(questionnaire_id)
+
+    questionnaire = await get_questionnaire_definition(questionnaire_id)
+
+    if questionnaire is None:
+        return questionnaire_not_found(questionnaire_id)
+
+    # The cached definition can be stale, count the Question only if the
+    # questionnaire hasn't been deleted.
+    if not await count_new_question(questionnaire_id):
+        definition_cache.invalidate(definition_key('questionnaire', questionnaire_id))
+        return questionnaire_not_found(questionnaire_id)
+
+    question = dict(
+        new_question(text, type, options),
+        questionnaire_id=ObjectId(questionnaire_id),
+        owner=questionnaire.get('user_id')
+    )
+
+    try:
+        result = await database.questions.insert_one(question)
+    except Exception:
+        await bump_version(questionnaire_id, questions=-1)
+        raise
+
+    definition_cache.invalidate(definition_key('questionnaire', questionnaire_id))
+
+    return result
+
+
+async def find_question(question_id):
+    """
+    Function to get a Question, without its Answers, with its given ID.
+    """
+
+    key = definition_key('question', question_id)
+
+    question = definition_cache.get(key)
+
+    if question is not None:
+        return question
+
+    lease = definition_cache.lease()
+    database = get_database()
+
+    if embedded_questions():
+        questionnaire = await database.questionnaires.find_one(
+            not_deleted({'questions._id': ObjectId(question_id)}),
+            {'questions.$': 1}
+        )
+
+        if questionnaire is None:
+            return None
+
+        question = questionnaire['questions'][0]
+        question['questionnaire_id'] = questionnaire.get('_id')
+
+    else:
+        question = await database.questions.find_one({'_id': ObjectId(question_id)})
+
+        # Hide the Questions of deleted Questionnaires that haven't been purged yet.
+        if question is None or await get_questionnaire_definition(question.get('questionnaire_id')) is None:
+            return None
+
+    definition_cache.set(key, question, lease)
+
+    return question
+
+
+async def get_question(question_id, include=INCLUDE_ALL, fields=None):
+    """
+    Function to get a Question from the database with its given ID, with its
+    Answers if 'answers' is in 'include', and only the given 'fields'.
+    """
+
+    question = await find_question(question_id)
+
+    if question is None:
+        return None
+
+    question = project_fields(question, fields)
+
+    if 'answers' in include:
+        question['answers'] = await get_database().answers.find({'question_id': question.get('_id')}).to_list(None)
+
+    return question
+
+
+async def delete_question(question_id):
+    """
+    Function to delete a Question, if its Questionnaire belongs to the current user.
+    """
+
+    database = get_database()
+
+    if embedded_questions():
+        questionnaire = await database.questionnaires.find_one_and_update(
+            {'questions._id': ObjectId(question_id), 'user_id': g._current_user.get("username")},
+            {'$pull': {'questions': {'_id': ObjectId(question_id)}}, '$inc': counters_update(questions=-1)},
+            {'_id': 1}
+        )
+
+        if questionnaire is None:
+            return DeleteResult({'n': 0}, True)
+
+        await database.question_stats.delete_one({'_id': ObjectId(question_id)})
+
+        definition_cache.invalidate(
+            definition_key('question', question_id),
+            definition_key('questionnaire', questionnaire.get('_id'))
+        )
+
+        return DeleteResult({'n': 1}, True)
+
+    question = await database.questions.find_one_and_delete(
+        {'_id': ObjectId(question_id), 'owner': g._current_user.get("username")},
+        {'questionnaire_id': 1}
+    )
+
+    if question is None:
+        return DeleteResult({'n': 0}, True)
+
+    # The ID of the Question is kept in its Questionnaire, so no Answer can be counted for it anymore.
+    await database.questionnaires.update_one(
+        {'_id': question.get('questionnaire_id')},
+        {'$inc': counters_update(questions=-1), '$addToSet': {'deleted_questions': ObjectId(question_id)}}
+    )
+    await database.question_stats.delete_one({'_id': ObjectId(question_id)})
+    definition_cache.invalidate(
+        definition_key('question', question_id),
+        definition_key('questionnaire', question.get('questionnaire_id'))
+    )
+
+    return DeleteResult({'n': 1}, True)
+
+
+# ANSWER MANAGEMENT
+async def create_answer(question_id, value):
+    """
+    Function to create a new answer and save it to the database, if the
+    question with the given 'question_id' exists and the 'value' is valid for it.
+    """
+
+    question = await find_question(question_id)
+
+    if question is not None:
+        # Raises a ValidationError if the value doesn't fit the Question.
+        value = validate_answer(question, value)
+
+        # Get the owner of the question's questionnaire, usually from the cache.
+        questionnaire = await get_questionnaire_definition(question.get('questionnaire_id')) or {}
+
+        # The cached Question can be stale, count the Answer only if neither the
+        # Question nor its Questionnaire have been deleted.
+        if not await count_new_answers(question.get('questionnaire_id'), [question.get('_id')], 1):
+            forget_definitions(question.get('questionnaire_id'), [question_id])
+            return question_not_found(question_id)
+
+        try:
+            result = await get_database().answers.insert_one(
+                new_answer(ObjectId(question_id), question.get('questionnaire_id'), questionnaire.get('user_id'), value)
+            )
+        except Exception:
+            await bump_version(question.get('questionnaire_id'), answers=-1)
+            raise
+
+        await update_question_stats(stats_operations(question.get('questionnaire_id'), question, value))
+
+        return result
+
+    return question_not_found(question_id)
+
+
+async def update_question_stats(operations):
+    """
+    Function to apply to the "question_stats" collection the updates built by stats_operations().
+    """
+
+    if operations:
+        await get_database().question_stats.bulk_write(operations, ordered=False)
+
+
+async def get_answer(answer_id):
+    """
+    Function to get an Answer from the database with its given ID.
+    """
+
+    answer = await get_database().answers.find_one(ObjectId(answer_id))
+
+    # Hide the Answers of deleted Questionnaires that haven't been purged yet.
+    if answer is not None and answer.get('questionnaire_id') is not None:
+        if await get_questionnaire_definition(answer.get('questionnaire_id')) is None:
+            return None
+
+    return answer
+
+
+async def delete_answer(answer_id):
+    """
+    Function to delete an Answer, if its Questionnaire belongs to the current user.
+    """
+
+    answer = await get_database().answers.find_one_and_delete(
+        {'_id': ObjectId(answer_id), 'owner': g._current_user.get("username")},
+        {'questionnaire_id': 1, 'question_id': 1, 'value': 1}
+    )
+
+    if answer is None:
+        return DeleteResult({'n': 0}, True)
+
+    await bump_version(answer.get('questionnaire_id'), answers=-1)
+
+    question = await find_question(answer.get('question_id'))
+
+    if question is not None:
+        await update_question_stats(stats_operations(answer.get('questionnaire_id'), question, answer.get('value'), -1))
+
+    return DeleteResult({'n': 1}, True)
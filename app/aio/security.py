@@ -0,0 +1,46 @@
+from functools import wraps
+
+import jwt
+from bson.objectid import ObjectId
+from quart import current_app, g, request
+
+from app.aio.db import get_cached_user, is_token_revoked
+
+
+def token_required(f):
+    """
+    Decorator to validate the user's JSON Web Token in the async handlers.
+    """
+
+    @wraps(f)
+    async def decorator(*args, **kwargs):
+
+        # Get the JSON Web Token from the "Authorization" header.
+        token = request.headers.get('authorization')
+
+        # If the token does not have a value, return an error.
+        if not token:
+            return {'message': 'a valid token is missing'}, 401
+
+        try:
+            # Decode the token using the applications Secret Key.
+            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms="HS256")
+
+            # In stateless mode, the user is built from the claims of the token.
+            if current_app.config.get('STATELESS_ACCESS_TOKENS', False) and 'user_id' in data:
+                if await is_token_revoked(data['username'], data.get('iat')):
+                    return {'message': 'invalid token', 'token': token}, 403
+
+                g._current_user = {'_id': ObjectId(data['user_id']), 'username': data['username']}
+
+            else:
+                # Store the user on Quart's global variable.
+                g._current_user = await get_cached_user(data['username'])
+
+        except Exception:
+            # Return an error message if the token is invalid.
+            return {'message': 'invalid token', 'token': token}, 403
+
+        return await f(*args, **kwargs)
+
+    return decorator
@@ -0,0 +1,461 @@
+from datetime import datetime, timedelta
+
+import jwt
+from marshmallow import ValidationError
+from quart import Response, current_app, g, make_response, request
+from quart.views import MethodView
+
+from app.aio.db import (
+    add_session, create_answer, create_new_user, create_question, create_questionnaire, delete_answer,
+    delete_question, delete_questionnaire, get_answer, get_question, get_question_version, get_questionnaire,
+    get_questionnaire_version, get_questionnaires, get_user, get_user_with_rt, rotate_session, sign_out_all,
+    sign_out_session, user_exists
+)
+from app.aio.security import token_required
+from app.common.hashing import HashingOverloaded, password_hasher
+from app.common.encoder import encode_response
+from app.common.tokens import encode_access_token, encode_refresh_token
+from app.common.util import projection_tag
+from app.schemas.answer_schema import AnswerSchema
+from app.schemas.pagination_schema import QuestionnaireListSchema
+from app.schemas.projection_schema import QuestionProjectionSchema, QuestionnaireProjectionSchema
+from app.schemas.question_schema import QuestionSchema
+from app.schemas.questionnaire_schema import QuestionnaireSchema
+from app.schemas.user_schema import LogUserSchema, RegisterUserSchema
+
+# Async handlers of the ASGI application. They mirror the resources in
+# app/resources and return the same responses.
+
+
+def json_response(document, status=200):
+    """
+    Function to create a JSON response with the given 'document', encoded in a single pass.
+    """
+
+    return Response(encode_response(document), status=status, mimetype='application/json')
+
+
+def make_etag(*parts):
+    """
+    Function to build the strong ETag of a representation from the given 'parts'.
+    """
+
+    return '-'.join(str(part) for part in parts if part is not None)
+
+
+def not_modified(etag):
+    """
+    Function to return a "304 Not Modified" response if the client already has
+    the representation with the given 'etag', or None otherwise.
+    """
+
+    if not request.if_none_match.contains_weak(etag):
+        return None
+
+    return with_etag(Response('', status=304), etag)
+
+
+def with_etag(response, etag):
+    """
+    Function to add the given 'etag' to the given 'response'.
+    """
+
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    return response
+
+
+async def clear_cookie(body, status):
+    """
+    Function to create a response that clears the Refresh Token cookie.
+    """
+
+    response = await make_response(body, status)
+    response.set_cookie('jwt', '', expires=datetime(1970, 1, 1), httponly=True)
+    return response
+
+
+class Auth(MethodView):
+
+    login_schema = LogUserSchema()
+
+    async def post(self):
+        data = Auth.login_schema.load(await request.get_json())
+
+        # Retrieve the Refresh Token, if any
+        refresh_token = request.cookies.get('jwt')
+
+        if refresh_token is not None:
+
+            # If there is not a user with the Refresh Token, it is being reused.
+            found_user = await get_user_with_rt(refresh_token)
+
+            if found_user is None:
+                await sign_out_all(data.get('username'))
+                return await clear_cookie({'message': 'Unauthorized log in.'}, 403)
+
+            # Remove session from the found user
+            await sign_out_session(found_user.get('username'), refresh_token)
+
+        # Get the user with the given username and/or email.
+        user = await get_user(email=data.get('email', None), username=data.get('username', None))
+
+        if user is None:
+            return {'message': 'Wrong user and/or password.'}, 401
+
+        # Check the password in the hashing pool, outside of the event loop.
+        try:
+            password_matches = await password_hasher.check_password_async(user.get('password'), data.get('password'))
+        except HashingOverloaded as error:
+            return {'message': 'The server is busy. Please try again later.'}, 503, {'Retry-After': str(error.retry_after)}
+
+        if password_matches:
+
+            access_token = encode_access_token(
+                user.get('username'), user.get('_id'), current_app.config['SECRET_KEY'], timedelta(seconds=10)
+            )
+
+            new_refresh_token = encode_refresh_token(
+                user.get('username'), current_app.config['REFRESH_TOKEN_KEY'], timedelta(minutes=1)
+            )
+
+            response = await make_response(
+                {
+                    'user_id': str(user.get('_id')),
+                    'accessToken': access_token
+                }, 200
+            )
+
+            response.set_cookie('jwt', value=new_refresh_token, httponly=True, max_age=24 * 60 * 60 * 1000)
+
+            # Save the session of the new Refresh Token
+            add_session_result = await add_session(
+                username=user.get('username'), refresh_token=new_refresh_token, user_id=user.get('_id')
+            )
+
+            if add_session_result is None or add_session_result.inserted_id is None:
+                return {
+                    'message': 'Server could not save the session. Please try logging in again'}, 500
+
+            return response
+
+        elif refresh_token is not None:
+            return await clear_cookie({'message': 'Wrong user and/or password (cookie).'}, 401)
+
+        else:
+            return {'message': 'Wrong user and/or password.'}, 401
+
+
+class Refresh(MethodView):
+
+    async def get(self):
+        refresh_token = request.cookies.get('jwt')
+
+        if refresh_token is None:
+            return {'message': 'Refresh Token not found. Please try again.'}, 401
+
+        try:
+            data = jwt.decode(refresh_token, current_app.config['REFRESH_TOKEN_KEY'], algorithms="HS256")
+            decoded_username = data.get('username')
+
+        except jwt.ExpiredSignatureError:
+            expired_info = jwt.decode(
+                refresh_token,
+                current_app.config['REFRESH_TOKEN_KEY'],
+                algorithms="HS256",
+                options={'verify_exp': False}
+            )
+
+            # Refresh token is invalid so it needs to be removed from the db
+            result = await sign_out_session(expired_info.get('username'), refresh_token)
+
+            if result is None or result.deleted_count == 0:
+                return {
+                        'message': 'Invalid refresh token. Please try again.',
+                        'debug': 'Refresh Token Reuse. Expired Refresh Token.'
+                    }, 403
+
+            return await clear_cookie(
+                {
+                    'message': 'Invalid refresh token. Please try again.',
+                    'debug': 'Refresh Token NOT Reused. Expired Refresh Token'
+                }, 403
+            )
+
+        new_session = encode_refresh_token(decoded_username, current_app.config['REFRESH_TOKEN_KEY'], timedelta(days=1))
+
+        # Swap the used refresh token for the new one, if it is still the current one.
+        found_user = await rotate_session(decoded_username, refresh_token, new_session)
+
+        # If a session was not found, this a reused refresh token.
+        if found_user is None:
+            # Delete all the active sessions from the user
+            await sign_out_all(decoded_username)
+
+            return await clear_cookie(
+                {
+                    'message': 'Invalid refresh token. Please try again.',
+                    'debug': 'Refresh Token Reuse. Deleted all sessions from db.'
+                }, 403)
+
+        access_token = encode_access_token(
+            decoded_username, found_user.get('_id'), current_app.config['SECRET_KEY'], timedelta(minutes=15)
+        )
+
+        tokens_response = await make_response({
+            'accessToken': access_token,
+            'username': found_user.get('username'),
+            'user_id': str(found_user.get('_id'))
+            }, 200)
+
+        tokens_response.set_cookie('jwt', value=new_session, httponly=True, max_age=24 * 60 * 60 * 1000)
+
+        return tokens_response
+
+
+class Logout(MethodView):
+
+    async def get(self):
+        refresh_token = request.cookies.get('jwt')
+
+        if refresh_token is None:
+            return '', 204
+
+        # If a user was found with the Refresh Token, delete the session from the db
+        user = await get_user_with_rt(refresh_token)
+
+        if user is not None:
+            await sign_out_session(user.get('username'), refresh_token)
+
+        response = await make_response('', 204)
+        response.set_cookie('jwt', '', expires=(datetime.today() - timedelta(seconds=1.0)), httponly=True)
+
+        return response
+
+
+class User(MethodView):
+
+    register_schema = RegisterUserSchema()
+
+    async def post(self):
+        data = User.register_schema.load(await request.get_json())
+
+        # Check if the username or email are already in use.
+        if await user_exists(username=data['username']):
+            return {'message': "Username '{}' already exists.".format(data['username'])}, 409
+        elif await user_exists(email=data['email']):
+            return {'message': "Email '{}' is already taken. Please try with a different email.".format(data['email'])}, 409
+
+        try:
+            result = await create_new_user(**data)
+        except HashingOverloaded as error:
+            return {'message': 'The server is busy. Please try again later.'}, 503, {'Retry-After': str(error.retry_after)}
+
+        if result.acknowledged is True and result.inserted_id is not None:
+            return {'message': "User '{}' created successfully.".format(data['username'])}, 201
+        else:
+            return {'message': "An error happened while saving the new user in the database."}, 400
+
+
+class Questionnaire(MethodView):
+
+    quest_schema = QuestionnaireSchema()
+    pagination_schema = QuestionnaireListSchema()
+    projection_schema = QuestionnaireProjectionSchema()
+
+    @token_required
+    async def post(self):
+        request_data = await request.get_json()
+
+        # Add the username to the data
+        request_data['user_id'] = g._current_user.get('username')
+
+        validated_data = Questionnaire.quest_schema.load(request_data)
+
+        result = await create_questionnaire(**validated_data)
+
+        if result.acknowledged is True and result.inserted_id is not None:
+            return {'message': "Questionnaire created successfully.",
+                    'id': str(result.inserted_id)
+                    }, 201
+        else:
+            return {'message': "An error happened while saving the new questionnaire in the database."}, 400
+
+    @token_required
+    async def get(self, questner_id=None):
+        # If no ID was given, list the questionnaires of the user.
+        if questner_id is None:
+            return await Questionnaire.list_questionnaires()
+
+        try:
+            projection = Questionnaire.projection_schema.load(request.args)
+        except ValidationError as error:
+            return {'message': error.messages}, 400
+
+        # Get the version before the questionnaire, so a change in between
+        # can't be sent with an older ETag.
+        version = await get_questionnaire_version(questner_id)
+
+        if version is None:
+            return {'message': "The Questionnaire with the given ID could not be found."}, 400
+
+        # If the client already has this version, don't run the pipelines at all.
+        etag = make_etag(questner_id, version, projection_tag(projection, Questionnaire.projection_schema.INCLUDE))
+        response = not_modified(etag)
+
+        if response is not None:
+            return response
+
+        questionnaire = await get_questionnaire(questner_id, **projection)
+
+        if questionnaire is not None:
+            return with_etag(json_response(questionnaire), etag)
+
+        else:
+            return {'message': "The Questionnaire with the given ID could not be found."}, 400
+
+    @staticmethod
+    async def list_questionnaires():
+        try:
+            pagination = Questionnaire.pagination_schema.load(request.args)
+            projection = Questionnaire.projection_schema.load(request.args)
+        except ValidationError as error:
+            return {'message': error.messages}, 400
+
+        projection['summary'] = pagination.get('view') == 'summary'
+
+        limit = min(
+            pagination.get('limit', current_app.config['QUEST_PAGE_SIZE']),
+            current_app.config['QUEST_MAX_PAGE_SIZE']
+        )
+
+        questionnaires, next_cursor = await get_questionnaires(limit, pagination.get('after'), **projection)
+
+        if not questionnaires and pagination.get('after') is None:
+            return {'message': "There aren't any Questionnaires available from this user."}
+
+        return json_response({
+            'questionnaires': questionnaires,
+            'next': next_cursor
+        })
+
+    @token_required
+    async def delete(self, questner_id):
+        result = await delete_questionnaire(questner_id)
+
+        if result is None:
+            return {'message': "The Questionnaire with the given ID could not be found."}, 400
+
+        return result
+
+
+class Question(MethodView):
+
+    question_schema = QuestionSchema()
+    projection_schema = QuestionProjectionSchema()
+
+    @token_required
+    async def post(self):
+        validated_data = Question.question_schema.load(await request.get_json())
+
+        result = await create_question(**validated_data)
+
+        if type(result) is not dict:
+            if result.acknowledged is True and result.inserted_id is not None:
+                return {'message': "Question created successfully.",
+                        'id': str(result.inserted_id)
+                        }, 201
+
+            else:
+                return {'message': "An error happened while saving the new question in the database."}, 400
+
+        else:
+            return result, 404
+
+    @token_required
+    async def get(self, question_id):
+        try:
+            projection = Question.projection_schema.load(request.args)
+        except ValidationError as error:
+            return {'message': error.messages}, 400
+
+        version = await get_question_version(question_id)
+
+        if version is None:
+            return {'message': "The Question with the given ID does not exist."}, 400
+
+        etag = make_etag(question_id, version, projection_tag(projection, Question.projection_schema.INCLUDE))
+        response = not_modified(etag)
+
+        if response is not None:
+            return response
+
+        question = await get_question(question_id, **projection)
+
+        if question is not None:
+            return with_etag(json_response(question), etag)
+
+        else:
+            return {'message': "The Question with the given ID does not exist."}, 400
+
+    @token_required
+    async def delete(self, question_id):
+        result = await delete_question(question_id)
+
+        if result.acknowledged and result.deleted_count == 1:
+            return {'message': "The Question was successfully deleted.",
+                    'id': question_id}
+
+        else:
+            return {'message': "The Question with the given ID could not be deleted."}
+
+
+class Answer(MethodView):
+
+    answer_schema = AnswerSchema()
+
+    @token_required
+    async def post(self):
+        validated_data = Answer.answer_schema.load(await request.get_json())
+
+        try:
+            result = await create_answer(**validated_data)
+        except ValidationError as error:
+            return {'message': error.messages}, 400
+
+        if type(result) is not dict:
+            if result.acknowledged is True and result.inserted_id is not None:
+                return {'message': "Answer created successfully.",
+                        'id': str(result.inserted_id)
+                        }, 201
+
+            else:
+                return {'message': "An error happened while saving the new answer in the database."}, 400
+
+        else:
+            return result, 404
+
+    @token_required
+    async def get(self, answer_id):
+        answer = await get_answer(answer_id)
+
+        if answer is not None:
+            return {
+                '_id': str(answer.get('_id')),
+                'question_id': str(answer.get('question_id')),
+                'value': answer.get('value')
+            }
+
+        else:
+            return {'message': "The Answer with the given ID does not exist."}, 400
+
+    @token_required
+    async def delete(self, answer_id):
+        result = await delete_answer(answer_id)
+
+        if result.acknowledged and result.deleted_count == 1:
+            return {'message': "The Answer was successfully deleted.",
+                    'id': answer_id}
+
+        else:
+            return {'message': "The Answer with the given ID could not be deleted."}
@@ -0,0 +1,195 @@
+import json
+
+import click
+from flask.cli import AppGroup
+from marshmallow import ValidationError
+
+from app.db import (
+    backfill_owners, embed_questions, get_db, get_db_name, get_purge_progress, import_questionnaires, migrate_sessions,
+    purge_deleted_questionnaires, rebuild_question_stats, recount_questionnaires
+)
+from app.indexes import ensure_indexes, index_drift
+from app.schemas.questionnaire_schema import QuestionnaireImportSchema
+
+
+# Commands to manage the indexes of the database.
+# Usage: flask indexes ensure | flask indexes verify
+indexes_cli = AppGroup('indexes', help='Manage the indexes of the database.')
+
+
+@indexes_cli.command('ensure')
+def ensure_indexes_command():
+    """
+    Create the declared indexes that don't exist yet.
+    """
+
+    created = ensure_indexes(get_db()[get_db_name()])
+
+    for collection, names in created.items():
+        click.echo('{}: {}'.format(collection, ', '.join(names)))
+
+
+@indexes_cli.command('verify')
+def verify_indexes_command():
+    """
+    Report the differences between the declared indexes and the database.
+    """
+
+    drift = index_drift(get_db()[get_db_name()])
+
+    # Nothing to report, the database matches the declared indexes.
+    if not drift:
+        click.echo('All indexes are in place.')
+        return
+
+    for collection, report in drift.items():
+        for kind, names in report.items():
+            for name in names:
+                click.echo('{}: {} index "{}"'.format(collection, kind, name))
+
+    # Exit with an error so the command can be used in scripts.
+    raise SystemExit(1)
+
+
+# Commands to manage the questionnaires.
+# Usage: flask questionnaires import FILE --user USERNAME | flask questionnaires purge | flask questionnaires purge-status
+#        flask questionnaires rebuild-stats
+questionnaires_cli = AppGroup('questionnaires', help='Manage the questionnaires.')
+
+
+@questionnaires_cli.command('import')
+@click.argument('file', type=click.File('r'))
+@click.option('--user', 'username', required=True, help='Username of the owner of the questionnaires.')
+@click.option('--batch-size', default=500, show_default=True, help='Questionnaires saved per insert.')
+def import_questionnaires_command(file, username, batch_size):
+    """
+    Import the questionnaires defined in a JSON file.
+
+    The file contains a questionnaire, or a list of questionnaires, with their
+    "title" and the list of their "questions".
+    """
+
+    data = json.load(file)
+
+    if not isinstance(data, list):
+        data = [data]
+
+    # Validate all the questionnaires before saving any of them.
+    try:
+        questionnaires = QuestionnaireImportSchema().load(data, many=True)
+    except ValidationError as error:
+        click.echo('Invalid questionnaires: {}'.format(error.messages), err=True)
+        raise SystemExit(1)
+
+    # Save the questionnaires in batches.
+    imported = 0
+    for start in range(0, len(questionnaires), batch_size):
+        imported += len(import_questionnaires(username, questionnaires[start:start + batch_size]))
+
+    click.echo('Imported {} questionnaires.'.format(imported))
+
+
+@questionnaires_cli.command('purge')
+@click.option('--batch-size', default=1000, show_default=True, help='Questions or answers deleted per batch.')
+@click.option('--limit', type=int, default=None, help='Maximum number of questionnaires to purge.')
+def purge_questionnaires_command(batch_size, limit):
+    """
+    Remove the deleted questionnaires and their questions and answers.
+    """
+
+    purged = purge_deleted_questionnaires(batch_size, limit)
+
+    click.echo('Purged {} questionnaires.'.format(purged))
+
+
+@questionnaires_cli.command('purge-status')
+def purge_status_command():
+    """
+    List the deleted questionnaires that haven't been purged yet.
+    """
+
+    for questionnaire in get_purge_progress():
+        purge = questionnaire.get('purge', {})
+        click.echo('{} deleted at {}: {} answers and {} questions purged{}'.format(
+            questionnaire['_id'],
+            questionnaire.get('deleted_at'),
+            purge.get('answers', 0),
+            purge.get('questions', 0),
+            ', leased until {}'.format(purge['lease_until']) if 'lease_until' in purge else ''
+        ))
+
+
+@questionnaires_cli.command('rebuild-stats')
+@click.option('--batch-size', default=500, show_default=True, help='Questions rebuilt per write.')
+def rebuild_stats_command(batch_size):
+    """
+    Recompute the statistics of every question from its answers.
+
+    Run it once after upgrading, and whenever the statistics have to be recomputed from scratch.
+    """
+
+    rebuilt = rebuild_question_stats(batch_size)
+
+    click.echo('Rebuilt the statistics of {} questions.'.format(rebuilt))
+
+
+# Commands to migrate the data stored in the database.
+# Usage: flask migrate embed-questions | flask migrate sessions | flask migrate owners | flask migrate counters
+migrate_cli = AppGroup('migrate', help='Migrate the data stored in the database.')
+
+
+@migrate_cli.command('embed-questions')
+@click.option('--batch-size', default=500, show_default=True, help='Questionnaires updated per write.')
+def embed_questions_command(batch_size):
+    """
+    Embed the questions of every questionnaire in the questionnaire itself.
+
+    Run it before enabling QUEST_EMBEDDED_QUESTIONS.
+    """
+
+    migrated = embed_questions(batch_size)
+
+    click.echo('Embedded the questions of {} questionnaires.'.format(migrated))
+
+
+@migrate_cli.command('sessions')
+@click.option('--batch-size', default=500, show_default=True, help='Users migrated per write.')
+def migrate_sessions_command(batch_size):
+    """
+    Move the Refresh Tokens stored in the users into the sessions collection.
+
+    Run "flask indexes ensure" first, so the sessions expire.
+    """
+
+    users, sessions = migrate_sessions(batch_size)
+
+    click.echo('Moved {} sessions from {} users.'.format(sessions, users))
+
+
+@migrate_cli.command('owners')
+@click.option('--batch-size', default=500, show_default=True, help='Questionnaires updated per write.')
+def backfill_owners_command(batch_size):
+    """
+    Store the owner of every questionnaire in its questions and answers.
+
+    Run it once after upgrading: questions and answers without an owner can't be deleted.
+    """
+
+    questions, answers = backfill_owners(batch_size)
+
+    click.echo('Set the owner of {} questions and {} answers.'.format(questions, answers))
+
+
+@migrate_cli.command('counters')
+@click.option('--batch-size', default=500, show_default=True, help='Questionnaires updated per write.')
+def recount_questionnaires_command(batch_size):
+    """
+    Set the number of questions and answers stored in every questionnaire.
+
+    Run it once after upgrading, after "flask migrate owners": the summaries of the
+    questionnaires created before show 0 questions and answers until then.
+    """
+
+    updated = recount_questionnaires(batch_size)
+
+    click.echo('Updated the counters of {} questionnaires.'.format(updated))
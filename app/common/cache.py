@@ -0,0 +1,423 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import bson
+
+
+# Query of the generation of a SharedCache, which is 0 until the first invalidation.
+_GENERATION = 'SELECT COALESCE(MAX(value), 0) FROM generation WHERE id = 0'
+
+
+class TTLCache:
+    """
+    In-process LRU cache with a time to live for every entry.
+
+    It is safe to use from several threads, and keeps hit and miss
+    counters that can be read with stats().
+
+    Every invalidation increases its 'generation'. A value read from the
+    database after lease() is only stored by set() if there hasn't been any
+    invalidation in between, so a slow reader can't store a value that has
+    already been invalidated.
+    """
+
+    def __init__(self, maxsize=1024, ttl=5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize=None, ttl=None):
+        """
+        Method to change the size limit and/or the time to live. It clears the cache.
+        """
+
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self._entries.clear()
+            self.generation += 1
+
+    def lease(self):
+        """
+        Method to return the current generation, to be passed to set().
+        """
+
+        with self._lock:
+            return self.generation
+
+    def get(self, key, default=None):
+        """
+        Method to return the value stored with the given 'key', or 'default'
+        if there isn't one or it has expired.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            # The entry exists and hasn't expired: mark it as recently used.
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            # The entry has expired, remove it.
+            if entry is not None:
+                del self._entries[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value, lease=None):
+        """
+        Method to store the given 'value' with the given 'key'.
+
+        If a 'lease' is given, the value is only stored if there hasn't been
+        any invalidation since it was taken.
+        """
+
+        # A cache with no size or no time to live is disabled.
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+
+        with self._lock:
+            if lease is not None and lease != self.generation:
+                return
+
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            # Evict the least recently used entries over the size limit.
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Method to remove the entry stored with the given 'key', if any.
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self.generation += 1
+
+    def clear(self):
+        """
+        Method to remove all the entries.
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        """
+        Method to return the hit and miss counters and the current size.
+        """
+
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+class SharedCache:
+    """
+    Cache with a time to live for every entry, stored in a SQLite file that is
+    shared by all the processes of a host (e.g. the uWSGI workers). Put the file
+    in a memory-backed file system, like "/dev/shm".
+
+    The values are bytes. An error of the file while reading or storing a value
+    is treated as a miss, so it can't break a request. An invalidation is tried
+    again while the file is locked, and raises the error if it still fails,
+    since a stale entry would be served until it expires. The cache is disabled
+    until it has a 'path'.
+
+    Like in TTLCache, every invalidation increases a generation stored in the
+    file, and set() only stores a value if the generation is still the one
+    returned by lease() before the value was read from the database.
+    """
+
+    # Expired entries are removed every 'PURGE_EVERY' writes.
+    PURGE_EVERY = 1000
+
+    # Attempts of an invalidation, and seconds to wait after the first failed one.
+    INVALIDATE_ATTEMPTS = 5
+    INVALIDATE_BACKOFF = 0.01
+
+    def __init__(self, path=None, ttl=60.0):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._writes = 0
+        self._local = threading.local()
+
+    def configure(self, path=None, ttl=None):
+        """
+        Method to change the file and/or the time to live. An empty 'path' disables the cache.
+        """
+
+        if path is not None:
+            self.path = path or None
+        if ttl is not None:
+            self.ttl = ttl
+
+        # Make the threads open a new connection.
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        return self.path is not None and self.ttl > 0
+
+    def _connection(self):
+        """
+        Method to return the connection of the current thread, opened on first
+        use and again if the process has been forked.
+        """
+
+        local = self._local
+
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=0.05, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, expires REAL, value BLOB)')
+            connection.execute('CREATE TABLE IF NOT EXISTS generation (id INTEGER PRIMARY KEY, value INTEGER)')
+
+            local.connection = connection
+            local.pid = os.getpid()
+
+        return local.connection
+
+    def lease(self):
+        """
+        Method to return the current generation, to be passed to set(), or None
+        if it can't be read, in which case set() doesn't store anything.
+        """
+
+        if not self.enabled:
+            return None
+
+        try:
+            return self._connection().execute(_GENERATION).fetchone()[0]
+        except sqlite3.Error:
+            self.errors += 1
+            return None
+
+    def get(self, key, default=None):
+        """
+        Method to return the value stored with the given 'key', or 'default'
+        if there isn't one or it has expired.
+        """
+
+        if not self.enabled:
+            return default
+
+        try:
+            row = self._connection().execute('SELECT expires, value FROM entries WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error:
+            self.errors += 1
+            return default
+
+        if row is not None and row[0] > time.time():
+            self.hits += 1
+            return row[1]
+
+        self.misses += 1
+        return default
+
+    def set(self, key, value, lease):
+        """
+        Method to store the given 'value' with the given 'key', only if there
+        hasn't been any invalidation since the 'lease' was taken.
+        """
+
+        if not self.enabled or lease is None:
+            return
+
+        try:
+            connection = self._connection()
+
+            # Compare and set, in a single statement.
+            connection.execute(
+                'INSERT OR REPLACE INTO entries (key, expires, value) '
+                'SELECT ?, ?, ? WHERE ({}) = ?'.format(_GENERATION),
+                (key, time.time() + self.ttl, value, lease)
+            )
+
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                connection.execute('DELETE FROM entries WHERE expires <= ?', (time.time(),))
+
+        except sqlite3.Error:
+            self.errors += 1
+
+    def invalidate(self, *keys):
+        """
+        Method to remove the entries stored with the given 'keys', if any, and
+        increase the generation.
+
+        Raises sqlite3.Error if the file is still locked after every attempt.
+        """
+
+        if not self.enabled or not keys:
+            return
+
+        self._invalidate('DELETE FROM entries WHERE key IN ({})'.format(', '.join('?' * len(keys))), keys)
+
+    def clear(self):
+        """
+        Method to remove all the entries, and increase the generation.
+
+        Raises sqlite3.Error if the file is still locked after every attempt.
+        """
+
+        if not self.enabled:
+            return
+
+        self._invalidate('DELETE FROM entries', ())
+
+    def _invalidate(self, statement, parameters):
+        """
+        Method to run the given DELETE 'statement' and increase the generation
+        in a single transaction, trying again while the file is locked.
+        """
+
+        for attempt in range(self.INVALIDATE_ATTEMPTS):
+            try:
+                connection = self._connection()
+                connection.execute('BEGIN IMMEDIATE')
+
+                try:
+                    connection.execute('INSERT OR REPLACE INTO generation (id, value) SELECT 0, ({}) + 1'.format(_GENERATION))
+                    connection.execute(statement, parameters)
+                    connection.execute('COMMIT')
+                except sqlite3.Error:
+                    connection.execute('ROLLBACK')
+                    raise
+
+                return
+
+            except sqlite3.Error:
+                self.errors += 1
+
+                if attempt == self.INVALIDATE_ATTEMPTS - 1:
+                    raise
+
+                time.sleep(self.INVALIDATE_BACKOFF * 2 ** attempt)
+
+    def stats(self):
+        """
+        Method to return the hit, miss and error counters and the current size.
+        """
+
+        size = 0
+        if self.enabled:
+            try:
+                size = self._connection().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            except sqlite3.Error:
+                self.errors += 1
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'size': size,
+            'maxsize': None,
+        }
+
+
+class TwoTierCache:
+    """
+    Cache of documents with an in-process LRU (TTLCache) in front of an
+    optional SharedCache.
+
+    The documents are stored BSON-encoded in both tiers, so every get()
+    returns a new copy that the caller is free to change.
+
+    A document read from the database after a miss is stored with the lease()
+    taken before reading it, so it is dropped if any invalidation happened in
+    the meantime, instead of bringing back the value that was invalidated.
+    """
+
+    def __init__(self, maxsize=4096, ttl=2.0, shared_path=None, shared_ttl=60.0):
+        self.local = TTLCache(maxsize, ttl)
+        self.shared = SharedCache(shared_path, shared_ttl)
+
+    def configure(self, maxsize=None, ttl=None, shared_path=None, shared_ttl=None):
+        """
+        Method to change the parameters of both tiers. It clears the in-process tier.
+        """
+
+        self.local.configure(maxsize, ttl)
+        self.shared.configure(shared_path, shared_ttl)
+
+    def get(self, key):
+        """
+        Method to return the document stored with the given 'key', or None.
+        """
+
+        lease = self.local.lease()
+        value = self.local.get(key)
+
+        # Look in the shared tier, and keep what is found in this process,
+        # unless it has been invalidated in the meantime.
+        if value is None:
+            value = self.shared.get(key)
+
+            if value is not None:
+                self.local.set(key, value, lease)
+
+        return bson.decode(value) if value is not None else None
+
+    def lease(self):
+        """
+        Method to return the lease of both tiers, to be taken before reading
+        from the database a document that will be passed to set().
+        """
+
+        return self.local.lease(), self.shared.lease()
+
+    def set(self, key, document, lease):
+        """
+        Method to store the given 'document' with the given 'key' in both tiers,
+        in each one only if it hasn't had any invalidation since the 'lease'.
+        """
+
+        value = bson.encode(document)
+
+        self.local.set(key, value, lease[0])
+        self.shared.set(key, value, lease[1])
+
+    def invalidate(self, *keys):
+        """
+        Method to remove the entries stored with the given 'keys' from both tiers.
+
+        The in-process tier of the other processes keeps its entries until they
+        expire. Raises sqlite3.Error if the shared tier can't be changed.
+        """
+
+        for key in keys:
+            self.local.invalidate(key)
+
+        self.shared.invalidate(*keys)
+
+    def clear(self):
+        """
+        Method to remove all the entries from both tiers.
+        """
+
+        self.local.clear()
+        self.shared.clear()
@@ -0,0 +1,56 @@
+import json
+from collections.abc import Mapping
+from datetime import date, datetime
+
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from flask import Response
+
+class ResponseEncoder(json.JSONEncoder):
+    """
+    JSON encoder for documents read from MongoDB.
+
+    It converts the BSON types directly while encoding, so the documents can be
+    written to the response in a single pass instead of being encoded, parsed
+    back and encoded again by flask-restx.
+    """
+
+    def __init__(self, **kwargs):
+        # Compact output and no circular reference checks: the documents come
+        # from the database, so they can't reference themselves.
+        kwargs.setdefault('separators', (',', ':'))
+        kwargs.setdefault('check_circular', False)
+        super().__init__(**kwargs)
+
+    def default(self, o):
+        if isinstance(o, ObjectId):
+            return str(o)
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        if isinstance(o, Decimal128):
+            return str(o)
+        # Any other mapping (e.g. SON) is converted one level at a time.
+        if isinstance(o, Mapping):
+            return dict(o)
+        return super().default(o)
+
+
+# Shared encoder instance, it doesn't keep any state between calls.
+response_encoder = ResponseEncoder()
+
+
+def encode_response(document) -> bytes:
+    """
+    Function to encode the given 'document' (or list of documents) as JSON bytes.
+    """
+
+    return response_encoder.encode(document).encode('utf-8')
+
+
+def json_response(document, status=200, headers=None):
+    """
+    Function to create a JSON response with the given 'document', encoded in
+    a single pass and written straight into the response body.
+    """
+
+    return Response(encode_response(document), status=status, headers=headers, mimetype='application/json')
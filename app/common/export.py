@@ -0,0 +1,171 @@
+import csv
+import io
+import json
+from itertools import islice
+
+# Parquet export is only available if pyarrow is installed.
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Export formats and their media types.
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def parquet_available():
+    """
+    Function to check if the Parquet export can be used.
+    """
+
+    return pa is not None
+
+
+def answer_columns(questions):
+    """
+    Function to get the names of the columns of an export: the ID of the answer,
+    followed by one column per question, named after its text with a "q:" prefix,
+    so no question can have the name of the answer ID column.
+
+    Questions with the same text get their ID added to the name.
+    """
+
+    texts = [question.get('text') for question in questions]
+
+    columns = ['answer_id']
+    for question, text in zip(questions, texts):
+        if texts.count(text) > 1:
+            text = '{} ({})'.format(text, question.get('_id'))
+        columns.append('q:{}'.format(text))
+
+    return columns
+
+
+def answer_rows(questions, answers):
+    """
+    Function to turn every answer into a row with one value per column, where
+    only the column of the answer's question has a value.
+    """
+
+    # Position of the column of every question (the first column is the answer ID).
+    positions = {question.get('_id'): index + 1 for index, question in enumerate(questions)}
+    width = len(questions) + 1
+
+    for answer in answers:
+        row = [None] * width
+        row[0] = str(answer.get('_id'))
+        row[positions[answer.get('question_id')]] = _format_value(answer.get('value'))
+        yield row
+
+
+def _format_value(value):
+    """
+    Function to format an answer's value as text. Lists and objects are written as JSON.
+    """
+
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+def _batches(rows, size):
+    """
+    Function to group the given 'rows' in lists of 'size' rows.
+    """
+
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def csv_stream(columns, rows, batch_size):
+    """
+    Function to write the given 'rows' as CSV, yielding the text of
+    'batch_size' rows at a time.
+    """
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(columns)
+
+    for batch in _batches(rows, batch_size):
+        writer.writerows(batch)
+
+        # Send what has been written so far and empty the buffer.
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # The header, if there weren't any rows.
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ChunkSink:
+    """
+    Write-only file object that keeps what has been written until it is drained.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def parquet_stream(columns, rows, row_group_size):
+    """
+    Function to write the given 'rows' as Parquet, one row group of
+    'row_group_size' rows at a time, yielding the bytes of every row group
+    as soon as it is written.
+    """
+
+    # Every column is written as text, since answers can have any type.
+    schema = pa.schema([pa.field(name, pa.string()) for name in columns])
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+
+    try:
+        for batch in _batches(rows, row_group_size):
+            table = pa.Table.from_pydict(
+                {name: [row[index] for row in batch] for index, name in enumerate(columns)},
+                schema=schema
+            )
+            writer.write_table(table, row_group_size=row_group_size)
+            yield sink.drain()
+
+    finally:
+        # Write the footer of the file.
+        writer.close()
+
+    yield sink.drain()
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingOverloaded(Exception):
+    """
+    Raised when the password hashing queue is full.
+
+    'retry_after' is the number of seconds the client should wait before retrying.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__('The password hashing queue is full.')
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords in the thread that serves the request, and sheds
+    the load of the CPU-expensive hashing when too many arrive at the same time.
+
+    At most 'workers' passwords are hashed at the same time (no limit with 0),
+    and at most 'queue_depth' more wait for their turn. Any other request is
+    rejected right away with HashingOverloaded.
+
+    The coroutine versions hash in the default executor of the event loop, so
+    they don't block it.
+    """
+
+    def __init__(self, workers=2, queue_depth=16, method='pbkdf2:sha256', salt_length=16, retry_after=1):
+        self._lock = threading.Lock()
+        self.configure(workers, queue_depth, method, salt_length, retry_after)
+
+    def configure(self, workers=None, queue_depth=None, method=None, salt_length=None, retry_after=None):
+        """
+        Method to change the limits and the parameters of the hashes.
+        """
+
+        with self._lock:
+            if workers is not None:
+                self.workers = workers
+            if queue_depth is not None:
+                self.queue_depth = queue_depth
+            if method is not None:
+                self.method = method
+            if salt_length is not None:
+                self.salt_length = salt_length
+            if retry_after is not None:
+                self.retry_after = retry_after
+
+            self._slots = threading.BoundedSemaphore(max(self.workers, 1) + self.queue_depth)
+            self._running = threading.BoundedSemaphore(self.workers) if self.workers > 0 else None
+
+    def _acquire(self):
+        """
+        Method to take a slot of the queue, and return the semaphores to pass to _run().
+
+        Raises HashingOverloaded if the queue is full.
+        """
+
+        slots, running = self._slots, self._running
+
+        if not slots.acquire(blocking=False):
+            raise HashingOverloaded(self.retry_after)
+
+        return slots, running
+
+    @staticmethod
+    def _run(semaphores, function, *args):
+        """
+        Method to run the given 'function' once it's its turn, and free its slot.
+        """
+
+        slots, running = semaphores
+
+        try:
+            if running is None:
+                return function(*args)
+
+            with running:
+                return function(*args)
+        finally:
+            slots.release()
+
+    def hash_password(self, password):
+        """
+        Method to hash the given 'password' with the configured method and salt length.
+
+        Raises HashingOverloaded if the queue is full.
+        """
+
+        return self._run(self._acquire(), generate_password_hash, password, self.method, self.salt_length)
+
+    def check_password(self, pwhash, password):
+        """
+        Method to check the given 'password' against the given 'pwhash'.
+
+        Raises HashingOverloaded if the queue is full.
+        """
+
+        return self._run(self._acquire(), check_password_hash, pwhash, password)
+
+    async def hash_password_async(self, password):
+        """
+        Coroutine version of hash_password(), that doesn't block the event loop.
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._run, self._acquire(), generate_password_hash, password, self.method, self.salt_length
+        )
+
+    async def check_password_async(self, pwhash, password):
+        """
+        Coroutine version of check_password(), that doesn't block the event loop.
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._run, self._acquire(), check_password_hash, pwhash, password
+        )
+
+
+# Hasher used to hash and check the users' passwords.
+# It is configured with the "PASSWORD_HASH_*" settings in create_app().
+password_hasher = PasswordHasher()
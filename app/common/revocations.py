@@ -0,0 +1,109 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Longest lifetime of an Access Token. A revocation is useless after that
+# time, since every token it could reject has expired.
+ACCESS_TOKEN_MAX_LIFETIME = timedelta(minutes=15)
+
+
+class RevocationList:
+    """
+    In-memory copy of the "revocations" collection: the time at which all the
+    Access Tokens of a user were revoked, keyed by username.
+
+    The copy is reloaded at most once every 'interval' seconds, by the first
+    request that checks a token after that time, so checking a token doesn't
+    read the database. A revocation made by another process is seen at most
+    'interval' seconds later.
+    """
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self._revoked = {}
+        self._next_sync = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, interval=None):
+        """
+        Method to change the sync interval. The list is reloaded on the next check.
+        """
+
+        with self._lock:
+            if interval is not None:
+                self.interval = interval
+            self._next_sync = 0.0
+
+    def needs_sync(self):
+        """
+        Method to check if the list has to be reloaded.
+
+        Only the first caller after the interval gets True, the other requests
+        keep using the current list while it is being reloaded.
+        """
+
+        now = time.monotonic()
+
+        with self._lock:
+            if now < self._next_sync:
+                return False
+
+            self._next_sync = now + self.interval
+            return True
+
+    def update(self, revocations):
+        """
+        Method to replace the list with the given documents of the "revocations" collection.
+        """
+
+        revoked = {revocation['_id']: revocation['revoked_at'] for revocation in revocations}
+
+        # Revocations older than this can't reject any token that hasn't expired.
+        oldest = time.time() - ACCESS_TOKEN_MAX_LIFETIME.total_seconds()
+
+        with self._lock:
+            # Keep the revocations made by this process after the documents were read.
+            for username, revoked_at in self._revoked.items():
+                if revoked_at > max(revoked.get(username, 0), oldest):
+                    revoked[username] = revoked_at
+
+            self._revoked = revoked
+
+    def revoke(self, username, revoked_at):
+        """
+        Method to add a revocation made by this process, so it applies right away.
+        """
+
+        with self._lock:
+            if revoked_at > self._revoked.get(username, 0):
+                self._revoked[username] = revoked_at
+
+    def is_revoked(self, username, issued_at):
+        """
+        Method to check if a token of the given 'username' issued at 'issued_at'
+        (a UNIX timestamp) has been revoked. Tokens without it are revoked with
+        any revocation of their user.
+        """
+
+        revoked_at = self._revoked.get(username)
+
+        if revoked_at is None:
+            return False
+
+        return issued_at is None or issued_at <= revoked_at
+
+
+def new_revocation(username, revoked_at):
+    """
+    Function to build the document of the "revocations" collection that revokes
+    all the Access Tokens of the given 'username' issued until 'revoked_at'
+    (a UNIX timestamp).
+
+    The TTL index on 'expires_at' removes it once those tokens have expired.
+    """
+
+    return {
+        '_id': username,
+        'revoked_at': revoked_at,
+        'expires_at': datetime.utcfromtimestamp(revoked_at) + ACCESS_TOKEN_MAX_LIFETIME
+    }
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+import hashlib
+
+import jwt
+
+# Lifetime of a session whose Refresh Token has no expiration.
+DEFAULT_SESSION_LIFETIME = timedelta(days=1)
+
+
+def token_hash(refresh_token):
+    """
+    Function to get the key of the session of the given 'refresh_token'.
+
+    Only the SHA-256 hash of the token is stored, so the tokens can't be
+    used by someone who can read the database.
+    """
+
+    return hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+
+
+def token_expiration(refresh_token):
+    """
+    Function to get the expiration date of the given 'refresh_token'.
+
+    The signature is not checked here: the token is always checked with
+    the Refresh Token key before the session is used.
+    """
+
+    try:
+        exp = jwt.decode(refresh_token, options={'verify_signature': False}).get('exp')
+    except jwt.InvalidTokenError:
+        exp = None
+
+    if exp is None:
+        return datetime.utcnow() + DEFAULT_SESSION_LIFETIME
+
+    return datetime.utcfromtimestamp(exp)
+
+
+def session_filter(refresh_token):
+    """
+    Function to build the filter that finds the session of the given 'refresh_token'.
+
+    The current token of a session is in its 'token'. Sessions saved before the
+    tokens were rotated in place only have the hash of their token as their '_id'.
+    """
+
+    key = token_hash(refresh_token)
+
+    return {'$or': [{'token': key}, {'_id': key, 'token': {'$exists': False}}]}
+
+
+def rotation_update(new_refresh_token):
+    """
+    Function to build the update that replaces the token of a session with the
+    given 'new_refresh_token', which also moves the expiration of the session.
+    """
+
+    return {
+        '$set': {
+            'token': token_hash(new_refresh_token),
+            'expires_at': token_expiration(new_refresh_token),
+            'rotated_at': datetime.utcnow()
+        }
+    }
+
+
+def new_session(username, user_id, refresh_token):
+    """
+    Function to build the document of a new session of the "sessions" collection.
+
+    The '_id' of the session never changes, its 'token' is replaced every time
+    the Refresh Token is rotated. The TTL index on 'expires_at' removes the
+    session once the token expires.
+    """
+
+    return {
+        '_id': token_hash(refresh_token),
+        'token': token_hash(refresh_token),
+        'username': username,
+        'user_id': user_id,
+        'expires_at': token_expiration(refresh_token),
+        'created_at': datetime.utcnow()
+    }
@@ -0,0 +1,192 @@
+import math
+from collections import Counter
+
+from pymongo import UpdateOne
+
+# Types of Questions whose Answers are counted by option, and the ones whose
+# Answers are summarized as numbers.
+CHOICE_TYPES = ('one_of', 'many_of', 'list')
+NUMBER_TYPES = ('int', 'float')
+
+# Characters that can't be used in the keys of the 'options' subdocument,
+# replaced by their percent-encoding. "%" goes first so it can be decoded.
+_ESCAPES = (('%', '%25'), ('.', '%2E'), ('$', '%24'), ('\0', '%00'))
+
+# Key of the empty option, which can't be a field name. A lone "%" is never
+# the result of the percent-encoding.
+_EMPTY_KEY = '%'
+
+
+def option_key(value):
+    """
+    Function to turn an option into a key of the 'options' subdocument.
+    """
+
+    key = str(value)
+
+    if not key:
+        return _EMPTY_KEY
+
+    for character, escaped in _ESCAPES:
+        key = key.replace(character, escaped)
+
+    return key
+
+
+def option_value(key):
+    """
+    Function to get back the option of a key of the 'options' subdocument.
+    """
+
+    if key == _EMPTY_KEY:
+        return ''
+
+    for character, escaped in reversed(_ESCAPES):
+        key = key.replace(escaped, character)
+
+    return key
+
+
+def _values(value):
+    # A 'many_of' or 'list' Answer counts once for every option it has.
+    return Counter(option_key(item) for item in (value if isinstance(value, list) else [value]) if item is not None)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def stats_operations(questionnaire_id, question, value, sign=1):
+    """
+    Function to build the updates of the "question_stats" document of the given
+    'question' when an Answer with the given 'value' is added (sign 1) or
+    removed (sign -1).
+
+    Every Answer is counted in 'count'. The Answers of choice Questions are also
+    counted by option in 'options', and the ones of number Questions are added
+    to 'sum', 'sum_squares', 'min' and 'max'. The minimum and maximum can't be
+    undone, so removing an Answer equal to one of them marks the document as
+    'stale' until it is rebuilt. Every change increases the 'generation' of the
+    document, so a rebuild can tell if it has been changed in the meantime.
+
+    Returns a list of UpdateOne operations.
+    """
+
+    question_type = question.get('type')
+
+    inc = {'count': sign, 'generation': 1}
+    update = {'$inc': inc}
+
+    if question_type in CHOICE_TYPES:
+        for key, count in _values(value).items():
+            inc['options.' + key] = sign * count
+
+    elif question_type in NUMBER_TYPES and _is_number(value):
+        inc['sum'] = sign * value
+        inc['sum_squares'] = sign * value * value
+
+        if sign > 0:
+            update['$min'] = {'min': value}
+            update['$max'] = {'max': value}
+
+    # An Answer added creates the document if needed. An Answer removed from a
+    # document that doesn't exist yet can only be accounted for by a rebuild.
+    if sign > 0:
+        update['$setOnInsert'] = {'questionnaire_id': questionnaire_id}
+        return [UpdateOne({'_id': question.get('_id')}, update, upsert=True)]
+
+    operations = [UpdateOne({'_id': question.get('_id')}, update)]
+
+    if question_type in NUMBER_TYPES and _is_number(value):
+        operations.append(UpdateOne(
+            {'_id': question.get('_id'), '$or': [{'min': {'$gte': value}}, {'max': {'$lte': value}}]},
+            {'$set': {'stale': True}}
+        ))
+
+    return operations
+
+
+def new_question_stats(questionnaire_id, question, values):
+    """
+    Function to build the "question_stats" document of the given 'question'
+    from scratch, with the 'values' of all its Answers.
+    """
+
+    question_type = question.get('type')
+
+    stats = {
+        '_id': question.get('_id'),
+        'questionnaire_id': questionnaire_id,
+        'count': 0
+    }
+
+    options = Counter()
+    numbers = []
+
+    for value in values:
+        stats['count'] += 1
+
+        if question_type in CHOICE_TYPES:
+            options.update(_values(value))
+
+        elif question_type in NUMBER_TYPES and _is_number(value):
+            numbers.append(value)
+
+    if question_type in CHOICE_TYPES:
+        stats['options'] = dict(options)
+
+    elif question_type in NUMBER_TYPES:
+        stats['sum'] = sum(numbers)
+        stats['sum_squares'] = sum(number * number for number in numbers)
+
+        if numbers:
+            stats['min'] = min(numbers)
+            stats['max'] = max(numbers)
+
+    return stats
+
+
+def question_stats_result(question, stats):
+    """
+    Function to build the statistics of the given 'question' returned to the
+    client, from its "question_stats" document ('stats', None if it has no Answers).
+    """
+
+    stats = stats or {}
+    question_type = question.get('type')
+
+    result = {
+        '_id': question.get('_id'),
+        'text': question.get('text'),
+        'type': question.get('type'),
+        'count': stats.get('count', 0)
+    }
+
+    if question_type in CHOICE_TYPES:
+        counts = {option_value(key): count for key, count in (stats.get('options') or {}).items() if count > 0}
+
+        # Every option of the Question, in order, followed by any other value found.
+        values = list(question.get('options') or [])
+        values.extend(value for value in counts if value not in values)
+
+        result['options'] = [{'value': value, 'count': counts.get(value, 0)} for value in values]
+
+    elif question_type in NUMBER_TYPES:
+        count = stats.get('count', 0)
+        total = stats.get('sum', 0)
+
+        mean = total / count if count else None
+
+        # Population standard deviation. Rounding errors can make the variance
+        # slightly negative when all the values are equal.
+        stddev = math.sqrt(max(stats.get('sum_squares', 0) / count - mean * mean, 0)) if count else None
+
+        result.update({
+            'sum': total,
+            'mean': mean,
+            'stddev': stddev,
+            'min': stats.get('min') if count else None,
+            'max': stats.get('max') if count else None
+        })
+
+    return result
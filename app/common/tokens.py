@@ -0,0 +1,46 @@
+import secrets
+import time
+from datetime import datetime
+
+import jwt
+
+
+def encode_access_token(username, user_id, key, lifetime):
+    """
+    Function to encode an Access Token of the given user, valid for 'lifetime'
+    (a timedelta), signed with 'key'.
+
+    The 'user_id' and the exact issue time ('iat') let token_required() check
+    the token without reading the user in stateless mode.
+    """
+
+    return jwt.encode(
+        {
+            'username': username,
+            'user_id': str(user_id),
+            'iat': time.time(),
+            'exp': datetime.utcnow() + lifetime
+        },
+        key,
+        algorithm="HS256"
+    )
+
+
+def encode_refresh_token(username, key, lifetime):
+    """
+    Function to encode a Refresh Token of the given user, valid for 'lifetime'
+    (a timedelta), signed with 'key'.
+
+    Sessions are keyed by the hash of their token, so the random 'jti' makes
+    every token unique, even if the user gets two of them in the same second.
+    """
+
+    return jwt.encode(
+        {
+            'username': username,
+            'exp': datetime.utcnow() + lifetime,
+            'jti': secrets.token_hex(8)
+        },
+        key,
+        algorithm="HS256"
+    )
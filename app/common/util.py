@@ -1,9 +1,92 @@
-import json
-from typing import Any
-from bson import ObjectId
-
-class CustomEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, ObjectId):
-            return str(o)
-        return super().default(o)
\ No newline at end of file
+from flask import Response, request, stream_with_context
+
+from app.common.encoder import response_encoder
+
+# Media type of the streaming responses: one JSON document per line.
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_ndjson():
+    """
+    Function to check if the client asked for a streaming response, either
+    with the "Accept: application/x-ndjson" header or the "stream" query flag.
+    """
+
+    # The query flag takes precedence over the "Accept" header.
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return True
+
+    # "Accept: */*" will prefer the regular JSON response.
+    best_match = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+    return best_match == NDJSON_MIMETYPE
+
+
+def ndjson_response(documents):
+    """
+    Function to create a streaming response that writes the given iterable of
+    'documents' one JSON document per line, as they are produced.
+    """
+
+    def generate():
+        for document in documents:
+            yield response_encoder.encode(document).encode('utf-8') + b'\n'
+
+    # Keep the request context while streaming, since the documents
+    # may be fetched from the database as they are consumed.
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def make_etag(*parts):
+    """
+    Function to build the strong ETag of a representation from the given 'parts'
+    (e.g. the ID and the version of the document). The streaming (NDJSON) and the
+    regular JSON representations get different tags.
+    """
+
+    if wants_ndjson():
+        parts = parts + ('ndjson',)
+
+    return '-'.join(str(part) for part in parts if part is not None)
+
+
+def projection_tag(projection, default_include):
+    """
+    Function to build the part of an ETag that identifies the 'include' and
+    'fields' options of the given 'projection', so every combination gets its
+    own tag. Returns None for the default representation, whose tag doesn't change.
+    """
+
+    parts = []
+
+    if projection['include'] != frozenset(default_include):
+        parts.append('i:' + ('.'.join(sorted(projection['include'])) or 'none'))
+
+    if projection['fields'] is not None:
+        parts.append('f:' + '.'.join(sorted(projection['fields'])))
+
+    return '-'.join(parts) or None
+
+
+def not_modified(etag):
+    """
+    Function to return a "304 Not Modified" response if the client already has
+    the representation with the given 'etag', or None otherwise.
+    """
+
+    if not request.if_none_match.contains_weak(etag):
+        return None
+
+    return with_etag(Response(status=304), etag)
+
+
+def with_etag(response, etag):
+    """
+    Function to add the given 'etag' to the given 'response'.
+    """
+
+    response.set_etag(etag)
+
+    # The tag depends on the representation chosen with the "Accept" header.
+    response.vary.add('Accept')
+
+    return response
@@ -0,0 +1,141 @@
+from marshmallow import ValidationError
+from marshmallow.validate import Email
+
+from app.common.cache import TTLCache
+
+# Validator of the 'email' Questions, shared by all the compiled validators.
+_email = Email(error='Not a valid email address.')
+
+
+def _text(value):
+    if not isinstance(value, str):
+        raise ValidationError('Not a valid string.')
+    return value
+
+
+def _email_address(value):
+    return _email(_text(value))
+
+
+def _int(value):
+    # bool is a subclass of int, but True is not an answer to a number Question.
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValidationError('Not a valid integer.')
+    return value
+
+
+def _float(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValidationError('Not a valid number.')
+    return float(value)
+
+
+def _one_of(options):
+    def validate(value):
+        if _text(value) not in options:
+            raise ValidationError('Must be one of: {}.'.format(', '.join(sorted(options))))
+        return value
+
+    return validate
+
+
+def _many_of(options):
+    def validate(value):
+        if not isinstance(value, list):
+            raise ValidationError('Not a valid list.')
+
+        invalid = [item for item in value if not isinstance(item, str) or item not in options]
+        if invalid:
+            raise ValidationError('Must be any of: {}.'.format(', '.join(sorted(options))))
+
+        # Every option is only counted once.
+        return list(dict.fromkeys(value))
+
+    return validate
+
+
+def _list(options):
+    one_of = _one_of(options)
+    many_of = _many_of(options)
+
+    # A 'list' Question may be answered with one option or several of them.
+    def validate(value):
+        return many_of(value) if isinstance(value, list) else one_of(value)
+
+    return validate
+
+
+def _list_of_text(value):
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValidationError('Not a valid list of strings.')
+    return value
+
+
+def _text_or_list_of_text(value):
+    return _list_of_text(value) if isinstance(value, list) else _text(value)
+
+
+def _any(value):
+    return value
+
+
+def compile_validator(question):
+    """
+    Function to build the validator of the Answers of the given 'question'.
+
+    The validator is a function that takes the value of an Answer and returns
+    the value to store, or raises a ValidationError if the value is not valid
+    for the type and options of the Question.
+    """
+
+    question_type = question.get('type')
+
+    # A frozenset makes every option check a single lookup.
+    options = frozenset(question.get('options') or [])
+
+    if question_type == 'text':
+        return _text
+    if question_type == 'email':
+        return _email_address
+    if question_type == 'int':
+        return _int
+    if question_type == 'float':
+        return _float
+
+    # Choice Questions without options accept any string(s).
+    if question_type == 'one_of':
+        return _one_of(options) if options else _text
+    if question_type == 'many_of':
+        return _many_of(options) if options else _list_of_text
+    if question_type == 'list':
+        return _list(options) if options else _text_or_list_of_text
+
+    # Questions created before their type was validated keep accepting anything.
+    return _any
+
+
+# Compiled validators, keyed by Question ID. The type and options of a Question
+# never change, so an entry only leaves the cache when it is evicted or expires.
+# It is configured with "ANSWER_VALIDATOR_CACHE_SIZE" and "ANSWER_VALIDATOR_CACHE_TTL" in create_app().
+validator_cache = TTLCache(maxsize=4096, ttl=300)
+
+
+def validate_answer(question, value):
+    """
+    Function to validate the 'value' of an Answer to the given 'question',
+    with its compiled validator, usually from the validator cache.
+
+    Returns the value to store, or raises a ValidationError with the
+    errors under 'value', like the ones of AnswerSchema.
+    """
+
+    validator = validator_cache.get(question.get('_id'))
+
+    if validator is None:
+        validator = compile_validator(question)
+        validator_cache.set(question.get('_id'), validator)
+
+    try:
+        return validator(value)
+    except ValidationError as error:
+        raise ValidationError({'value': error.messages})
@@ -1,46 +1,116 @@
-from operator import truediv
-from turtle import update
-from click import command
+from datetime import datetime, timedelta
+import atexit
+import itertools
+import os
+import threading
+import time
+
 from flask import current_app, g
-from pymongo.read_preferences import ReadPreference
+from marshmallow import ValidationError
 from werkzeug.local import LocalProxy
-from werkzeug.security import generate_password_hash
 
-from pymongo import MongoClient
-from pymongo.read_concern import ReadConcern
-from pymongo.write_concern import WriteConcern
-from pymongo.results import DeleteResult
+from pymongo import MongoClient, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import DeleteResult, InsertOneResult
 from bson.objectid import ObjectId
 
+from app.common.cache import TTLCache, TwoTierCache
+from app.common.hashing import password_hasher
+from app.common.revocations import RevocationList, new_revocation
+from app.common.sessions import new_session, rotation_update, session_filter
+from app.common.stats import CHOICE_TYPES, new_question_stats, question_stats_result, stats_operations
+from app.common.validators import validate_answer, validator_cache
+from app.documents import (
+    CACHED_USER_PROJECTION, DEFINITION_PROJECTION, definition_cache_key, deletion_update, new_answer,
+    new_question, new_questionnaire, new_user, project_fields, question_not_found, questionnaire_not_found,
+    session_user, split_page, user_query
+)
+from app.metrics import command_listener, metrics
+from app.pipelines import (
+    INCLUDE_ALL, accepts_answers, answer_tallies_pipeline, answers_lookup, count_pipeline, counters_update, not_deleted, questionnaire_pipeline,
+    questionnaire_projection, questionnaire_summaries_pipeline, questionnaires_pipeline
+)
+
+
+# Process-wide MongoClient shared by every request handled by this worker,
+# and the PID of the process that created it.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Function to return the process-wide MongoClient.
 
-def get_db():
+    The client is created lazily on first use so that each uWSGI worker builds
+    its own connection pool after the fork. If the current process is not the
+    one that created the client (i.e. we have been forked), a new one is created.
     """
-    Configuration method to return db instance
+
+    global _client, _client_pid
+
+    # Fast path: the client already exists and belongs to this process.
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+
+    with _client_lock:
+
+        # Check again now that we hold the lock, another thread could
+        # have created the client in the meantime.
+        if _client is None or _client_pid != os.getpid():
+
+            # Get the connection and pool parameters from the config object.
+            config = current_app.config
+
+            # "connect=False" delays the server discovery until the first
+            # operation, so no background threads are started before a fork.
+            _client = MongoClient(
+                config["QUEST_DB_URI"],
+                tls=True,
+                tlsAllowInvalidCertificates=True,
+                maxPoolSize=config.get("QUEST_DB_MAX_POOL_SIZE", 100),
+                maxIdleTimeMS=config.get("QUEST_DB_MAX_IDLE_TIME_MS", 60000),
+                serverSelectionTimeoutMS=config.get("QUEST_DB_SERVER_SELECTION_TIMEOUT_MS", 5000),
+                event_listeners=[command_listener],
+                connect=False
+            )
+            _client_pid = os.getpid()
+
+    return _client
+
+
+def close_db():
+    """
+    Function to close the process-wide MongoClient, if this process owns one.
+
+    It is called when the worker shuts down.
     """
 
-    # If a database connection object has been already created, 
-    # retrieve it from the global variable "g".
-    db = getattr(g, "_database", None)
+    global _client, _client_pid
 
-    # Get the database URI from the config object.
-    QUEST_DB_URI = current_app.config["QUEST_DB_URI"]
+    with _client_lock:
+
+        # Only close the client if it was created by this process.
+        # A client inherited through a fork belongs to the parent.
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+
+        _client = None
+        _client_pid = None
+
+
+def get_db():
+    """
+    Configuration method to return db instance
+    """
 
     # Get the database name from the config object
     # and store it in the global variable "g" for later.
     g._db_name = current_app.config["QUEST_DB_NAME"]
 
-    # If there's not an existing connection to the database,
-    # create one with the configuration parameters.
-    if db is None:
-
-        db = g._database = MongoClient(
-            QUEST_DB_URI,
-            tls=True,
-            tlsAllowInvalidCertificates=True
-        )
-
-    # Return the connection to the database.
-    return db
+    # Return the connection to the database shared by the whole process.
+    return get_client()
 
 
 def get_db_name():
@@ -55,23 +125,32 @@ db = LocalProxy(get_db)
 # Use LocalProxy to get the database name with just 'db_name'.
 db_name = LocalProxy(get_db_name)
 
+# Close the client when the worker process exits. Under uWSGI the
+# "uwsgi.atexit" hook is used, since workers may skip Python's atexit.
+atexit.register(close_db)
+
+try:
+    import uwsgi
+    uwsgi.atexit = close_db
+except ImportError:
+    pass
+
 # USER MANAGEMENT
 def create_new_user(email, username, password):
     """
     Function to create a new user and save it to the database.
+
+    The password is hashed in the password hashing pool, which raises
+    HashingOverloaded if its queue is full.
     """
 
     # Build the new user to be added to the databse.
-    new_user = {
-        'username': username,
-        'email': email,
-        'password': generate_password_hash(password),
-    }
+    user = new_user(email, username, password_hasher.hash_password(password))
 
-    print("[create_new_user] Creating new user: ", new_user)
+    print("[create_new_user] Creating new user: ", user)
 
     # Save the new user in the database and return the result.
-    return db[g._db_name].users.insert_one(new_user)
+    return db[g._db_name].users.insert_one(user)
 
 
 def get_user(email=None, username=None) -> dict:
@@ -84,13 +163,7 @@ def get_user(email=None, username=None) -> dict:
     """
 
     # Build the query 'query' to be sent to the database.
-    query = {
-    '$and': 
-        [
-            {'email': email if email is not None else {'$exists': True}},
-            {'username': username if username is not None else {'$exists': True}},
-        ]
-    }
+    query = user_query(email, username)
 
     QUEST_DB_NAME = str(db_name)
 
@@ -101,49 +174,96 @@ def get_user(email=None, username=None) -> dict:
     return user
 
 
+# Cache of the users loaded by token_required(), keyed by username.
+# It is configured with "USER_CACHE_SIZE" and "USER_CACHE_TTL" in create_app().
+user_cache = TTLCache()
+metrics.register_cache('users', user_cache)
+
+
+def get_cached_user(username):
+    """
+    Function to return the user with the given 'username', from the user cache
+    if possible, or from the database otherwise.
+
+    The cached user doesn't include the password hash nor the Refresh Tokens.
+    """
+
+    # Look for the user in the cache first.
+    user = user_cache.get(username)
+
+    if user is None:
+
+        QUEST_DB_NAME = str(db_name)
+
+        # Look for the user with the given 'username', with only the fields
+        # needed to identify them, and cache it.
+        user = db[QUEST_DB_NAME].users.find_one({'username': username}, CACHED_USER_PROJECTION)
+
+        if user is not None:
+            user_cache.set(username, user)
+
+    # Return the user that was found.
+    return user
+
+
+# Access Tokens revoked by sign_out_all(), synced from the "revocations" collection.
+# It is configured with "REVOCATION_SYNC_INTERVAL" in create_app().
+revocation_list = RevocationList()
+
+
+def is_token_revoked(username, issued_at):
+    """
+    Function to check if an Access Token of the given 'username', issued at
+    'issued_at', has been revoked.
+
+    The check is done against the in-memory revocation list, which is reloaded
+    from the database at most once every "REVOCATION_SYNC_INTERVAL" seconds.
+    """
+
+    # Reload the list if it's time to, only in the request that claimed the sync.
+    if revocation_list.needs_sync():
+        revocation_list.update(db[g._db_name].revocations.find({}, {'revoked_at': 1}))
+
+    return revocation_list.is_revoked(username, issued_at)
+
+
 def get_user_with_rt(refresh_token=None):
     """
     Function to get the user to which the given 'refresh_token' belongs.
-    """
 
-    # Build the query 'query' to be sent to the database.
-    query = {
-        'refresh_tokens': {
-            '$in': [refresh_token]
-        }
-    }
+    The session is looked up by the hash of the token, and the returned user
+    only has the '_id' and the 'username' stored in the session.
+    """
 
     QUEST_DB_NAME = str(db_name)
 
-    # Look for the user with the given 'refresh_token'.
-    user = db[QUEST_DB_NAME].users.find_one(query)
+    # Look for the session of the given 'refresh_token'.
+    session = db[QUEST_DB_NAME].sessions.find_one(session_filter(refresh_token))
 
-    # Return the user that was found.
-    return user  
+    # Return the user of the session, if any.
+    return session_user(session)
 
 
 def sign_out_all(username=None):
     """
-    Function to remove all the Refresh Tokens from a user, which
+    Function to remove all the sessions from a user, which
     will cause the user to log out from all their sessions.
+
+    It also revokes the Access Tokens issued to the user until now,
+    which are checked by token_required() in stateless mode.
     """
 
     # Check if the username was provided before moving forward
     if username is not None:
 
-        # Filter to find the user that will get all their Refresh Tokens
-        # removed.
-        update_filter = {
-            'username': username
-        }
-
-        # Instruction to clear the user's Refresh Tokens
-        updated_value = {
-            '$set': {'refresh_tokens': []} 
-        }
+        # Revoke the Access Tokens, in this process right away, and in the
+        # other processes on their next sync of the revocation list.
+        revoked_at = time.time()
+        db[g._db_name].revocations.replace_one({'_id': username}, new_revocation(username, revoked_at), upsert=True)
+        revocation_list.revoke(username, revoked_at)
 
         # Send the command to the database and get the result
-        result = db[g._db_name].users.update_one(update_filter, updated_value)
+        result = db[g._db_name].sessions.delete_many({'username': username})
 
         # If the command was acknowledged by the database, return the result
         return result if result.acknowledged else None
@@ -156,18 +276,11 @@ def sign_out_session(username=None, session=None):
 
     # Confirm the requested parameters were given
     if (username is not None) and (session is not None):
-        # Filter to find the given user
-        update_filter = {
-            'username': username
-        }
-
-        # Command to remove the session
-        updated_value = {
-            '$pull': {'refresh_tokens': session}
-        }
+        # Filter to find the session of the given user
+        delete_filter = dict(session_filter(session), username=username)
 
         # Send the command to the database and get the result
-        result = db[g._db_name].users.update_one(update_filter, updated_value)
+        result = db[g._db_name].sessions.delete_one(delete_filter)
 
         # If the command was acknowledged by the database, return the result
         return result if result.acknowledged else None
@@ -176,6 +289,27 @@ def sign_out_session(username=None, session=None):
     return None
 
 
+def rotate_session(username=None, refresh_token=None, new_refresh_token=None):
+    """
+    Function to replace the given 'refresh_token' of a session of the user with
+    the given 'username' by the 'new_refresh_token', in a single operation.
+
+    Returns the user of the session, with its '_id' and 'username', or None if
+    there is no session with the given 'refresh_token': it has already been
+    rotated (the token is being reused), or the user has signed out.
+    """
+
+    # Swap the tokens only if the old one is still the current token of the session.
+    session = db[g._db_name].sessions.find_one_and_update(
+        dict(session_filter(refresh_token), username=username),
+        rotation_update(new_refresh_token),
+        {'username': 1, 'user_id': 1}
+    )
+
+    # Return the user of the session, if any.
+    return session_user(session)
+
+
 def user_exists(username=None, email=None) -> bool:
     """
     Function to return true or false if the user already exists
@@ -192,51 +326,42 @@ def user_exists(username=None, email=None) -> bool:
     return True if user else False
 
 
-def add_session(username=None, refresh_token=None):
+def add_session(username=None, refresh_token=None, user_id=None):
     """
-    Function to add a Refresh Token to the users database,
+    Function to save a new session with the given Refresh Token,
     which would be linked to a username
     """
 
-    # Filter to find the user that will get the Refresh Token
-    update_filter = {
-        'username': username
-    }
+    # Get the ID of the user, if it wasn't given.
+    if user_id is None:
+        user = db[g._db_name].users.find_one({'username': username}, {'_id': True})
 
-    # Instruction to add the Refresh Token to the user's 
-    # refresh_tokens array
-    updated_value = {
-        '$push' : {
-            'refresh_tokens': refresh_token
-        }
-    }
+        if user is None:
+            return None
+
+        user_id = user.get('_id')
 
     # Send the command to the database and get the result
-    result = db[g._db_name].users.update_one(update_filter, updated_value)
+    result = db[g._db_name].sessions.insert_one(new_session(username, user_id, refresh_token))
 
     # If the command was acknowledged by the database, return the result
     return result if result.acknowledged else None
 
 
-    """
-    Function to get all the active sessions from the given user.
-    """
-
-    # Query that will be sent to find the user
-    query = {
-        'username': username
-    }
+# Cache of the Questionnaire and Question definitions, without their Answers.
+# It is configured with the "DEFINITION_CACHE_*" settings in create_app().
+definition_cache = TwoTierCache()
+metrics.register_cache('definitions', definition_cache.local)
+metrics.register_cache('definitions_shared', definition_cache.shared)
+metrics.register_cache('validators', validator_cache)
 
-    # Filter to only return the refresh_tokens field from the database
-    projection = {
-        '_id': False,
-        'refresh_tokens': True
-    }
 
-    # Search for the Refresh Tokens from the given user
-    sessions = db[g._db_name].users.find_one(query, projection)
+def definition_key(kind, object_id):
+    """
+    Function to build the key of a definition in the definition cache.
+    """
 
-    return sessions
+    return definition_cache_key(g._db_name, kind, object_id)
 
 
 # QUESTIONNAIRE MANAGEMENT
@@ -245,132 +370,182 @@ def create_questionnaire(title, user_id):
     Function to create a new questionnaire and save it to the database.
     """
 
-    # Build the new questionnaire that will be added to the database.
-    new_quest = {
-        'title': title,
-        'user_id': user_id,
-    }
+    # Build the new questionnaire that will be added to the database,
+    # with the counters of its questions and answers.
+    new_quest = new_questionnaire(title, user_id)
 
     # Save the new questionnaire in the database and return the result.
     return db[g._db_name].questionnaires.insert_one(new_quest)
 
 
-def get_questionnaires():
+def import_questionnaires(user_id, questionnaires):
+    """
+    Function to save complete Questionnaires, with all their Questions, in the database.
+
+    'questionnaires' is a list of dictionaries with the 'title' of every Questionnaire
+    and its list of 'questions'. All the Questionnaires are saved with one ordered
+    insert and all their Questions with another one. If any of them can't be saved,
+    the ones already saved are deleted, so nothing is imported.
+
+    Returns a list with the ID of every new Questionnaire, in the same order, or
+    an error with the index and the reason of every Questionnaire that failed.
+    """
+
+    QUEST_DB_NAME = str(db_name)
+
+    # Build the new Questionnaires and Questions. The IDs are generated here
+    # so the Questions can be linked to their Questionnaire before saving them.
+    new_questionnaires = []
+    new_questions = []
+
+    # Index of the Questionnaire of every new Question, to report its errors.
+    question_indexes = []
+
+    for index, questionnaire in enumerate(questionnaires):
+        questionnaire_id = ObjectId()
+
+        imported = dict(
+            new_questionnaire(questionnaire.get('title'), user_id, len(questionnaire.get('questions', []))),
+            _id=questionnaire_id
+        )
+
+        # In embedded mode the Questions are saved inside their Questionnaire.
+        if embedded_questions():
+            imported['questions'] = []
+
+        new_questionnaires.append(imported)
+
+        for question in questionnaire.get('questions', []):
+            imported_question = new_question(question.get('text'), question.get('type'), question.get('options'))
+
+            if embedded_questions():
+                imported_question['_id'] = ObjectId()
+                imported['questions'].append(imported_question)
+            else:
+                # Link the Question to its Questionnaire, and store the owner of the Questionnaire in the Question too.
+                imported_question['questionnaire_id'] = questionnaire_id
+                imported_question['owner'] = user_id
+                new_questions.append(imported_question)
+                question_indexes.append(index)
+
+    questionnaire_ids = [questionnaire['_id'] for questionnaire in new_questionnaires]
+
+    # Save the Questionnaires first, then their Questions. The inserts are ordered,
+    # so they stop at the first error.
+    try:
+        db[QUEST_DB_NAME].questionnaires.insert_many(new_questionnaires, ordered=True)
+
+        try:
+            if new_questions:
+                db[QUEST_DB_NAME].questions.insert_many(new_questions, ordered=True)
+
+        except BulkWriteError as error:
+            # Report the errors of the Questions as errors of their Questionnaire.
+            for write_error in error.details.get('writeErrors', []):
+                write_error['index'] = question_indexes[write_error['index']]
+            raise
+
+    except Exception as error:
+        # Don't leave partial imports behind: delete whatever was saved.
+        db[QUEST_DB_NAME].questions.delete_many({'questionnaire_id': {'$in': questionnaire_ids}})
+        db[QUEST_DB_NAME].questionnaires.delete_many({'_id': {'$in': questionnaire_ids}})
+
+        if not isinstance(error, BulkWriteError):
+            raise
+
+        return {
+            'message': "The Questionnaires could not be imported, none of them has been saved.",
+            'errors': [
+                {'index': write_error['index'], 'message': write_error.get('errmsg')}
+                for write_error in error.details.get('writeErrors', [])
+            ]
+        }
+
+    return questionnaire_ids
+
+
+def embedded_questions():
+    """
+    Function to check if the Questions are stored embedded in their Questionnaire
+    ("QUEST_EMBEDDED_QUESTIONS") instead of in the "questions" collection.
+    """
+
+    return current_app.config.get('QUEST_EMBEDDED_QUESTIONS', False)
+
+
+def user_questionnaires_pipeline(after, limit, include, fields, summary):
+    """
+    Function to build the pipeline that gets the Questionnaires of the user that's
+    sending the request, either complete or as summaries ('summary').
+    """
+
+    username = g._current_user.get('username')
+
+    if summary:
+        return questionnaire_summaries_pipeline(username, after, limit)
+
+    return questionnaires_pipeline(username, embedded_questions(), after, limit, include, fields)
+
+
+def get_questionnaires(limit, after=None, include=INCLUDE_ALL, fields=None, summary=False):
     """
-    Function to get all the Questionnaires from the database that belong to
+    Function to get a page of the Questionnaires from the database that belong to
     the user that's sending the request.
+
+    The Questionnaires are sorted by their ID. 'limit' is the maximum number of
+    Questionnaires to return and 'after' is the ID of the last Questionnaire of the
+    previous page, if any. 'include' is the set of linked elements to return
+    ('questions' and/or 'answers') and 'fields' the list of fields, or None for all.
+    With 'summary', only the title and the number of Questions and Answers of every
+    Questionnaire are returned, and 'include' and 'fields' are ignored.
+
+    Returns a tuple with the list of Questionnaires and the cursor of the next page,
+    which is None if this is the last page.
     """
 
     # Pipeline used to get the information about the Questionnaire and the elements
-    # linked to it.
-    pipeline = [
-        {
-            '$match': {
-                'user_id': g._current_user.get('username')
-            }
-        }, {
-            '$lookup': {
-                'from': 'questions', 
-                'let': {
-                    'questner_id': '$_id'
-                }, 
-                'pipeline': [
-                    {
-                        '$match': {
-                            '$expr': {
-                                '$eq': [
-                                    '$questionnaire_id', '$$questner_id'
-                                ]
-                            }
-                        }
-                    }, {
-                        '$lookup': {
-                            'from': 'answers', 
-                            'let': {
-                                'quest_id': '$_id'
-                            }, 
-                            'pipeline': [
-                                {
-                                    '$match': {
-                                        '$expr': {
-                                            '$eq': [
-                                                '$question_id', '$$quest_id'
-                                            ]
-                                        }
-                                    }
-                                }
-                            ], 
-                            'as': 'answers'
-                        }
-                    }
-                ], 
-                'as': 'questions'
-            }
-        }
-    ]
+    # linked to it. One extra Questionnaire is requested to know if there is a next page.
+    pipeline = user_questionnaires_pipeline(after, limit + 1, include, fields, summary)
 
     # Process the pipeline
     questionnaires = list(db[g._db_name].questionnaires.aggregate(pipeline))
 
-    # If we have a result, return it.
-    # If not, return None.
-    if len(questionnaires) > 0:
-        return questionnaires
-    return None
+    # If there are more Questionnaires than requested, there is a next page
+    # starting after the last Questionnaire of this one.
+    return split_page(questionnaires, limit)
+
+
+def iter_questionnaires(after=None, limit=None, include=INCLUDE_ALL, fields=None, summary=False):
+    """
+    Function to get a cursor over the Questionnaires of the user that's sending
+    the request, to be consumed one Questionnaire at a time.
+
+    Unlike get_questionnaires(), the result is not loaded in memory and there is
+    no limit unless one is given.
+    """
+
+    # Pipeline used to get the information about the Questionnaire and the elements
+    # linked to it.
+    pipeline = user_questionnaires_pipeline(after, limit, include, fields, summary)
+
+    # Return the cursor, which will fetch the Questionnaires in batches.
+    return db[g._db_name].questionnaires.aggregate(
+        pipeline,
+        batchSize=current_app.config.get('QUEST_STREAM_BATCH_SIZE', 100)
+    )
 
 
-def get_questionnaire(questner_id):
+def get_questionnaire(questner_id, include=INCLUDE_ALL, fields=None):
     """
     Function to get a Questionnaire from the database with its given ID.
+
+    Only the linked elements in 'include' and the given 'fields' are returned.
+    Without 'answers', the Answers are not read at all.
     """
 
     # Pipeline used to get the information about the Questionnaire and the elements
     # linked to it.
-    pipeline = [
-        {
-            '$match': {
-                '_id': ObjectId(questner_id)
-            }
-        }, {
-            '$lookup': {
-                'from': 'questions', 
-                'let': {
-                    'questner_id': '$_id'
-                }, 
-                'pipeline': [
-                    {
-                        '$match': {
-                            '$expr': {
-                                '$eq': [
-                                    '$questionnaire_id', '$$questner_id'
-                                ]
-                            }
-                        }
-                    }, {
-                        '$lookup': {
-                            'from': 'answers', 
-                            'let': {
-                                'quest_id': '$_id'
-                            }, 
-                            'pipeline': [
-                                {
-                                    '$match': {
-                                        '$expr': {
-                                            '$eq': [
-                                                '$question_id', '$$quest_id'
-                                            ]
-                                        }
-                                    }
-                                }
-                            ], 
-                            'as': 'answers'
-                        }
-                    }
-                ], 
-                'as': 'questions'
-            }
-        }
-    ]
+    pipeline = questionnaire_pipeline(questner_id, embedded_questions(), include, fields)
 
     # Process the pipeline
     questionnaire = list(db[g._db_name].questionnaires.aggregate(pipeline))
@@ -382,313 +557,1193 @@ def get_questionnaire(questner_id):
     return None
 
 
-def delete_questionnaire(questner_id):
+def iter_questionnaire(questner_id, include=INCLUDE_ALL, fields=None):
     """
-    Function to delete a Questionnaire from the database with the given ID.
+    Function to get a Questionnaire from the database with its given ID, without
+    its Questions, and a cursor over its Questions (with their Answers) to be
+    consumed one Question at a time.
 
-    It first confirms that the Questionnaire with the given ID exists, and that
-    the user sending the request is the owner of the Questionnaire.
+    Only the linked elements in 'include' and the given 'fields' are returned.
 
-    Then, it delets the Questionnaire and the Questions and Answers linked to it.
+    Returns a tuple with the Questionnaire and the cursor, or None if the
+    Questionnaire doesn't exist.
     """
 
-    # Pipeline to get the information from the Questionnaire that will be deleted,
-    # including the IDs from the Questions and Answers linked to it.
+    # Get the Questionnaire itself, with only the requested fields.
+    questionnaire = db[g._db_name].questionnaires.find_one(
+        not_deleted({'_id': ObjectId(questner_id)}),
+        questionnaire_projection(embedded_questions(), include, fields)
+    )
+
+    if questionnaire is None:
+        return None
+
+    # Without its Questions, there is nothing else to stream.
+    if 'questions' not in include:
+        return questionnaire, iter(())
+
+    # In embedded mode, the Questions come with the Questionnaire and
+    # their Answers are fetched one Question at a time.
+    if embedded_questions():
+        questions = questionnaire.pop('questions', [])
+
+        def with_answers():
+            for question in questions:
+                if 'answers' in include:
+                    question['answers'] = list(db[g._db_name].answers.find({'question_id': question.get('_id')}))
+                yield question
+
+        return questionnaire, with_answers()
+
+    # Pipeline used to get the Questions of the Questionnaire and their Answers.
     pipeline = [
         {
             '$match': {
-                '_id': ObjectId(questner_id)
-            }
-        }, {
-            '$lookup': {
-                'from': 'questions', 
-                'let': {
-                    'questner_id': '$_id'
-                }, 
-                'pipeline': [
-                    {
-                        '$match': {
-                            '$expr': {
-                                '$eq': [
-                                    '$questionnaire_id', '$$questner_id'
-                                ]
-                            }
-                        }
-                    }, {
-                        '$lookup': {
-                            'from': 'answers', 
-                            'let': {
-                                'quest_id': '$_id'
-                            }, 
-                            'pipeline': [
-                                {
-                                    '$match': {
-                                        '$expr': {
-                                            '$eq': [
-                                                '$question_id', '$$quest_id'
-                                            ]
-                                        }
-                                    }
-                                }, {
-                                    '$project': {
-                                        '_id': 1
-                                    }
-                                }
-                            ], 
-                            'as': 'answers'
-                        }
-                    }, {
-                        '$project': {
-                            'answers': 1
-                        }
-                    }
-                ], 
-                'as': 'questions'
+                'questionnaire_id': questionnaire.get('_id')
             }
         }
     ]
 
-    # Process the pipeline and get the result with the information requested.
-    questionnaire = list(db[g._db_name].questionnaires.aggregate(pipeline))[0]
+    if 'answers' in include:
+        pipeline.append(answers_lookup())
 
-    # Confirm that the requester is the owner of the Questionnaire.
-    # If not, return None.
-    if questionnaire.get('user_id', None) == g._current_user.get('username'):
-
-        # Intialize the variables that will be used to store the elements
-        # linked to the Questionnaire.
-        questions = list()
-        answers = list()
-
-        # Get the list of Questions and Answers linked to the Questionnaire and store their IDs.
-        for question in questionnaire.get('questions'):
-            question_id = question.get('_id', None)
-            if question_id is not None:
-                questions.append(question_id)
-                answers.extend([answer.get('_id') for answer in question.get('answers') if answer is not None])
-        
-
-        # Callback function to execute the operations that will delete the elements.
-        def callback(session):
-
-            # Retrieve the collections that will be modified, through the given session.
-            questner_coll = session.client.test_quest.questionnaires
-            quest_coll = session.client.test_quest.questions
-            answer_coll = session.client.test_quest.answers
-
-            # Delete operations
-            answer_coll.delete_many({'_id': {'$in': answers}}, session=session)
-            quest_coll.delete_many({'_id': {'$in': questions}}, session=session)
-            print('Questner ID: ', questner_id)
-            questner_coll.delete_one({'_id': ObjectId(questner_id)}, session=session)
-
-        # Start a client session and execute the operations
-        with db.start_session() as session:
-            session.with_transaction(
-                callback,
-                read_concern=ReadConcern('snapshot'),
-                write_concern=WriteConcern("majority", wtimeout=1000),
-                read_preference=ReadPreference.PRIMARY
-            )
-        
-        return {'message': 'Questionnaire deleted!'}
+    # Get the cursor, which will fetch the Questions in batches.
+    questions = db[g._db_name].questions.aggregate(
+        pipeline,
+        batchSize=current_app.config.get('QUEST_STREAM_BATCH_SIZE', 100)
+    )
 
-    else:
-        return None
+    return questionnaire, questions
 
 
-# QUESTION MANAGEMENT
-def create_question(questionnaire_id, text, type, options=None):
+def get_questionnaire_definition(questner_id):
     """
-    Function to create a new question and save it to the database.
+    Function to get a Questionnaire from the database with its given ID, and its
+    Questions but not their Answers.
 
-    It first checks if a questionnaire with the given 'questionnaire_id' exists.
-    If it doesn't exists, it will return an error.
+    In embedded mode this is a single document fetch. The definition is read
+    from the definition cache if possible, and doesn't include the version nor the counters.
     """
 
-    # Check if the questionnaire with the given 'questionnaire_id' exists.
-    questionnaire = db[g._db_name].questionnaires.find_one({'_id': ObjectId(questionnaire_id)})
+    key = definition_key('questionnaire', questner_id)
+
+    # Look for the definition in the cache first.
+    questionnaire = definition_cache.get(key)
 
     if questionnaire is not None:
+        return questionnaire
 
-        # Build the new question that will be added to the database.
-        new_question = {
-            'questionnaire_id': ObjectId(questionnaire_id),
-            'text': text,
-            'type': type
-        }
+    # Taken before reading, so a definition invalidated while it is being read isn't cached.
+    lease = definition_cache.lease()
 
-        # If there are options, add them to the question.
-        if options is not None:
-            new_question['options'] = options
+    # Get the Questionnaire itself. The version and the counters change with every
+    # Answer, so they are left out to keep the definition valid until a Question changes.
+    questionnaire = db[g._db_name].questionnaires.find_one(
+        not_deleted({'_id': ObjectId(questner_id)}),
+        DEFINITION_PROJECTION
+    )
 
-        # Save the new question in the database and return the result.
-        return db[g._db_name].questions.insert_one(new_question)
-    
-    return {'message': "Could't find questionnaire with the given Questionnaire ID: {}.".format(questionnaire_id)}
+    if questionnaire is None:
+        return None
 
+    # Get its Questions from the "questions" collection, if they are not embedded.
+    if not embedded_questions():
+        questionnaire['questions'] = list(db[g._db_name].questions.find({'questionnaire_id': questionnaire.get('_id')}))
 
-def get_question(question_id):
+    definition_cache.set(key, questionnaire, lease)
+
+    return questionnaire
+
+
+def bump_version(questner_id, questions=0, answers=0):
     """
-    Function to get a Question from the database with its given ID.
+    Function to increase the version of the Questionnaire with the given ID, and
+    add the given number of 'questions' and 'answers' to its counters.
+
+    It has to be called after every change to the Questionnaire, its Questions
+    or their Answers, since the version is used to build the ETags.
     """
 
-    # Pipeline used to get the information about the Question and the answers
-    # linked to it.
-    pipeline = [
-        {
-            '$match': {
-                '_id': ObjectId(question_id)
-            }
-        }, {
-            '$lookup': {
-                'from': 'answers', 
-                'localField': '_id', 
-                'foreignField': 'question_id', 
-                'as': 'answers'
-            }
-        }
-    ]
+    db[g._db_name].questionnaires.update_one({'_id': ObjectId(questner_id)}, {'$inc': counters_update(questions, answers)})
 
-    # Process the pipeline and get the result
-    question = list(db[g._db_name].questions.aggregate(pipeline))
 
-    # If we have a result, return it.
-    # If not, return None.
-    if len(question) > 0:
-        return question[0]
-    return None
+def count_new_question(questner_id):
+    """
+    Function to add a new Question to the counters of the Questionnaire with the
+    given ID, and increase its version, only if it hasn't been deleted.
 
+    Returns False if the Questionnaire doesn't exist anymore.
+    """
 
-def delete_question(question_id):
+    result = db[g._db_name].questionnaires.update_one(
+        not_deleted({'_id': ObjectId(questner_id)}),
+        {'$inc': counters_update(questions=1)}
+    )
+
+    return result.matched_count == 1
+
+
+def count_new_answers(questner_id, question_ids, answers):
     """
-    Function to delete a Question from the database with its given ID.
+    Function to add the given number of new 'answers' to the Questions with the
+    given IDs to the counters of their Questionnaire, and increase its version.
 
-    The process is:
+    The update is only done if neither the Questionnaire nor any of the Questions
+    have been deleted, which their cached definitions can't tell for sure.
 
-    1. Check if the Question with the given ID exists.
-    2. If it exists, it checks if the Questionnaire to which the Question is linked belongs to the current user.
-    3. If it does, it sends the command to the database to delete the Question.
+    Returns False if the Answers can't be saved.
     """
 
-    # Pipeline to get the information about the Questionnaire to which this Question is linked to.
-    pipeline = [
-        {
-            '$match': {
-                '_id': ObjectId(question_id)
-            }
-        }, {
-            '$lookup': {
-                'from': 'questionnaires', 
-                'localField': 'questionnaire_id', 
-                'foreignField': '_id', 
-                'as': 'questionnaire'
-            }
-        }, {
-            '$project': {
-                '_id': 0, 
-                'questionnaire': 1
-            }
-        }
-    ]
+    result = db[g._db_name].questionnaires.update_one(
+        accepts_answers(questner_id, question_ids, embedded_questions()),
+        {'$inc': counters_update(answers=answers)}
+    )
 
-    # Run the pipeline and get the result.
-    result = db[g._db_name].questions.aggregate(pipeline)
+    return result.matched_count == 1
 
-    # Get the owner of the Questionnaire.
-    questionnaire_owner = list(result)[0].get('questionnaire')[0].get('user_id')
 
-    # If the current user is the owner of the Questionnaire,
-    # delete the Question as requested.
-    # If not, return a DeleteResult object with "acknowledged" as False.
-    if questionnaire_owner == g._current_user.get("username"):
-        return db[g._db_name].questions.delete_one({'_id': ObjectId(question_id)})
-    else:
-        return DeleteResult(None, False)
+def forget_definitions(questner_id, question_ids):
+    """
+    Function to remove from the definition cache, in every tier, the stale
+    definitions of a Questionnaire and the given Questions.
+    """
 
+    definition_cache.invalidate(
+        definition_key('questionnaire', questner_id),
+        *[definition_key('question', question_id) for question_id in question_ids]
+    )
 
-# ANSWER MANAGEMENT
-def create_answer(question_id, value):
+
+def get_questionnaire_version(questner_id):
     """
-    Function to create a new answer and save it to the database.
+    Function to get the version of the Questionnaire with the given ID, with a
+    single indexed read. Questionnaires that were never changed have version 0.
 
-    It first checks if a question with the given 'question_id' exists.
-    If it doesn't exists, it will return an error.
+    Returns None if the Questionnaire doesn't exist.
     """
 
-    # Check if the question with the given 'question_id' exists.
-    question = db[g._db_name].questions.find_one({'_id': ObjectId(question_id)})
+    questionnaire = db[g._db_name].questionnaires.find_one(not_deleted({'_id': ObjectId(questner_id)}), {'version': 1})
 
-    if question is not None:
+    if questionnaire is None:
+        return None
 
-        # Build the new answer that will be added to the database.
-        new_answer = {
-            'question_id': ObjectId(question_id),
-            'value': value
-        }
+    return questionnaire.get('version', 0)
 
-        # Save the new answer in the database and return the result.
-        return db[g._db_name].answers.insert_one(new_answer)
-    
-    return {'message': "Could't find question with the given Question ID: {}.".format(question_id)}
 
+def get_question_version(question_id):
+    """
+    Function to get the version of the Questionnaire of the Question with the given ID.
 
-def get_answer(answer_id):
+    Returns None if the Question doesn't exist.
     """
-    Function to get an Answer from the database with its given ID.
+
+    # In embedded mode, the Question is found inside its Questionnaire.
+    if embedded_questions():
+        questionnaire = db[g._db_name].questionnaires.find_one(not_deleted({'questions._id': ObjectId(question_id)}), {'version': 1})
+
+        if questionnaire is None:
+            return None
+
+        return questionnaire.get('version', 0)
+
+    question = db[g._db_name].questions.find_one({'_id': ObjectId(question_id)}, {'questionnaire_id': 1})
+
+    if question is None:
+        return None
+
+    return get_questionnaire_version(question.get('questionnaire_id'))
+
+
+def delete_questionnaire(questner_id):
     """
+    Function to delete a Questionnaire from the database with the given ID, if
+    the user sending the request is the owner of the Questionnaire.
 
-    # Return Answer with the given Answer ID (answer_id).
-    return db[g._db_name].answers.find_one(ObjectId(answer_id))
+    The Questionnaire is only marked as deleted, which hides it and the Questions
+    and Answers linked to it right away. They are removed from the database later,
+    in batches, by purge_deleted_questionnaires().
+    """
 
+    # Mark the Questionnaire as deleted, only if it belongs to the user.
+    questionnaire = db[g._db_name].questionnaires.find_one_and_update(
+        not_deleted({'_id': ObjectId(questner_id), 'user_id': g._current_user.get('username')}),
+        deletion_update(),
+        {'questions._id': 1}
+    )
 
-def delete_answer(answer_id):
+    # If it doesn't exist or doesn't belong to the user, return None.
+    if questionnaire is None:
+        return None
+
+    # Get the IDs of its Questions, to remove them from the definition cache.
+    question_ids = [question['_id'] for question in questionnaire.get('questions', [])]
+    question_ids.extend(
+        question['_id'] for question in db[g._db_name].questions.find({'questionnaire_id': ObjectId(questner_id)}, {'_id': 1})
+    )
+
+    definition_cache.invalidate(
+        definition_key('questionnaire', questner_id),
+        *[definition_key('question', question_id) for question_id in question_ids]
+    )
+
+    return {'message': 'Questionnaire deleted!'}
+
+
+def get_questionnaire_results(questner_id):
     """
-    Function to delete an Answer from the database with is given ID.
+    Function to count the Answers of every choice Question ('one_of', 'many_of'
+    and 'list') of the Questionnaire with the given ID.
+
+    The Answers are counted in the database, grouped by Question and value. Every
+    Question gets the count of every option and the total number of Answers.
 
-    It first confirms that the Answer exists and that it is linked to a Questionnaire that belongs to the user.
+    Returns None if the Questionnaire doesn't exist or it doesn't belong to the
+    user sending the request.
     """
 
-    # Pipeline to get the information about the Questionnaire to which this Answer is linked to.
-    pipeline = [
-        {
-            '$match': {
-                '_id': ObjectId(answer_id)
-            }
-        }, {
-            '$lookup': {
-                'from': 'questions', 
-                'localField': 'question_id', 
-                'foreignField': '_id', 
-                'as': 'question'
-            }
-        }, {
-            '$lookup': {
-                'from': 'questionnaires', 
-                'localField': 'question.0.questionnaire_id', 
-                'foreignField': '_id', 
-                'as': 'questionnaire'
-            }
-        }, {
-            '$project': {
-                '_id': 0, 
-                'questionnaire': 1
-            }
-        }
-    ]
+    # Get the Questionnaire and its Questions, without their Answers.
+    questionnaire = get_questionnaire_definition(questner_id)
+
+    if questionnaire is None or questionnaire.get('user_id') != g._current_user.get('username'):
+        return None
 
-    # Run the pipeline and get the result.
-    result = db[g._db_name].answers.aggregate(pipeline)
+    questions = [question for question in questionnaire.get('questions', []) if question.get('type') in CHOICE_TYPES]
 
-    # Get the owner of the Questionnaire.
-    questionnaire_owner = list(result)[0].get('questionnaire')[0].get('user_id')
+    # Pipeline to count the Answers of the Questions by value.
+    pipeline = answer_tallies_pipeline([question.get('_id') for question in questions])
 
-    print(f"[Delete Answer] Questionnaire owner: {questionnaire_owner} / Current User: {g._current_user.get('username')}")
+    # Process the pipeline, there is one result per Question with Answers.
+    tallies = {tally['_id']: tally for tally in db[g._db_name].answers.aggregate(pipeline)}
 
-    # If the current user is the owner of the Questionnaire,
-    # delete the Answer as requested.
-    # If not, return a DeleteResult object with "acknowledged" as False.
-    if questionnaire_owner == g._current_user.get("username"):
-        return db[g._db_name].answers.delete_one({'_id': ObjectId(answer_id)})
-    else:
-        return DeleteResult(None, False)
\ No newline at end of file
+    results = []
+
+    for question in questions:
+        tally = tallies.get(question.get('_id'), {})
+
+        # Count of every value that was given, skipping empty Answers.
+        counts = {option['value']: option['count'] for option in tally.get('options', []) if option.get('value') is not None}
+
+        # Every option of the Question, in order, followed by any other value found.
+        values = list(question.get('options') or [])
+        values.extend(value for value in counts if value not in values)
+
+        results.append({
+            '_id': question.get('_id'),
+            'text': question.get('text'),
+            'type': question.get('type'),
+            'total': tally.get('total', 0),
+            'options': [{'value': value, 'count': counts.get(value, 0)} for value in values]
+        })
+
+    return {
+        '_id': questionnaire.get('_id'),
+        'title': questionnaire.get('title'),
+        'questions': results
+    }
+
+
+def iter_questionnaire_answers(questner_id, batch_size):
+    """
+    Function to get the Questionnaire with the given ID, with its Questions, and
+    a cursor over all the Answers of its Questions, fetched in batches of 'batch_size'.
+
+    Returns a tuple with the Questionnaire and the cursor, or None if the Questionnaire
+    doesn't exist or it doesn't belong to the user sending the request.
+    """
+
+    # Get the Questionnaire and its Questions, without their Answers.
+    questionnaire = get_questionnaire_definition(questner_id)
+
+    if questionnaire is None or questionnaire.get('user_id') != g._current_user.get('username'):
+        return None
+
+    question_ids = [question.get('_id') for question in questionnaire.get('questions', [])]
+
+    # Get the cursor, which will fetch the Answers in batches.
+    answers = db[g._db_name].answers.find(
+        {'question_id': {'$in': question_ids}},
+        {'question_id': 1, 'value': 1},
+        batch_size=batch_size
+    )
+
+    return questionnaire, answers
+
+
+# QUESTION MANAGEMENT
+def create_question(questionnaire_id, text, type, options=None):
+    """
+    Function to create a new question and save it to the database.
+
+    It first checks if a questionnaire with the given 'questionnaire_id' exists.
+    If it doesn't exists, it will return an error.
+    """
+
+    # In embedded mode, add the question to the questionnaire's array in a single
+    # atomic update, which also checks that the questionnaire exists.
+    if embedded_questions():
+        question = dict(new_question(text, type, options), _id=ObjectId())
+
+        result = db[g._db_name].questionnaires.update_one(
+            not_deleted({'_id': ObjectId(questionnaire_id)}),
+            {'$push': {'questions': question}, '$inc': counters_update(questions=1)}
+        )
+
+        if result.matched_count == 1:
+            # The definition of the Questionnaire has changed.
+            definition_cache.invalidate(definition_key('questionnaire', questionnaire_id))
+
+            return InsertOneResult(question['_id'], result.acknowledged)
+
+        return questionnaire_not_found(questionnaire_id)
+
+    # Check if the questionnaire with the given 'questionnaire_id' exists.
+    questionnaire = get_questionnaire_definition(questionnaire_id)
+
+    # Count the new question first, only if the questionnaire hasn't been deleted
+    # since its definition was cached.
+    if questionnaire is not None and not count_new_question(questionnaire_id):
+        definition_cache.invalidate(definition_key('questionnaire', questionnaire_id))
+        questionnaire = None
+
+    if questionnaire is not None:
+
+        # Build the new question that will be added to the database, with the
+        # owner of its questionnaire, so it can be checked without a $lookup.
+        question = dict(
+            new_question(text, type, options),
+            questionnaire_id=ObjectId(questionnaire_id),
+            owner=questionnaire.get('user_id')
+        )
+
+        # Save the new question in the database.
+        try:
+            result = db[g._db_name].questions.insert_one(question)
+        except Exception:
+            # Don't count a question that wasn't saved.
+            bump_version(questionnaire_id, questions=-1)
+            raise
+
+        # The definition of the Questionnaire has changed.
+        definition_cache.invalidate(definition_key('questionnaire', questionnaire_id))
+
+        return result
+    
+    return questionnaire_not_found(questionnaire_id)
+
+
+def find_question(question_id):
+    """
+    Function to get a Question, without its Answers, from the database with its given ID.
+
+    The Question always has its 'questionnaire_id', also in embedded mode.
+    It is read from the definition cache if possible.
+    """
+
+    key = definition_key('question', question_id)
+
+    # Look for the Question in the cache first.
+    question = definition_cache.get(key)
+
+    if question is not None:
+        return question
+
+    # Taken before reading, so a Question invalidated while it is being read isn't cached.
+    lease = definition_cache.lease()
+
+    # In embedded mode, get the Questionnaire with only the matching Question.
+    if embedded_questions():
+        questionnaire = db[g._db_name].questionnaires.find_one(
+            not_deleted({'questions._id': ObjectId(question_id)}),
+            {'questions.$': 1}
+        )
+
+        if questionnaire is None:
+            return None
+
+        question = questionnaire['questions'][0]
+        question['questionnaire_id'] = questionnaire.get('_id')
+
+    else:
+        question = db[g._db_name].questions.find_one({'_id': ObjectId(question_id)})
+
+        # Hide the Questions of deleted Questionnaires that haven't been purged yet.
+        if question is None or get_questionnaire_definition(question.get('questionnaire_id')) is None:
+            return None
+
+    definition_cache.set(key, question, lease)
+
+    return question
+
+
+def get_question(question_id, include=INCLUDE_ALL, fields=None):
+    """
+    Function to get a Question from the database with its given ID, with its
+    Answers if 'answers' is in 'include', and only the given 'fields'.
+    """
+
+    # Get the Question itself, usually from the definition cache.
+    question = find_question(question_id)
+
+    if question is None:
+        return None
+
+    question = project_fields(question, fields)
+
+    # Add its Answers.
+    if 'answers' in include:
+        question['answers'] = list(db[g._db_name].answers.find({'question_id': question.get('_id')}))
+
+    return question
+
+
+def iter_question(question_id, include=INCLUDE_ALL, fields=None):
+    """
+    Function to get a Question from the database with its given ID, without its
+    Answers, and a cursor over its Answers to be consumed one Answer at a time.
+
+    Only the given 'fields' are returned, and the cursor is empty if 'answers'
+    is not in 'include'.
+
+    Returns a tuple with the Question and the cursor, or None if the
+    Question doesn't exist.
+    """
+
+    # Get the Question itself.
+    question = find_question(question_id)
+
+    if question is None:
+        return None
+
+    question = project_fields(question, fields)
+
+    if 'answers' not in include:
+        return question, iter(())
+
+    # Get the cursor, which will fetch the Answers in batches.
+    answers = db[g._db_name].answers.find(
+        {'question_id': question.get('_id')},
+        batch_size=current_app.config.get('QUEST_STREAM_BATCH_SIZE', 100)
+    )
+
+    return question, answers
+
+
+def delete_question(question_id):
+    """
+    Function to delete a Question from the database with its given ID.
+
+    The Question is only deleted if its Questionnaire belongs to the current user.
+    """
+
+    # In embedded mode, remove the Question from its Questionnaire's array in a single
+    # atomic update, only if the Questionnaire belongs to the current user.
+    if embedded_questions():
+        questionnaire = db[g._db_name].questionnaires.find_one_and_update(
+            {'questions._id': ObjectId(question_id), 'user_id': g._current_user.get("username")},
+            {'$pull': {'questions': {'_id': ObjectId(question_id)}}, '$inc': counters_update(questions=-1)},
+            {'_id': 1}
+        )
+
+        if questionnaire is None:
+            return DeleteResult({'n': 0}, True)
+
+        db[g._db_name].question_stats.delete_one({'_id': ObjectId(question_id)})
+
+        # The definitions of the Question and its Questionnaire have changed.
+        definition_cache.invalidate(
+            definition_key('question', question_id),
+            definition_key('questionnaire', questionnaire.get('_id'))
+        )
+
+        return DeleteResult({'n': 1}, True)
+
+    # Delete the Question only if it belongs to the current user, in a single operation.
+    question = db[g._db_name].questions.find_one_and_delete(
+        {'_id': ObjectId(question_id), 'owner': g._current_user.get("username")},
+        {'questionnaire_id': 1}
+    )
+
+    if question is None:
+        return DeleteResult({'n': 0}, True)
+
+    # The Questionnaire has changed, and has one Question less. The ID of the
+    # Question is kept in it, so no Answer can be counted for it anymore.
+    db[g._db_name].questionnaires.update_one(
+        {'_id': question.get('questionnaire_id')},
+        {'$inc': counters_update(questions=-1), '$addToSet': {'deleted_questions': ObjectId(question_id)}}
+    )
+    db[g._db_name].question_stats.delete_one({'_id': ObjectId(question_id)})
+    definition_cache.invalidate(
+        definition_key('question', question_id),
+        definition_key('questionnaire', question.get('questionnaire_id'))
+    )
+
+    return DeleteResult({'n': 1}, True)
+
+
+# ANSWER MANAGEMENT
+def create_answer(question_id, value):
+    """
+    Function to create a new answer and save it to the database.
+
+    It first checks if a question with the given 'question_id' exists.
+    If it doesn't exists, it will return an error. If the 'value' isn't valid
+    for the type and options of the question, it raises a ValidationError.
+    """
+
+    # Check if the question with the given 'question_id' exists.
+    question = find_question(question_id)
+
+    if question is not None:
+
+        # Check the value with the compiled validator of the question.
+        value = validate_answer(question, value)
+
+        # Get the owner of the question's questionnaire, usually from the cache.
+        questionnaire = get_questionnaire_definition(question.get('questionnaire_id')) or {}
+
+        # Build the new answer that will be added to the database, with its
+        # questionnaire and owner, so they can be checked without a $lookup.
+        answer = new_answer(ObjectId(question_id), question.get('questionnaire_id'), questionnaire.get('user_id'), value)
+
+        # The Questionnaire of the Question changes, and has one more Answer. It is
+        # counted first, only if neither the Question nor the Questionnaire have
+        # been deleted since they were cached.
+        if not count_new_answers(question.get('questionnaire_id'), [question.get('_id')], 1):
+            forget_definitions(question.get('questionnaire_id'), [question_id])
+            return question_not_found(question_id)
+
+        # Save the new answer in the database.
+        try:
+            result = db[g._db_name].answers.insert_one(answer)
+        except Exception:
+            # Don't count an Answer that wasn't saved.
+            bump_version(question.get('questionnaire_id'), answers=-1)
+            raise
+
+        update_question_stats(stats_operations(question.get('questionnaire_id'), question, value))
+
+        return result
+    
+    return question_not_found(question_id)
+
+
+def create_answers(questionnaire_id, answers, retry=True):
+    """
+    Function to create all the answers of a filled-out Questionnaire at once.
+
+    'answers' is a list of dictionaries with the 'question_id' and 'value' of
+    every answer. The Questions are validated against the Questionnaire with a
+    single query, the values against the type and options of their Question,
+    and the valid answers are saved with a single insert.
+
+    If a Question or the Questionnaire has been deleted since the definition was
+    cached, the definition is read again and the answers are validated once more
+    ('retry').
+
+    Returns a list with the result of every answer, in the same order.
+    """
+
+    # Get the IDs of the given Questions that belong to the Questionnaire.
+    question_ids = [ObjectId(answer.get('question_id')) for answer in answers]
+
+    # The Questions are read from the definition of the Questionnaire, usually cached.
+    questionnaire = get_questionnaire_definition(questionnaire_id) or {}
+
+    found = {question['_id']: question for question in questionnaire.get('questions', [])}
+
+    # Build the new answers that will be added to the database, and the
+    # result of the answers whose Question doesn't belong to the Questionnaire.
+    results = []
+    new_answers = []
+    stats = []
+
+    for index, question_id in enumerate(question_ids):
+
+        if question_id in found:
+
+            # Check the value with the compiled validator of the question.
+            try:
+                value = validate_answer(found[question_id], answers[index].get('value'))
+            except ValidationError as error:
+                results.append({'index': index, 'status': 400, 'message': error.messages})
+                continue
+
+            new_answers.append(new_answer(question_id, questionnaire.get('_id'), questionnaire.get('user_id'), value))
+            results.append({'index': index, 'status': 201})
+            stats.extend(stats_operations(questionnaire.get('_id'), found[question_id], value))
+
+        else:
+            results.append({
+                'index': index,
+                'status': 404,
+                'message': "Couldn't find question with the given Question ID: {}.".format(question_id)
+            })
+
+    # Save all the new answers in the database at once.
+    if new_answers:
+
+        # The Questionnaire changes, and has more Answers. They are counted first,
+        # only if none of their Questions has been deleted since it was cached.
+        answered = list(dict.fromkeys(answer['question_id'] for answer in new_answers))
+
+        if not count_new_answers(questionnaire_id, answered, len(new_answers)):
+            forget_definitions(questionnaire_id, answered)
+
+            if retry:
+                return create_answers(questionnaire_id, answers, retry=False)
+
+            # The Questionnaire is still changing, let the client try again.
+            return [
+                dict(item, status=404, message="Couldn't find question with the given Question ID: {}.".format(
+                    answers[item['index']].get('question_id')))
+                if item['status'] == 201 else item
+                for item in results
+            ]
+
+        try:
+            result = db[g._db_name].answers.insert_many(new_answers, ordered=False)
+        except BulkWriteError as error:
+            # Don't count the Answers that weren't saved.
+            bump_version(questionnaire_id, answers=error.details.get('nInserted', 0) - len(new_answers))
+            raise
+
+        # Add the ID of every new answer to its result.
+        inserted_ids = iter(result.inserted_ids)
+        for item in results:
+            if item['status'] == 201:
+                item['id'] = str(next(inserted_ids))
+
+        update_question_stats(stats)
+
+    return results
+
+
+def get_answer(answer_id):
+    """
+    Function to get an Answer from the database with its given ID.
+    """
+
+    # Get the Answer with the given Answer ID (answer_id).
+    answer = db[g._db_name].answers.find_one(ObjectId(answer_id))
+
+    # Hide the Answers of deleted Questionnaires that haven't been purged yet.
+    if answer is not None and answer.get('questionnaire_id') is not None:
+        if get_questionnaire_definition(answer.get('questionnaire_id')) is None:
+            return None
+
+    return answer
+
+
+def delete_answer(answer_id):
+    """
+    Function to delete an Answer from the database with is given ID.
+
+    The Answer is only deleted if its Questionnaire belongs to the current user.
+    """
+
+    # Delete the Answer only if it belongs to the current user, in a single operation.
+    answer = db[g._db_name].answers.find_one_and_delete(
+        {'_id': ObjectId(answer_id), 'owner': g._current_user.get("username")},
+        {'questionnaire_id': 1, 'question_id': 1, 'value': 1}
+    )
+
+    if answer is None:
+        return DeleteResult({'n': 0}, True)
+
+    # The Questionnaire has changed, and has one Answer less.
+    bump_version(answer.get('questionnaire_id'), answers=-1)
+
+    # Remove the Answer from the statistics of its Question, if it still exists.
+    question = find_question(answer.get('question_id'))
+
+    if question is not None:
+        update_question_stats(stats_operations(answer.get('questionnaire_id'), question, answer.get('value'), -1))
+
+    return DeleteResult({'n': 1}, True)
+
+
+# QUESTION STATISTICS
+def update_question_stats(operations):
+    """
+    Function to apply to the "question_stats" collection the updates built
+    by stats_operations(), in a single round trip.
+    """
+
+    if operations:
+        db[g._db_name].question_stats.bulk_write(operations, ordered=False)
+
+
+def get_questionnaire_stats(questner_id):
+    """
+    Function to get the statistics of every Question of the Questionnaire with
+    the given ID, from the "question_stats" collection.
+
+    The statistics are kept up to date by every Answer created or deleted, so
+    they are read with a single query whatever the number of Answers. Stale
+    statistics (see stats_operations()) are rebuilt before they are returned,
+    and stay stale if an Answer changes them during the rebuild.
+
+    Returns None if the Questionnaire doesn't exist or it doesn't belong to the
+    user sending the request.
+    """
+
+    # Get the Questionnaire and its Questions, usually from the cache.
+    questionnaire = get_questionnaire_definition(questner_id)
+
+    if questionnaire is None or questionnaire.get('user_id') != g._current_user.get('username'):
+        return None
+
+    questions = questionnaire.get('questions', [])
+
+    # One document per Question with Answers.
+    stats = {
+        document['_id']: document
+        for document in db[g._db_name].question_stats.find({'questionnaire_id': questionnaire.get('_id')})
+    }
+
+    stale = [question for question in questions if stats.get(question.get('_id'), {}).get('stale')]
+
+    if stale:
+        stats.update(_rebuild_stats(db[g._db_name], questionnaire.get('_id'), stale))
+
+    return {
+        '_id': questionnaire.get('_id'),
+        'title': questionnaire.get('title'),
+        'questions': [question_stats_result(question, stats.get(question.get('_id'))) for question in questions]
+    }
+
+
+def _rebuild_stats(database, questionnaire_id, questions):
+    """
+    Function to recompute from the Answers the "question_stats" documents of
+    the given 'questions' of a Questionnaire, and replace the saved ones.
+
+    Every update of a document increases its 'generation', so a document is only
+    replaced if no Answer has changed it since its Answers were read. Otherwise
+    it is marked as stale, to be rebuilt again by the next read.
+
+    Returns a dictionary with the new documents, keyed by Question ID.
+    """
+
+    found = {question['_id']: question for question in questions}
+
+    # Generation of the saved documents, read before their Answers.
+    generations = {
+        document['_id']: document.get('generation')
+        for document in database.question_stats.find({'_id': {'$in': list(found)}}, {'generation': 1})
+    }
+
+    # Go through the Answers sorted by Question, so only the values of one
+    # Question are held at a time.
+    answers = database.answers.find(
+        {'question_id': {'$in': list(found)}},
+        {'question_id': 1, 'value': 1}
+    ).sort('question_id', 1)
+
+    stats = {question_id: new_question_stats(questionnaire_id, question, []) for question_id, question in found.items()}
+
+    for question_id, group in itertools.groupby(answers, key=lambda answer: answer['question_id']):
+        stats[question_id] = new_question_stats(
+            questionnaire_id, found[question_id], (answer.get('value') for answer in group)
+        )
+
+    for question_id, document in stats.items():
+        generation = generations.get(question_id)
+        document['generation'] = (generation or 0) + 1
+
+        # Documents saved before the generations were added don't have one.
+        query = {'_id': question_id, 'generation': {'$exists': False} if generation is None else generation}
+
+        # If the document has changed, the filter doesn't match and the upsert
+        # collides with it: keep it stale instead of losing the changes.
+        try:
+            database.question_stats.replace_one(query, document, upsert=True)
+        except DuplicateKeyError:
+            database.question_stats.update_one({'_id': question_id}, {'$set': {'stale': True}})
+
+    return stats
+
+
+def rebuild_question_stats(batch_size=500):
+    """
+    Function to recompute the "question_stats" collection from scratch, from
+    the Answers of every Questionnaire that hasn't been deleted.
+
+    The statistics changed by an Answer while their Question is being rebuilt
+    are left stale, and rebuilt by the next read. It has to be run once after
+    upgrading.
+
+    Returns the number of Questions whose statistics were rebuilt.
+    """
+
+    QUEST_DB_NAME = str(db_name)
+    database = db[QUEST_DB_NAME]
+
+    rebuilt = 0
+
+    # Go through the Questionnaires that haven't been deleted, with their embedded Questions if any.
+    for questionnaire in database.questionnaires.find(not_deleted({}), {'questions': 1}):
+        questions = list(questionnaire.get('questions', []))
+        questions.extend(database.questions.find({'questionnaire_id': questionnaire['_id']}, {'type': 1, 'options': 1}))
+
+        # Remove the statistics of the Questions that no longer exist.
+        database.question_stats.delete_many({
+            'questionnaire_id': questionnaire['_id'],
+            '_id': {'$nin': [question['_id'] for question in questions]}
+        })
+
+        # Rebuild the Questions in batches.
+        for start in range(0, len(questions), batch_size):
+            rebuilt += len(_rebuild_stats(database, questionnaire['_id'], questions[start:start + batch_size]))
+
+    return rebuilt
+
+
+# PURGE OF DELETED QUESTIONNAIRES
+def _purge_batches(collection, query, batch_size, progress):
+    """
+    Function to delete the documents of the given 'collection' that match 'query',
+    'batch_size' documents at a time.
+
+    'progress' is called with the number of documents deleted by every batch,
+    and returns False if the purge has to stop.
+    """
+
+    while True:
+        ids = [document['_id'] for document in collection.find(query, {'_id': 1}).limit(batch_size)]
+
+        if not ids:
+            return True
+
+        deleted = collection.delete_many({'_id': {'$in': ids}}).deleted_count
+
+        if not progress(deleted):
+            return False
+
+
+def purge_questionnaire(questionnaire, lease, batch_size):
+    """
+    Function to remove from the database a deleted Questionnaire that has been
+    claimed with the given 'lease', and the Questions and Answers linked to it.
+
+    The Answers and Questions are removed in batches. After every batch the
+    progress is saved in the Questionnaire and the lease is renewed. If the lease
+    has been lost, the purge stops and is left for whoever holds it now.
+
+    Returns True if the Questionnaire was completely removed.
+    """
+
+    QUEST_DB_NAME = str(db_name)
+    questionnaires = db[QUEST_DB_NAME].questionnaires
+
+    lease_seconds = current_app.config.get('QUEST_PURGE_LEASE_SECONDS', 60)
+    claimed = {'_id': questionnaire['_id'], 'purge.lease': lease}
+
+    def progress(field):
+        def save(deleted):
+            result = questionnaires.update_one(claimed, {
+                '$inc': {'purge.' + field: deleted},
+                '$set': {'purge.lease_until': datetime.utcnow() + timedelta(seconds=lease_seconds)}
+            })
+            return result.matched_count == 1
+        return save
+
+    # Get the IDs of the Questions in either layout. Answers saved before
+    # "flask migrate owners" don't have the 'questionnaire_id'.
+    question_ids = [question['_id'] for question in questionnaire.get('questions', [])]
+    question_ids.extend(
+        question['_id'] for question in db[QUEST_DB_NAME].questions.find({'questionnaire_id': questionnaire['_id']}, {'_id': 1})
+    )
+
+    answers_query = {'$or': [{'questionnaire_id': questionnaire['_id']}, {'question_id': {'$in': question_ids}}]}
+
+    # Remove the Answers first and the Questions next, so nothing is left without its parent.
+    if not _purge_batches(db[QUEST_DB_NAME].answers, answers_query, batch_size, progress('answers')):
+        return False
+
+    if not _purge_batches(db[QUEST_DB_NAME].questions, {'questionnaire_id': questionnaire['_id']}, batch_size, progress('questions')):
+        return False
+
+    # There is only one statistics document per Question.
+    db[QUEST_DB_NAME].question_stats.delete_many({'questionnaire_id': questionnaire['_id']})
+
+    return questionnaires.delete_one(claimed).deleted_count == 1
+
+
+def purge_deleted_questionnaires(batch_size=1000, limit=None):
+    """
+    Function to remove from the database the Questionnaires that have been
+    deleted, and the Questions and Answers linked to them.
+
+    Every Questionnaire is claimed with a lease before it is purged, so several
+    purgers (e.g. one per worker) can run at the same time. A Questionnaire
+    whose lease has expired, because its purger stopped, is claimed again and
+    its purge continues where it was left.
+
+    Returns the number of Questionnaires removed.
+    """
+
+    QUEST_DB_NAME = str(db_name)
+
+    lease_seconds = current_app.config.get('QUEST_PURGE_LEASE_SECONDS', 60)
+    purged = 0
+
+    while limit is None or purged < limit:
+        now = datetime.utcnow()
+        lease = ObjectId()
+
+        # Claim a deleted Questionnaire that nobody else is purging.
+        questionnaire = db[QUEST_DB_NAME].questionnaires.find_one_and_update(
+            {
+                'deleted_at': {'$exists': True},
+                '$or': [{'purge.lease_until': {'$exists': False}}, {'purge.lease_until': {'$lt': now}}]
+            },
+            {
+                '$set': {'purge.lease': lease, 'purge.lease_until': now + timedelta(seconds=lease_seconds)},
+                '$min': {'purge.started_at': now}
+            },
+            {'questions._id': 1},
+            sort=[('deleted_at', 1)]
+        )
+
+        if questionnaire is None:
+            break
+
+        if purge_questionnaire(questionnaire, lease, batch_size):
+            purged += 1
+
+    return purged
+
+
+def get_purge_progress():
+    """
+    Function to get the deleted Questionnaires that haven't been purged yet,
+    with the progress of their purge.
+    """
+
+    QUEST_DB_NAME = str(db_name)
+
+    return list(db[QUEST_DB_NAME].questionnaires.find(
+        {'deleted_at': {'$exists': True}},
+        {'title': 1, 'user_id': 1, 'deleted_at': 1, 'purge': 1}
+    ).sort('deleted_at', 1))
+
+
+# MIGRATIONS
+def embed_questions(batch_size=500):
+    """
+    Function to copy the Questions of every Questionnaire from the "questions"
+    collection into an embedded "questions" array in the Questionnaire.
+
+    Questionnaires that already have the array are skipped, so it can be run
+    more than once. The "questions" collection is left untouched.
+
+    Returns the number of Questionnaires that were migrated.
+    """
+
+    QUEST_DB_NAME = str(db_name)
+
+    migrated = 0
+    operations = []
+
+    # Go through the Questionnaires that haven't been migrated yet.
+    for questionnaire in db[QUEST_DB_NAME].questionnaires.find({'questions': {'$exists': False}}, {'_id': 1}):
+
+        # Get the Questions of the Questionnaire, without the now redundant 'questionnaire_id'.
+        questions = list(db[QUEST_DB_NAME].questions.find(
+            {'questionnaire_id': questionnaire['_id']},
+            {'questionnaire_id': 0, 'owner': 0}
+        ))
+
+        operations.append(UpdateOne(
+            {'_id': questionnaire['_id'], 'questions': {'$exists': False}},
+            {'$set': {'questions': questions}}
+        ))
+
+        # Send the updates in batches.
+        if len(operations) >= batch_size:
+            migrated += db[QUEST_DB_NAME].questionnaires.bulk_write(operations, ordered=False).modified_count
+            operations = []
+
+    if operations:
+        migrated += db[QUEST_DB_NAME].questionnaires.bulk_write(operations, ordered=False).modified_count
+
+    # The cached definitions have the previous layout.
+    definition_cache.clear()
+
+    return migrated
+
+
+def migrate_sessions(batch_size=500):
+    """
+    Function to move the Refresh Tokens of the users' "refresh_tokens" arrays
+    into the "sessions" collection, and remove the arrays from the users.
+
+    Expired tokens are dropped instead of moved. Sessions that already exist
+    are left untouched, so it can be run more than once.
+
+    Returns a tuple with the number of users migrated and sessions created.
+    """
+
+    QUEST_DB_NAME = str(db_name)
+
+    migrated = 0
+    created = 0
+    user_ids = []
+    operations = []
+
+    def flush():
+        # The sessions have to be saved before the arrays are removed.
+        upserted = 0
+        if operations:
+            upserted = db[QUEST_DB_NAME].sessions.bulk_write(operations, ordered=False).upserted_count
+
+        db[QUEST_DB_NAME].users.update_many({'_id': {'$in': user_ids}}, {'$unset': {'refresh_tokens': ''}})
+
+        return upserted
+
+    now = datetime.utcnow()
+
+    # Go through the users that haven't been migrated yet.
+    for user in db[QUEST_DB_NAME].users.find({'refresh_tokens': {'$exists': True}}, {'username': 1, 'refresh_tokens': 1}):
+
+        for refresh_token in user.get('refresh_tokens') or []:
+            session = new_session(user.get('username'), user.get('_id'), refresh_token)
+
+            # Skip the tokens that have already expired.
+            if session['expires_at'] > now:
+                operations.append(UpdateOne({'_id': session['_id']}, {'$setOnInsert': session}, upsert=True))
+
+        user_ids.append(user['_id'])
+
+        # Migrate the users in batches.
+        if len(user_ids) >= batch_size:
+            created += flush()
+            migrated += len(user_ids)
+            user_ids = []
+            operations = []
+
+    if user_ids:
+        created += flush()
+        migrated += len(user_ids)
+
+    return migrated, created
+
+
+def backfill_owners(batch_size=500):
+    """
+    Function to store the owner of every Questionnaire in its Questions and
+    Answers, and the ID of the Questionnaire in its Answers.
+
+    Only the documents that don't have an owner yet are updated, so it can be
+    run more than once. Questions and Answers without an owner can't be deleted.
+
+    Returns a tuple with the number of Questions and Answers updated.
+    """
+
+    QUEST_DB_NAME = str(db_name)
+
+    updated_questions = 0
+    updated_answers = 0
+    question_operations = []
+    answer_operations = []
+
+    def flush():
+        questions = answers = 0
+        if question_operations:
+            questions = db[QUEST_DB_NAME].questions.bulk_write(question_operations, ordered=False).modified_count
+        if answer_operations:
+            answers = db[QUEST_DB_NAME].answers.bulk_write(answer_operations, ordered=False).modified_count
+        return questions, answers
+
+    # Go through all the Questionnaires, with their Questions in either layout.
+    for questionnaire in db[QUEST_DB_NAME].questionnaires.find({}, {'user_id': 1, 'questions._id': 1}):
+        owner = questionnaire.get('user_id')
+
+        question_ids = [question['_id'] for question in questionnaire.get('questions', [])]
+        question_ids.extend(
+            question['_id'] for question in db[QUEST_DB_NAME].questions.find({'questionnaire_id': questionnaire['_id']}, {'_id': 1})
+        )
+
+        question_operations.append(UpdateMany(
+            {'questionnaire_id': questionnaire['_id'], 'owner': {'$exists': False}},
+            {'$set': {'owner': owner}}
+        ))
+
+        if question_ids:
+            answer_operations.append(UpdateMany(
+                {'question_id': {'$in': question_ids}, 'owner': {'$exists': False}},
+                {'$set': {'owner': owner, 'questionnaire_id': questionnaire['_id']}}
+            ))
+
+        # Send the updates in batches.
+        if len(question_operations) >= batch_size:
+            questions, answers = flush()
+            updated_questions += questions
+            updated_answers += answers
+            question_operations = []
+            answer_operations = []
+
+    questions, answers = flush()
+    updated_questions += questions
+    updated_answers += answers
+
+    return updated_questions, updated_answers
+
+
+def recount_questionnaires(batch_size=500):
+    """
+    Function to set the 'question_count' and 'answer_count' counters of every
+    Questionnaire from its Questions and Answers.
+
+    The counters are kept up to date by every write since they were added, so it
+    only has to be run once for the Questionnaires created before, or to fix them.
+    The Answers are counted by their 'questionnaire_id', so "flask migrate owners"
+    has to be run first on older databases.
+
+    Returns the number of Questionnaires whose counters were changed.
+    """
+
+    QUEST_DB_NAME = str(db_name)
+
+    updated = 0
+    batch = []
+
+    def flush():
+        ids = [questionnaire['_id'] for questionnaire in batch]
+
+        # Count the Answers, and the Questions not embedded, of the whole batch at once.
+        answer_counts = {
+            count['_id']: count['count'] for count in db[QUEST_DB_NAME].answers.aggregate(count_pipeline('questionnaire_id', ids))
+        }
+        question_counts = {
+            count['_id']: count['count'] for count in db[QUEST_DB_NAME].questions.aggregate(count_pipeline('questionnaire_id', ids))
+        }
+
+        operations = [
+            UpdateOne(
+                {'_id': questionnaire['_id']},
+                {'$set': {
+                    'question_count': len(questionnaire.get('questions', [])) + question_counts.get(questionnaire['_id'], 0),
+                    'answer_count': answer_counts.get(questionnaire['_id'], 0)
+                }}
+            )
+            for questionnaire in batch
+        ]
+
+        return db[QUEST_DB_NAME].questionnaires.bulk_write(operations, ordered=False).modified_count
+
+    # Go through the Questionnaires that haven't been deleted, with their embedded Questions if any.
+    for questionnaire in db[QUEST_DB_NAME].questionnaires.find(not_deleted({}), {'questions._id': 1}):
+        batch.append(questionnaire)
+
+        # Send the updates in batches.
+        if len(batch) >= batch_size:
+            updated += flush()
+            batch = []
+
+    if batch:
+        updated += flush()
+
+    return updated
@@ -0,0 +1,174 @@
+from datetime import datetime
+
+# Documents, queries and updates written to and read from the database. Like the
+# pipelines in app/pipelines.py, they don't depend on the application context nor
+# on the driver, so they are shared by the WSGI (app.db) and the ASGI (app.aio.db)
+# applications, which only differ in how they send them to the database.
+
+# Fields of a user that are never cached nor kept in the current user.
+CACHED_USER_PROJECTION = {
+    'password': False,
+    'refresh_tokens': False
+}
+
+# Fields of a Questionnaire left out of its definition. They change with every
+# Answer, and the definition has to stay valid until a Question changes. The IDs
+# of the deleted Questions are only used by the updates that count new Answers.
+DEFINITION_PROJECTION = {
+    'version': 0,
+    'question_count': 0,
+    'answer_count': 0,
+    'deleted_questions': 0
+}
+
+
+def user_query(email=None, username=None):
+    """
+    Function to build the query of the user with the given 'email' and/or 'username'.
+    """
+
+    return {
+        '$and': [
+            {'email': email if email is not None else {'$exists': True}},
+            {'username': username if username is not None else {'$exists': True}},
+        ]
+    }
+
+
+def new_user(email, username, password_hash):
+    """
+    Function to build a new user, with the hash of their password.
+    """
+
+    return {
+        'username': username,
+        'email': email,
+        'password': password_hash,
+    }
+
+
+def session_user(session):
+    """
+    Function to get the user of a session, with only its '_id' and 'username',
+    or None if there is no session.
+    """
+
+    if session is None:
+        return None
+
+    return {
+        '_id': session.get('user_id'),
+        'username': session.get('username')
+    }
+
+
+def definition_cache_key(db_name, kind, object_id):
+    """
+    Function to build the key of a definition in the definition cache. Both
+    applications use the same keys, so they can share the shared tier.
+    """
+
+    return '{}:{}:{}'.format(db_name, kind, object_id)
+
+
+def new_questionnaire(title, user_id, question_count=0):
+    """
+    Function to build a new Questionnaire, with the counters of its Questions and Answers.
+    """
+
+    return {
+        'title': title,
+        'user_id': user_id,
+        'question_count': question_count,
+        'answer_count': 0
+    }
+
+
+def deletion_update():
+    """
+    Function to build the update that marks a Questionnaire as deleted, which
+    hides it until it is purged, and changes its version.
+    """
+
+    return {
+        '$set': {'deleted_at': datetime.utcnow()},
+        '$inc': {'version': 1}
+    }
+
+
+def new_question(text, type, options=None):
+    """
+    Function to build a new Question, without the fields that link it to its
+    Questionnaire, which depend on the layout of the Questions.
+    """
+
+    question = {
+        'text': text,
+        'type': type
+    }
+
+    # If there are options, add them to the question.
+    if options is not None:
+        question['options'] = options
+
+    return question
+
+
+def new_answer(question_id, questionnaire_id, owner, value):
+    """
+    Function to build a new Answer, with its Questionnaire and owner, so they
+    can be checked without a $lookup.
+    """
+
+    return {
+        'question_id': question_id,
+        'questionnaire_id': questionnaire_id,
+        'owner': owner,
+        'value': value
+    }
+
+
+def project_fields(document, fields):
+    """
+    Function to get a copy of a 'document' with only its '_id' and the given
+    'fields', or all of them if 'fields' is None.
+
+    It always returns a copy, so the result can be changed without changing a
+    document stored in a cache.
+    """
+
+    if fields is None:
+        return dict(document)
+
+    return {key: value for key, value in document.items() if key == '_id' or key in fields}
+
+
+def split_page(documents, limit):
+    """
+    Function to split the 'documents' read with one extra document into the page
+    of 'limit' documents and the cursor of the next page, which is None if this
+    is the last page.
+    """
+
+    if len(documents) <= limit:
+        return documents, None
+
+    documents = documents[:limit]
+
+    return documents, str(documents[-1].get('_id'))
+
+
+def questionnaire_not_found(questionnaire_id):
+    """
+    Function to build the error returned when a Questionnaire can't be found.
+    """
+
+    return {'message': "Could't find questionnaire with the given Questionnaire ID: {}.".format(questionnaire_id)}
+
+
+def question_not_found(question_id):
+    """
+    Function to build the error returned when a Question can't be found.
+    """
+
+    return {'message': "Could't find question with the given Question ID: {}.".format(question_id)}
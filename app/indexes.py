@@ -0,0 +1,125 @@
+from pymongo import ASCENDING, IndexModel
+
+
+# Indexes required by the queries in app/db.py, grouped by collection.
+# The "name" of every index is set explicitly so that the declared indexes
+# can be compared with the ones that exist in the database.
+INDEXES = {
+    'users': [
+        # get_user() by username and/or email. Both have to be unique.
+        IndexModel([('username', ASCENDING)], name='username_unique', unique=True),
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True),
+
+    ],
+    'sessions': [
+        # Sessions are looked up by the hash of their current token. Sessions saved
+        # before the tokens were rotated in place don't have it, and use their "_id".
+        IndexModel([('token', ASCENDING)], name='token_unique', unique=True, sparse=True),
+
+        # sign_out_all() deletes all the sessions of a user.
+        IndexModel([('username', ASCENDING)], name='username'),
+
+        # Remove the sessions once their Refresh Token expires.
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl', expireAfterSeconds=0),
+    ],
+    'revocations': [
+        # Remove the revocations once the Access Tokens they revoke have expired.
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl', expireAfterSeconds=0),
+    ],
+    'questionnaires': [
+        # get_questionnaires() matches on the owner and sorts by "_id".
+        IndexModel([('user_id', ASCENDING), ('_id', ASCENDING)], name='user_id__id'),
+
+        # find_question() in embedded mode (QUEST_EMBEDDED_QUESTIONS).
+        IndexModel([('questions._id', ASCENDING)], name='questions__id'),
+
+        # purge_deleted_questionnaires() claims the oldest deleted Questionnaire.
+        IndexModel([('deleted_at', ASCENDING)], name='deleted_at', sparse=True),
+    ],
+    'questions': [
+        # $lookup from "questionnaires" into "questions".
+        IndexModel([('questionnaire_id', ASCENDING)], name='questionnaire_id'),
+    ],
+    'answers': [
+        # $lookup from "questions" into "answers".
+        IndexModel([('question_id', ASCENDING)], name='question_id'),
+
+        # purge_questionnaire() deletes the Answers of a Questionnaire in batches.
+        IndexModel([('questionnaire_id', ASCENDING)], name='questionnaire_id'),
+    ],
+    'question_stats': [
+        # get_questionnaire_stats() reads the statistics of all the Questions of a Questionnaire.
+        IndexModel([('questionnaire_id', ASCENDING)], name='questionnaire_id'),
+    ],
+}
+
+
+def ensure_indexes(database):
+    """
+    Function to create all the declared indexes in the given 'database'.
+
+    Creating an index that already exists with the same options is a no-op,
+    so this function can be called on every start of the application.
+
+    Returns a dictionary with the names of the indexes of every collection.
+    """
+
+    created = {}
+
+    for collection, indexes in INDEXES.items():
+        created[collection] = database[collection].create_indexes(indexes)
+
+    return created
+
+
+def index_drift(database):
+    """
+    Function to compare the declared indexes with the ones that exist in
+    the given 'database'.
+
+    Returns a dictionary with one entry per collection that has any drift:
+
+    - 'missing': declared indexes that don't exist in the database.
+    - 'changed': indexes that exist with a different key or options.
+    - 'extra': indexes in the database that are not declared here.
+    """
+
+    drift = {}
+
+    for collection, indexes in INDEXES.items():
+
+        # Get the indexes that exist in the database, without the default "_id" index.
+        existing = database[collection].index_information()
+        existing.pop('_id_', None)
+
+        missing = []
+        changed = []
+
+        for index in indexes:
+            document = index.document
+            name = document['name']
+
+            # The index doesn't exist in the database.
+            if name not in existing:
+                missing.append(name)
+                continue
+
+            # The index exists, check that the key and options are the same.
+            info = existing.pop(name)
+            if (list(document['key'].items()) != list(info['key'])
+                    or document.get('unique', False) != info.get('unique', False)
+                    or document.get('sparse', False) != info.get('sparse', False)
+                    or document.get('expireAfterSeconds') != info.get('expireAfterSeconds')):
+                changed.append(name)
+
+        # Any index left in "existing" is not declared.
+        extra = list(existing)
+
+        if missing or changed or extra:
+            drift[collection] = {
+                'missing': missing,
+                'changed': changed,
+                'extra': extra,
+            }
+
+    return drift
@@ -0,0 +1,254 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+from flask import Response, g, has_request_context, request
+from pymongo import monitoring
+
+# Upper bounds (in seconds) of the buckets of the latency histograms.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Quantiles reported for the request latency of every endpoint.
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Metric families exported for every cache: name, key of its statistics, type and help.
+CACHE_FAMILIES = (
+    ('quest_cache_hits_total', 'hits', 'counter', 'Cache hits.'),
+    ('quest_cache_misses_total', 'misses', 'counter', 'Cache misses.'),
+    ('quest_cache_size', 'size', 'gauge', 'Entries in the cache.'),
+)
+
+# Media type of the Prometheus text format.
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """
+    Latency histogram with cumulative buckets, like a Prometheus histogram.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        Method to return the (upper bound, cumulative count) of every bucket, including "+Inf".
+        """
+
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class Summary:
+    """
+    Latency summary that computes its quantiles over the latest observations.
+    """
+
+    def __init__(self, window=1024):
+        self.values = deque(maxlen=window)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.values.append(value)
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        values = sorted(self.values)
+        if not values:
+            return float('nan')
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class Metrics:
+    """
+    Registry of the metrics of this process: Mongo commands, requests and caches.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # Mongo commands, keyed by (endpoint, command, collection).
+        self.command_latency = {}
+        self.command_documents = {}
+        self.command_failures = {}
+
+        # Request latency, keyed by endpoint.
+        self.request_latency = {}
+
+        # Caches whose hit and miss counters are exported, keyed by name.
+        self.caches = {}
+
+    def observe_command(self, labels, duration, documents):
+        with self._lock:
+            self.command_latency.setdefault(labels, Histogram()).observe(duration)
+            self.command_documents[labels] = self.command_documents.get(labels, 0) + documents
+
+    def observe_command_failure(self, labels, duration):
+        with self._lock:
+            self.command_latency.setdefault(labels, Histogram()).observe(duration)
+            self.command_failures[labels] = self.command_failures.get(labels, 0) + 1
+
+    def observe_request(self, endpoint, duration):
+        with self._lock:
+            self.request_latency.setdefault(endpoint, Summary()).observe(duration)
+
+    def register_cache(self, name, cache):
+        with self._lock:
+            self.caches[name] = cache
+
+    def render(self):
+        """
+        Method to export all the metrics in the Prometheus text format.
+        """
+
+        lines = []
+
+        with self._lock:
+            lines.append('# HELP quest_mongo_command_duration_seconds Latency of the Mongo commands.')
+            lines.append('# TYPE quest_mongo_command_duration_seconds histogram')
+            for labels, histogram in sorted(self.command_latency.items()):
+                for bound, count in histogram.cumulative():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('quest_mongo_command_duration_seconds_bucket{{{},le="{}"}} {}'.format(_command_labels(labels), le, count))
+                lines.append('quest_mongo_command_duration_seconds_sum{{{}}} {}'.format(_command_labels(labels), histogram.sum))
+                lines.append('quest_mongo_command_duration_seconds_count{{{}}} {}'.format(_command_labels(labels), histogram.count))
+
+            lines.append('# HELP quest_mongo_command_documents_total Documents returned or written by the Mongo commands.')
+            lines.append('# TYPE quest_mongo_command_documents_total counter')
+            for labels, documents in sorted(self.command_documents.items()):
+                lines.append('quest_mongo_command_documents_total{{{}}} {}'.format(_command_labels(labels), documents))
+
+            lines.append('# HELP quest_mongo_command_failures_total Failed Mongo commands.')
+            lines.append('# TYPE quest_mongo_command_failures_total counter')
+            for labels, failures in sorted(self.command_failures.items()):
+                lines.append('quest_mongo_command_failures_total{{{}}} {}'.format(_command_labels(labels), failures))
+
+            lines.append('# HELP quest_http_request_duration_seconds Latency of the requests, by endpoint.')
+            lines.append('# TYPE quest_http_request_duration_seconds summary')
+            for endpoint, summary in sorted(self.request_latency.items()):
+                label = 'endpoint="{}"'.format(_escape(endpoint))
+                for q in QUANTILES:
+                    lines.append('quest_http_request_duration_seconds{{{},quantile="{}"}} {}'.format(label, q, summary.quantile(q)))
+                lines.append('quest_http_request_duration_seconds_sum{{{}}} {}'.format(label, summary.sum))
+                lines.append('quest_http_request_duration_seconds_count{{{}}} {}'.format(label, summary.count))
+
+            caches = sorted(self.caches.items())
+
+        # The statistics of every cache are read once, so its three families agree.
+        stats = [('cache="{}"'.format(_escape(name)), cache.stats()) for name, cache in caches]
+
+        for family, key, kind, description in CACHE_FAMILIES:
+            lines.append('# HELP {} {}'.format(family, description))
+            lines.append('# TYPE {} {}'.format(family, kind))
+            for label, values in stats:
+                lines.append('{}{{{}}} {}'.format(family, label, values[key]))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    """
+    Function to escape a label value for the Prometheus text format.
+    """
+
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _command_labels(labels):
+    endpoint, command, collection = labels
+    return 'endpoint="{}",command="{}",collection="{}"'.format(_escape(endpoint), _escape(command), _escape(collection))
+
+
+# Metrics of this process.
+metrics = Metrics()
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    PyMongo command listener that records the latency, the number of documents
+    and the failures of every command, tagged with the Flask endpoint that sent it.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._started = {}
+
+    def started(self, event):
+        # The listener runs in the thread that sends the command,
+        # so the request that issued it is still the current one.
+        if has_request_context():
+            endpoint = request.endpoint or 'unknown'
+        else:
+            endpoint = 'none'
+
+        # Name of the collection. "getMore" has the cursor ID as its value.
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get('collection', '')
+
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = (endpoint, event.command_name, collection)
+
+    def _labels(self, event):
+        with self._lock:
+            return self._started.pop(
+                (event.connection_id, event.request_id),
+                ('unknown', event.command_name, '')
+            )
+
+    def succeeded(self, event):
+        self.registry.observe_command(self._labels(event), event.duration_micros / 1e6, _documents(event.reply))
+
+    def failed(self, event):
+        self.registry.observe_command_failure(self._labels(event), event.duration_micros / 1e6)
+
+
+def _documents(reply):
+    """
+    Function to get the number of documents returned (reads) or written (writes) by a command.
+    """
+
+    cursor = reply.get('cursor')
+    if cursor is not None:
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+    return reply.get('n', 0)
+
+
+# Listener registered with the MongoClient.
+command_listener = MongoCommandListener(metrics)
+
+
+def init_metrics(app):
+    """
+    Function to record the latency of every request of the given 'app' and
+    serve all the metrics at "/metrics".
+    """
+
+    @app.before_request
+    def start_timer():
+        g._request_start = time.perf_counter()
+
+    @app.teardown_request
+    def record_request_latency(exception=None):
+        start = g.pop('_request_start', None)
+        if start is not None:
+            metrics.observe_request(request.endpoint or 'unknown', time.perf_counter() - start)
+
+    def export_metrics():
+        return Response(metrics.render(), mimetype=PROMETHEUS_MIMETYPE)
+
+    app.add_url_rule('/metrics', 'metrics', export_metrics)
@@ -0,0 +1,374 @@
+from bson.objectid import ObjectId
+
+# Aggregation pipelines used to read the database. They don't depend on the
+# application context, so they are shared by the WSGI (app.db) and the
+# ASGI (app.aio.db) applications.
+
+# Elements linked to a Questionnaire that are returned by default.
+INCLUDE_ALL = frozenset(('questions', 'answers'))
+
+
+def not_deleted(query):
+    """
+    Function to add to the given Questionnaire 'query' the condition that leaves
+    out the Questionnaires that have been deleted but not purged yet.
+    """
+
+    return dict(query, deleted_at={'$exists': False})
+
+
+def accepts_answers(questionnaire_id, question_ids, embedded):
+    """
+    Function to build the query of the Questionnaire with the given ID, only if
+    it hasn't been deleted and none of the Questions with the given IDs has been
+    deleted from it, depending on whether the Questions are 'embedded' or not.
+
+    It is used by the update that counts the new Answers, before they are saved,
+    so a Question read from a stale cached definition can't get new Answers.
+    """
+
+    query = not_deleted({'_id': ObjectId(questionnaire_id)})
+
+    if embedded:
+        query['questions._id'] = {'$all': question_ids}
+    else:
+        query['deleted_questions'] = {'$nin': question_ids}
+
+    return query
+
+
+def counters_update(questions=0, answers=0):
+    """
+    Function to build the $inc that increases the version of a Questionnaire and
+    adds the given number of 'questions' and 'answers' to its counters.
+    """
+
+    update = {'version': 1}
+
+    if questions:
+        update['question_count'] = questions
+    if answers:
+        update['answer_count'] = answers
+
+    return update
+
+
+def answers_lookup():
+    """
+    Function to build the $lookup stage that joins a Question with its Answers.
+    """
+
+    return {
+        '$lookup': {
+            'from': 'answers', 
+            'let': {
+                'quest_id': '$_id'
+            }, 
+            'pipeline': [
+                {
+                    '$match': {
+                        '$expr': {
+                            '$eq': [
+                                '$question_id', '$$quest_id'
+                            ]
+                        }
+                    }
+                }
+            ], 
+            'as': 'answers'
+        }
+    }
+
+
+def questions_lookup(answers=True):
+    """
+    Function to build the $lookup stage that joins a Questionnaire with its Questions,
+    and every Question with its Answers if 'answers' is True.
+    """
+
+    # Without the Answers, it is a plain equality match on the indexed "questionnaire_id".
+    if not answers:
+        return {
+            '$lookup': {
+                'from': 'questions',
+                'localField': '_id',
+                'foreignField': 'questionnaire_id',
+                'as': 'questions'
+            }
+        }
+
+    return {
+        '$lookup': {
+            'from': 'questions', 
+            'let': {
+                'questner_id': '$_id'
+            }, 
+            'pipeline': [
+                {
+                    '$match': {
+                        '$expr': {
+                            '$eq': [
+                                '$questionnaire_id', '$$questner_id'
+                            ]
+                        }
+                    }
+                },
+                answers_lookup()
+            ], 
+            'as': 'questions'
+        }
+    }
+
+
+def embedded_answers_stages():
+    """
+    Function to build the stages that join the Questions embedded in a Questionnaire
+    with their Answers.
+
+    All the Answers of the Questionnaire are looked up at once, and then every Question
+    gets the ones that belong to it.
+    """
+
+    return [
+        {
+            '$lookup': {
+                'from': 'answers', 
+                'localField': 'questions._id', 
+                'foreignField': 'question_id', 
+                'as': '_answers'
+            }
+        }, {
+            '$addFields': {
+                'questions': {
+                    '$map': {
+                        'input': {'$ifNull': ['$questions', []]},
+                        'as': 'question',
+                        'in': {
+                            '$mergeObjects': [
+                                '$$question',
+                                {
+                                    'answers': {
+                                        '$filter': {
+                                            'input': '$_answers',
+                                            'as': 'answer',
+                                            'cond': {'$eq': ['$$answer.question_id', '$$question._id']}
+                                        }
+                                    }
+                                }
+                            ]
+                        }
+                    }
+                }
+            }
+        }, {
+            '$project': {
+                '_answers': 0
+            }
+        }
+    ]
+
+
+def questions_stages(embedded, include=INCLUDE_ALL):
+    """
+    Function to build the stages that join a Questionnaire with its Questions and
+    their Answers, depending on whether the Questions are 'embedded' or not.
+
+    Only the elements in 'include' are joined: without 'answers' there is no
+    $lookup into the Answers at all.
+    """
+
+    if 'questions' not in include:
+        return []
+
+    if embedded:
+        return embedded_answers_stages() if 'answers' in include else []
+    return [questions_lookup('answers' in include)]
+
+
+def questionnaire_projection(embedded, include=INCLUDE_ALL, fields=None):
+    """
+    Function to build the projection that keeps only the requested 'fields' of a
+    Questionnaire, and its embedded Questions only if they are included.
+
+    The IDs of the deleted Questions are never returned.
+    """
+
+    if fields is not None:
+        projection = dict.fromkeys(fields, 1)
+
+        if embedded and 'questions' in include:
+            projection['questions'] = 1
+
+        return projection
+
+    if embedded and 'questions' not in include:
+        return {'questions': 0, 'deleted_questions': 0}
+
+    return {'deleted_questions': 0}
+
+
+def projection_stages(embedded, include=INCLUDE_ALL, fields=None):
+    """
+    Function to build the $project stage of questionnaire_projection().
+
+    It goes before the $lookup stages, so they only get the fields they need.
+    """
+
+    return [{'$project': questionnaire_projection(embedded, include, fields)}]
+
+
+def questionnaires_page_stages(user_id, after=None, limit=None):
+    """
+    Function to build the stages that select a page of the Questionnaires of the
+    user 'user_id', sorted by their ID and starting after the ID 'after'.
+    """
+
+    # Filter to get the Questionnaires of the user, after the given cursor.
+    match = not_deleted({
+        'user_id': user_id
+    })
+
+    if after is not None:
+        match['_id'] = {'$gt': ObjectId(after)}
+
+    stages = [
+        {
+            '$match': match
+        }, {
+            '$sort': {
+                '_id': 1
+            }
+        }
+    ]
+
+    if limit is not None:
+        stages.append({'$limit': limit})
+
+    return stages
+
+
+def questionnaires_pipeline(user_id, embedded, after=None, limit=None, include=INCLUDE_ALL, fields=None):
+    """
+    Function to build the pipeline that gets the Questionnaires of the user 'user_id',
+    sorted by their ID and starting after the ID 'after'.
+
+    The page is selected before the $lookup stages so that only the Questionnaires
+    in the page are joined. 'include' and 'fields' select what is returned, see
+    questions_stages() and projection_stages().
+    """
+
+    pipeline = questionnaires_page_stages(user_id, after, limit)
+
+    pipeline.extend(projection_stages(embedded, include, fields))
+    pipeline.extend(questions_stages(embedded, include))
+
+    return pipeline
+
+
+def questionnaire_summaries_pipeline(user_id, after=None, limit=None):
+    """
+    Function to build the pipeline that gets a page of the Questionnaires of the
+    user 'user_id' as summaries: their title and the number of Questions and Answers.
+
+    The numbers come from the counters kept in every Questionnaire, so nothing
+    is joined and the size of a summary doesn't grow with the Answers.
+    """
+
+    pipeline = questionnaires_page_stages(user_id, after, limit)
+
+    pipeline.append({
+        '$project': {
+            'title': 1,
+            'question_count': {'$ifNull': ['$question_count', 0]},
+            'answer_count': {'$ifNull': ['$answer_count', 0]}
+        }
+    })
+
+    return pipeline
+
+
+def questionnaire_pipeline(questner_id, embedded, include=INCLUDE_ALL, fields=None):
+    """
+    Function to build the pipeline that gets the Questionnaire with the given ID,
+    with its Questions and their Answers, or only the ones in 'include'.
+    """
+
+    return [
+        {
+            '$match': not_deleted({
+                '_id': ObjectId(questner_id)
+            })
+        },
+        *projection_stages(embedded, include, fields),
+        *questions_stages(embedded, include)
+    ]
+
+
+def count_pipeline(field, values):
+    """
+    Function to build the pipeline that counts the documents whose 'field' is
+    one of the given 'values', grouped by that field.
+    """
+
+    return [
+        {
+            '$match': {
+                field: {'$in': values}
+            }
+        }, {
+            '$group': {
+                '_id': '$' + field,
+                'count': {'$sum': 1}
+            }
+        }
+    ]
+
+
+def answer_tallies_pipeline(question_ids):
+    """
+    Function to build the pipeline that counts the Answers of the given Questions,
+    grouped by Question and value, with the total number of Answers per Question.
+    """
+
+    # Single values are wrapped in an array so 'many_of' Answers can be unwound into
+    # their values. 'position' is used to count every Answer once, whatever its
+    # number of values.
+    return [
+        {
+            '$match': {
+                'question_id': {'$in': question_ids}
+            }
+        }, {
+            '$project': {
+                'question_id': 1,
+                'value': {
+                    '$cond': [{'$isArray': '$value'}, '$value', ['$value']]
+                }
+            }
+        }, {
+            '$unwind': {
+                'path': '$value',
+                'includeArrayIndex': 'position',
+                'preserveNullAndEmptyArrays': True
+            }
+        }, {
+            '$group': {
+                '_id': {
+                    'question_id': '$question_id',
+                    'value': '$value'
+                },
+                'count': {'$sum': 1},
+                'answers': {
+                    '$sum': {'$cond': [{'$lte': ['$position', 0]}, 1, 0]}
+                }
+            }
+        }, {
+            '$group': {
+                '_id': '$_id.question_id',
+                'total': {'$sum': '$answers'},
+                'options': {
+                    '$push': {'value': '$_id.value', 'count': '$count'}
+                }
+            }
+        }
+    ]
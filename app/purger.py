@@ -0,0 +1,52 @@
+import os
+import threading
+import time
+
+from app.db import purge_deleted_questionnaires
+
+
+def init_purger(app):
+    """
+    Function to run purge_deleted_questionnaires() in a background thread of
+    every process of the given 'app', every "QUEST_PURGE_INTERVAL" seconds.
+
+    The thread is started by the first request that every process serves, so
+    it is never started before uWSGI forks the workers. With an interval of 0
+    nothing is started, and the purge has to be run with "flask questionnaires purge".
+    """
+
+    interval = app.config.get('QUEST_PURGE_INTERVAL', 0)
+
+    if interval <= 0:
+        return
+
+    batch_size = app.config.get('QUEST_PURGE_BATCH_SIZE', 1000)
+
+    # PID of the process whose thread has been started.
+    started = {'pid': None}
+    lock = threading.Lock()
+
+    def run():
+        while True:
+            time.sleep(interval)
+
+            try:
+                with app.app_context():
+                    purged = purge_deleted_questionnaires(batch_size)
+
+                if purged:
+                    app.logger.info('Purged %d deleted questionnaires.', purged)
+
+            except Exception:
+                # Keep the thread alive, the purge will be retried on the next run.
+                app.logger.exception('The purge of the deleted questionnaires failed.')
+
+    @app.before_request
+    def start_purger():
+        if started['pid'] == os.getpid():
+            return
+
+        with lock:
+            if started['pid'] != os.getpid():
+                threading.Thread(target=run, name='questionnaire-purger', daemon=True).start()
+                started['pid'] = os.getpid()
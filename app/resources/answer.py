@@ -1,5 +1,6 @@
 from flask_restx import Resource
 from flask import request
+from marshmallow import ValidationError
 from marshmallow.utils import pprint
 
 from app.security import token_required
@@ -18,8 +19,12 @@ class Answer(Resource):
         # Validate the information
         validated_data = Answer.answer_schema.load(request_data)
 
-        # Save the new answer in the database
-        result = create_answer(**validated_data)
+        # Save the new answer in the database. The value is checked
+        # against the type and options of the question.
+        try:
+            result = create_answer(**validated_data)
+        except ValidationError as error:
+            return {'message': error.messages}, 400
 
         # If the insertion has been acknowledged by the database and an ID
         # has been created for the new answer, return a success message.
@@ -1,9 +1,9 @@
 from flask import current_app, make_response, request
 from datetime import datetime, timedelta
 from flask_restx import Resource
-from werkzeug.security import check_password_hash
-import jwt
 
+from app.common.hashing import HashingOverloaded, password_hasher
+from app.common.tokens import encode_access_token, encode_refresh_token
 from app.db import add_session, get_user, get_user_with_rt, sign_out_all, sign_out_session
 
 from app.schemas.user_schema import LogUserSchema
@@ -62,30 +62,27 @@ class Auth(Resource):
         if user is None:
             return {'message': 'Wrong user and/or password.'}, 401
 
+        # Check the password in the hashing pool. If it is full, ask the
+        # client to retry later instead of waiting for a free worker.
+        try:
+            password_matches = password_hasher.check_password(user.get('password'), data.get('password'))
+        except HashingOverloaded as error:
+            return {'message': 'The server is busy. Please try again later.'}, 503, {'Retry-After': str(error.retry_after)}
+
          # If the given password matches the given user's password,
          # send back the JWToken.
-        if check_password_hash(user.get('password'), data.get('password')):
+        if password_matches:
             
             # Encode the Access Token using the application's Secret Key
-            # with the username and expiration in the payload.
-            access_token = jwt.encode(
-                {
-                    'username': user.get('username'),
-                    'exp': datetime.utcnow() + timedelta(seconds=10)
-                },
-                current_app.config['SECRET_KEY'],
-                algorithm="HS256"
+            # with the user, the issue time and expiration in the payload.
+            access_token = encode_access_token(
+                user.get('username'), user.get('_id'), current_app.config['SECRET_KEY'], timedelta(seconds=10)
             )
             
             # Encode the Refresh Token using the application's Secret Key
             # with the username and expiration in the payload.
-            new_refresh_token = jwt.encode(
-                {
-                'username': user.get('username'),
-                'exp': datetime.utcnow() + timedelta(minutes=1)
-                },
-                current_app.config['REFRESH_TOKEN_KEY'],
-                algorithm="HS256"
+            new_refresh_token = encode_refresh_token(
+                user.get('username'), current_app.config['REFRESH_TOKEN_KEY'], timedelta(minutes=1)
             )
             
             # Create a response with the user_id and accessToken that will be
@@ -103,11 +100,13 @@ class Auth(Resource):
 
             print('[New Refresh Token]: {}'.format(new_refresh_token))
 
-            # Add the Refresh Token to the user's Refresh Token list
-            add_session_result = add_session(username=user.get('username'), refresh_token=new_refresh_token)
+            # Save the session of the new Refresh Token
+            add_session_result = add_session(
+                username=user.get('username'), refresh_token=new_refresh_token, user_id=user.get('_id')
+            )
 
             # Confirm the Refresh Token was saved
-            if add_session_result is None or add_session_result.modified_count != 1:
+            if add_session_result is None or add_session_result.inserted_id is None:
                 return {
                     'message': 'Server could not save the session. Please try logging in again'}, 500
 
@@ -0,0 +1,47 @@
+from flask_restx import Resource
+from flask import Response, current_app, request, stream_with_context
+
+from app.security import token_required
+from app.db import iter_questionnaire_answers
+from app.common.export import EXPORT_MIMETYPES, answer_columns, answer_rows, csv_stream, parquet_available, parquet_stream
+
+class Export(Resource):
+
+    @token_required
+    def get(self, questner_id):
+        # Get the format of the export, CSV by default.
+        export_format = request.args.get('format', 'csv').lower()
+
+        if export_format not in EXPORT_MIMETYPES:
+            return {'message': "The format must be one of: {}.".format(', '.join(EXPORT_MIMETYPES))}, 400
+
+        if export_format == 'parquet' and not parquet_available():
+            return {'message': "The Parquet export is not available in this server."}, 501
+
+        # Get the questionnaire and a cursor over all its answers.
+        batch_size = current_app.config['QUEST_EXPORT_BATCH_SIZE']
+        result = iter_questionnaire_answers(questner_id, batch_size)
+
+        if result is None:
+            return {'message': "The Questionnaire with the given ID could not be found."}, 400
+
+        questionnaire, answers = result
+        questions = questionnaire.get('questions', [])
+
+        # One row per answer and one column per question.
+        columns = answer_columns(questions)
+        rows = answer_rows(questions, answers)
+
+        if export_format == 'parquet':
+            body = parquet_stream(columns, rows, current_app.config['QUEST_EXPORT_ROW_GROUP_SIZE'])
+        else:
+            body = csv_stream(columns, rows, batch_size)
+
+        # Stream the file while the answers are read from the cursor.
+        return Response(
+            stream_with_context(body),
+            mimetype=EXPORT_MIMETYPES[export_format],
+            headers={
+                'Content-Disposition': 'attachment; filename="questionnaire-{}.{}"'.format(questner_id, export_format)
+            }
+        )
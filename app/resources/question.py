@@ -1,17 +1,24 @@
 from flask_restx import Resource
 from flask import request
+from marshmallow import ValidationError
 from marshmallow.utils import pprint
-import json
+from itertools import chain
 
 from app.security import token_required
+from app.schemas.projection_schema import QuestionProjectionSchema
 from app.schemas.question_schema import QuestionSchema
-from app.db import create_question, delete_question, get_question
-from app.common.util import CustomEncoder
+from app.db import create_question, delete_question, get_question, get_question_version, iter_question
+from app.common.encoder import json_response
+from app.common.util import make_etag, ndjson_response, not_modified, projection_tag, wants_ndjson, with_etag
 
 class Question(Resource):
     # Create a QuestionSchema() instance to validate the info
     question_schema = QuestionSchema()
 
+    # Create a QuestionProjectionSchema() instance to validate the
+    # "include" and "fields" parameters of the query string
+    projection_schema = QuestionProjectionSchema()
+
     @token_required
     def post(self):
         # Get the information through the request
@@ -43,11 +50,43 @@ class Question(Resource):
         # TODO Get questionnaire and check if it belongs to the user
         # before sending it back to the them.
 
+        # Validate the elements and fields requested in the query string.
+        try:
+            projection = Question.projection_schema.load(request.args)
+        except ValidationError as error:
+            return {'message': error.messages}, 400
+
+        # Get the version of the question's questionnaire before the question itself,
+        # so a change in between can't be sent with an older ETag.
+        version = get_question_version(question_id)
+
+        if version is None:
+            return {'message': "The Question with the given ID does not exist."}, 400
+
+        # If the client already has this version, don't run the pipeline at all.
+        # Every combination of elements and fields has its own ETag.
+        etag = make_etag(question_id, version, projection_tag(projection, Question.projection_schema.INCLUDE))
+        response = not_modified(etag)
+
+        if response is not None:
+            return response
+
+        # If requested, stream the question as NDJSON: the first line is the
+        # question without its answers, then one line per answer.
+        if wants_ndjson():
+            result = iter_question(question_id, **projection)
+
+            if result is None:
+                return {'message': "The Question with the given ID does not exist."}, 400
+
+            question, answers = result
+            return with_etag(ndjson_response(chain([question], answers)), etag)
+
         # Check if the questionnaire with the given ID exists.
-        question = get_question(question_id)
+        question = get_question(question_id, **projection)
 
         if question is not None:
-            return json.loads(CustomEncoder().encode(question))
+            return with_etag(json_response(question), etag)
 
         else:
             return {'message': "The Question with the given ID does not exist."}, 400
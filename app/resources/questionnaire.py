@@ -1,12 +1,19 @@
-import json
+from itertools import chain
 from flask_restx import Resource
-from flask import request, g
+from flask import current_app, request, g
+from marshmallow import ValidationError
 
+from app.schemas.pagination_schema import QuestionnaireListSchema
+from app.schemas.projection_schema import QuestionnaireProjectionSchema
 from app.schemas.questionnaire_schema import QuestionnaireSchema
-from app.db import create_questionnaire, delete_questionnaire, get_questionnaire, get_questionnaires
+from app.db import (
+    create_questionnaire, delete_questionnaire, get_questionnaire, get_questionnaire_version, get_questionnaires,
+    iter_questionnaire, iter_questionnaires
+)
 from app.security import token_required
 
-from app.common.util import CustomEncoder
+from app.common.encoder import json_response
+from app.common.util import make_etag, ndjson_response, not_modified, projection_tag, wants_ndjson, with_etag
 
 class Questionnaire(Resource):
     # TODO Create the Schema instance for the Questionnaire resource.
@@ -14,6 +21,13 @@ class Questionnaire(Resource):
     # Create an instance of UserSchema() to validate the info
     quest_schema = QuestionnaireSchema()
 
+    # Create an instance of QuestionnaireListSchema() to validate the query string
+    pagination_schema = QuestionnaireListSchema()
+
+    # Create an instance of QuestionnaireProjectionSchema() to validate the
+    # "include" and "fields" parameters of the query string
+    projection_schema = QuestionnaireProjectionSchema()
+
     @token_required
     def post(self):
         # Get the information sent through the request
@@ -39,34 +53,97 @@ class Questionnaire(Resource):
 
     
     @token_required
-    def get(self, questner_id):
+    def get(self, questner_id=None):
+        # If no ID was given, list the questionnaires of the user.
+        if questner_id is None:
+            return Questionnaire.list_questionnaires()
+
         # TODO Get questionnaire and check if it belongs to the user
         # before sending it back to the them.
 
+        # Validate the elements and fields requested in the query string.
+        try:
+            projection = Questionnaire.projection_schema.load(request.args)
+        except ValidationError as error:
+            return {'message': error.messages}, 400
+
+        # Get the version of the questionnaire before the questionnaire itself,
+        # so a change in between can't be sent with an older ETag.
+        version = get_questionnaire_version(questner_id)
+
+        if version is None:
+            return {'message': "The Questionnaire with the given ID could not be found."}, 400
+
+        # If the client already has this version, don't run the pipelines at all.
+        # Every combination of elements and fields has its own ETag.
+        etag = make_etag(questner_id, version, projection_tag(projection, Questionnaire.projection_schema.INCLUDE))
+        response = not_modified(etag)
+
+        if response is not None:
+            return response
+
+        # If requested, stream the questionnaire as NDJSON: the first line is the
+        # questionnaire without its questions, then one line per question.
+        if wants_ndjson():
+            result = iter_questionnaire(questner_id, **projection)
+
+            if result is None:
+                return {'message': "The Questionnaire with the given ID could not be found."}, 400
+
+            questionnaire, questions = result
+            return with_etag(ndjson_response(chain([questionnaire], questions)), etag)
+
         # Check if the questionnaire with the given ID exists.
-        questionnaire = get_questionnaire(questner_id)
+        questionnaire = get_questionnaire(questner_id, **projection)
 
         if questionnaire is not None:
-            return json.loads(CustomEncoder().encode(questionnaire))
+            return with_etag(json_response(questionnaire), etag)
 
         else:
             return {'message': "The Questionnaire with the given ID could not be found."}, 400
 
-    @token_required
-    def get(self):
-        # Get all the questionnaires that belong to the user sending 
+    @staticmethod
+    def list_questionnaires():
+        # Get a page of the questionnaires that belong to the user sending 
         # the request.
 
-        # Get the questionnares from the database that belong to the
+        # Validate the pagination parameters sent in the query string,
+        # and the elements and fields requested.
+        try:
+            pagination = Questionnaire.pagination_schema.load(request.args)
+            projection = Questionnaire.projection_schema.load(request.args)
+        except ValidationError as error:
+            return {'message': error.messages}, 400
+
+        # With the summary view, only the counters stored in the questionnaires are
+        # returned, so the questions and answers are never joined.
+        projection['summary'] = pagination.get('view') == 'summary'
+
+        # Use the default page size if none was given, and never
+        # go over the maximum page size.
+        limit = min(
+            pagination.get('limit', current_app.config['QUEST_PAGE_SIZE']),
+            current_app.config['QUEST_MAX_PAGE_SIZE']
+        )
+
+        # If requested, stream the page of questionnaires as NDJSON, one per line.
+        # Streaming only changes the encoding, the page has the same size.
+        if wants_ndjson():
+            return ndjson_response(iter_questionnaires(pagination.get('after'), limit, **projection))
+
+        # Get the page of questionnaires from the database that belong to the
         # user sending the request.
-        questionnaires = get_questionnaires()
-
-        # If any, return the list of Questionnaires found.
-        if questionnaires is not None:
-            return json.loads(CustomEncoder().encode(questionnaires))
+        questionnaires, next_cursor = get_questionnaires(limit, pagination.get('after'), **projection)
 
         # If none, let the user know.
-        return {'message': "There aren't any Questionnaires available from this user."}
+        if not questionnaires and pagination.get('after') is None:
+            return {'message': "There aren't any Questionnaires available from this user."}
+
+        # Return the page of Questionnaires found and the cursor of the next page.
+        return json_response({
+            'questionnaires': questionnaires,
+            'next': next_cursor
+        })
 
 
     @token_required
@@ -79,5 +156,8 @@ class Questionnaire(Resource):
         # Delete the questionnaire and get the result.
         result = delete_questionnaire(questner_id)
 
-        # return json.loads(CustomEncoder().encode(result))
+        # If it doesn't exist or doesn't belong to the user, let them know.
+        if result is None:
+            return {'message': "The Questionnaire with the given ID could not be found."}, 400
+
         return result
\ No newline at end of file
@@ -0,0 +1,40 @@
+from flask_restx import Resource
+from flask import request, g
+from marshmallow import ValidationError
+
+from app.schemas.questionnaire_schema import QuestionnaireImportSchema
+from app.db import import_questionnaires
+from app.security import token_required
+
+class QuestionnaireImport(Resource):
+
+    # Create an instance of QuestionnaireImportSchema() to validate the info
+    import_schema = QuestionnaireImportSchema()
+
+    @token_required
+    def post(self):
+        # Get the information sent through the request. It can be a single
+        # questionnaire or a list of questionnaires.
+        request_data = request.json
+        many = isinstance(request_data, list)
+
+        # Validate the information
+        try:
+            validated_data = QuestionnaireImport.import_schema.load(request_data, many=many)
+        except ValidationError as error:
+            return {'message': error.messages}, 400
+
+        if not many:
+            validated_data = [validated_data]
+
+        # Save the questionnaires, with all their questions, for the user
+        # sending the request.
+        questionnaire_ids = import_questionnaires(g._current_user.get('username'), validated_data)
+
+        # If any of them couldn't be saved, none was imported. Report which ones failed.
+        if type(questionnaire_ids) is dict:
+            return questionnaire_ids, 400
+
+        return {'message': "Questionnaires imported successfully.",
+                'ids': [str(questionnaire_id) for questionnaire_id in questionnaire_ids]
+                }, 201
@@ -1,9 +1,11 @@
 from datetime import datetime, timedelta
+
 from flask import current_app, make_response, request
 from flask_restx import Resource
 import jwt
 
-from app.db import add_session, get_user_with_rt, sign_out_all, sign_out_session
+from app.common.tokens import encode_access_token, encode_refresh_token
+from app.db import rotate_session, sign_out_all, sign_out_session
 
 class Refresh(Resource):
 
@@ -16,38 +18,6 @@ class Refresh(Resource):
         if refresh_token is None:
             return {'message': 'Refresh Token not found. Please try again.'}, 401
 
-        # Get the user from the Refresh Token.
-        found_user = get_user_with_rt(refresh_token)
-
-        # If a user was not found, this a reused refresh token.
-        if found_user is None:   
-            try:
-                # Get the username from the refresh token
-                decoded_info = jwt.decode(refresh_token, current_app.config['REFRESH_TOKEN_KEY'], algorithms="HS256")
-
-                # Delete all the active sessions from the user
-                sign_out_all(decoded_info['username'])
-
-                # Create a new response with 403 status
-                new_response = make_response(
-                    {
-                        'message': 'Invalid refresh token. Please try again.',
-                        'debug': 'Refresh Token Reuse. Deleted all sessions from db.'
-                    }, 403)
-                
-                # Clear the cookie session
-                new_response.set_cookie('jwt', value='', expires=datetime(1970, 1, 1), httponly=True)
-
-                # Return the response with the cookie cleared out
-                return new_response
-
-            # If the refresh token is expired, return a 403 status
-            except jwt.ExpiredSignatureError:
-                return {
-                        'message': 'Invalid refresh token. Please try again.',
-                        'debug': 'Refresh Token Reuse. Expired Refresh Token.'
-                    }, 403                 
-
         try:
             # Decode the token using the applications Secret Key.
             data = jwt.decode(refresh_token, current_app.config['REFRESH_TOKEN_KEY'], algorithms="HS256")
@@ -56,8 +26,23 @@ class Refresh(Resource):
             decoded_username = data.get('username')
 
         except jwt.ExpiredSignatureError:
+            # Get the username from the expired token, its signature is still checked.
+            expired_info = jwt.decode(
+                refresh_token,
+                current_app.config['REFRESH_TOKEN_KEY'],
+                algorithms="HS256",
+                options={'verify_exp': False}
+            )
+
             # Refresh token is invalid so it needs to be removed from the db
-            sign_out_session(found_user.get('username'), refresh_token)
+            result = sign_out_session(expired_info.get('username'), refresh_token)
+
+            # If there was no session, it was a reused and expired refresh token.
+            if result is None or result.deleted_count == 0:
+                return {
+                        'message': 'Invalid refresh token. Please try again.',
+                        'debug': 'Refresh Token Reuse. Expired Refresh Token.'
+                    }, 403
 
             # Create a new response with the error message and status 403
             expired_rt_response = make_response(
@@ -73,37 +58,36 @@ class Refresh(Resource):
             # Return an error message.
             return expired_rt_response
 
-        if found_user.get('username') != decoded_username:
-            # If the decoded username and the user found in the database are not the same,
-            # return an error.
-            return {'message': 'Invalid user.'}, 403
-        
-        # Delete the existing (used) refresh token from the db
-        sign_out_session(found_user.get('username'), refresh_token)
-
         print('[Creating New Session]')
 
-        # Create a new refresh token for the user
-        new_session = jwt.encode(
-            {
-                'username': found_user.get('username'),
-                'exp': datetime.utcnow() + timedelta(days=1)
-            },
-            current_app.config['REFRESH_TOKEN_KEY'],
-            algorithm="HS256"
-        )
-        
-        # Save the session in the db
-        add_session(found_user.get('username'), new_session)
-
-        # Generate a new access token
-        access_token = jwt.encode(
-            {
-                'username': decoded_username,
-                'exp': datetime.utcnow() + timedelta(minutes=15)
-            },
-            current_app.config['SECRET_KEY'],
-            algorithm="HS256"
+        # Create a new refresh token for the user.
+        new_session = encode_refresh_token(decoded_username, current_app.config['REFRESH_TOKEN_KEY'], timedelta(days=1))
+
+        # Replace the used refresh token with the new one in the db, in a single
+        # operation that only succeeds if the used token is still the current one.
+        found_user = rotate_session(decoded_username, refresh_token, new_session)
+
+        # If a session was not found, this a reused refresh token.
+        if found_user is None:
+            # Delete all the active sessions from the user
+            sign_out_all(decoded_username)
+
+            # Create a new response with 403 status
+            new_response = make_response(
+                {
+                    'message': 'Invalid refresh token. Please try again.',
+                    'debug': 'Refresh Token Reuse. Deleted all sessions from db.'
+                }, 403)
+
+            # Clear the cookie session
+            new_response.set_cookie('jwt', value='', expires=datetime(1970, 1, 1), httponly=True)
+
+            # Return the response with the cookie cleared out
+            return new_response
+
+        # Generate a new access token, with the user and the issue time
+        access_token = encode_access_token(
+            decoded_username, found_user.get('_id'), current_app.config['SECRET_KEY'], timedelta(minutes=15)
         )
 
         # Create a response with the new Access Token
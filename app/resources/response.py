@@ -0,0 +1,48 @@
+from flask_restx import Resource
+from flask import request
+
+from app.security import token_required
+from app.schemas.response_schema import ResponseSchema
+from app.db import create_answers
+
+class Response(Resource):
+    # Create a ResponseSchema() instance to validate the info
+    response_schema = ResponseSchema()
+
+    @token_required
+    def post(self, questner_id):
+        # Get the information through the request
+        request_data = request.json
+
+        # Validate the information
+        validated_data = Response.response_schema.load(request_data)
+
+        # Save all the answers of the response in the database
+        results = create_answers(questner_id, validated_data['answers'])
+
+        # Count the answers that were saved.
+        created = len([item for item in results if item['status'] == 201])
+
+        # All the answers were saved.
+        if created == len(results):
+            return {'message': "Response created successfully.",
+                    'results': results
+                    }, 201
+
+        # Only some of the answers were saved.
+        elif created > 0:
+            return {'message': "Some of the answers could not be saved.",
+                    'results': results
+                    }, 207
+
+        # None of the answers were saved, because their values are not valid.
+        elif all(item['status'] == 400 for item in results):
+            return {'message': "None of the answers are valid.",
+                    'results': results
+                    }, 400
+
+        # None of the answers were saved.
+        else:
+            return {'message': "None of the answers belong to the Questionnaire with the given ID.",
+                    'results': results
+                    }, 404
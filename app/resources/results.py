@@ -0,0 +1,18 @@
+from flask_restx import Resource
+
+from app.security import token_required
+from app.db import get_questionnaire_results
+from app.common.encoder import json_response
+
+class Results(Resource):
+
+    @token_required
+    def get(self, questner_id):
+        # Count the answers of the choice questions of the questionnaire.
+        results = get_questionnaire_results(questner_id)
+
+        if results is not None:
+            return json_response(results)
+
+        else:
+            return {'message': "The Questionnaire with the given ID could not be found."}, 400
@@ -0,0 +1,18 @@
+from flask_restx import Resource
+
+from app.security import token_required
+from app.db import get_questionnaire_stats
+from app.common.encoder import json_response
+
+class Stats(Resource):
+
+    @token_required
+    def get(self, questner_id):
+        # Read the statistics of the questions of the questionnaire.
+        stats = get_questionnaire_stats(questner_id)
+
+        if stats is not None:
+            return json_response(stats)
+
+        else:
+            return {'message': "The Questionnaire with the given ID could not be found."}, 400
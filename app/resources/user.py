@@ -1,6 +1,7 @@
 from flask_restx import Resource
 from flask import request
 
+from app.common.hashing import HashingOverloaded
 from app.db import create_new_user, user_exists
 from app.schemas.user_schema import RegisterUserSchema
 
@@ -26,8 +27,12 @@ class User(Resource):
         elif email_exists:
             return {'message': "Email '{}' is already taken. Please try with a different email.".format(data['email'])}, 409
         
-        # If the user doesn't exist, create it and save it to the database
-        result = create_new_user(**data)
+        # If the user doesn't exist, create it and save it to the database.
+        # If the password hashing queue is full, ask the client to retry later.
+        try:
+            result = create_new_user(**data)
+        except HashingOverloaded as error:
+            return {'message': 'The server is busy. Please try again later.'}, 503, {'Retry-After': str(error.retry_after)}
 
         # If the insertion has been acknowledged by the dataabase and an ID
         # has been created for the new user, return a success message.
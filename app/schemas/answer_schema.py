@@ -8,5 +8,6 @@ class AnswerSchema(Schema):
     # Question ID
     question_id = fields.String(required=True, validate=Length(equal=24))
 
-    # Value (Can be any type as needed)
+    # Value (Can be any type as needed, it is checked against the type and
+    # options of the question by app.common.validators when it is saved)
     value = fields.Raw(required=True)
\ No newline at end of file
@@ -0,0 +1,27 @@
+from bson.objectid import ObjectId
+from marshmallow import Schema, ValidationError, fields
+from marshmallow.utils import EXCLUDE
+from marshmallow.validate import OneOf, Range
+
+def _object_id(value):
+    """
+    Function to check that the cursor is a valid ObjectId, so it can be used in the query.
+    """
+
+    if not ObjectId.is_valid(value):
+        raise ValidationError('Must be a valid ID.')
+
+class PaginationSchema(Schema):
+    # Maximum number of items to return
+    limit = fields.Integer(validate=Range(min=1))
+
+    # Cursor: ID of the last item from the previous page
+    after = fields.String(validate=_object_id)
+
+    class Meta:
+        unknown = EXCLUDE
+
+class QuestionnaireListSchema(PaginationSchema):
+    # How to return every Questionnaire: complete, or only its title
+    # and the number of its Questions and Answers
+    view = fields.String(validate=OneOf(('full', 'summary')), load_default='full')
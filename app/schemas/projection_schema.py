@@ -0,0 +1,75 @@
+from marshmallow import Schema, ValidationError, fields, post_load
+from marshmallow.utils import EXCLUDE
+
+class ProjectionSchema(Schema):
+    # Elements linked to the document that can be included, and
+    # included by default.
+    INCLUDE = ()
+
+    # Fields of the document that can be requested. "_id" is always returned.
+    FIELDS = ()
+
+    # Comma-separated list of the linked elements to return
+    include = fields.String()
+
+    # Comma-separated list of the fields of the document to return
+    field_names = fields.String(data_key='fields')
+
+    class Meta:
+        unknown = EXCLUDE
+
+    @post_load
+    def split_lists(self, data, **kwargs):
+        """
+        Method to turn the comma-separated lists into the 'include' set and the 'fields' list.
+        """
+
+        include = _split(data.get('include'), self.INCLUDE, 'include')
+        field_names = _split(data.get('field_names'), self.FIELDS, 'fields')
+
+        return {
+            # Include everything if the parameter wasn't given.
+            'include': self.expand(frozenset(self.INCLUDE if include is None else include)),
+
+            # Return all the fields if the parameter wasn't given.
+            'fields': field_names
+        }
+
+    def expand(self, include):
+        """
+        Method to add to the 'include' set the elements required by the ones in it.
+        """
+
+        return include
+
+class QuestionnaireProjectionSchema(ProjectionSchema):
+    INCLUDE = ('questions', 'answers')
+    FIELDS = ('title', 'user_id')
+
+    def expand(self, include):
+        # The Answers are returned inside their Questions.
+        if 'answers' in include:
+            return include | {'questions'}
+        return include
+
+class QuestionProjectionSchema(ProjectionSchema):
+    INCLUDE = ('answers',)
+    FIELDS = ('questionnaire_id', 'text', 'type', 'options')
+
+def _split(value, choices, name):
+    """
+    Function to split the comma-separated 'value' of the parameter 'name', checking
+    that every item is one of the given 'choices'. Returns None if there is no value.
+    """
+
+    if value is None:
+        return None
+
+    items = [item.strip() for item in value.split(',') if item.strip()]
+
+    invalid = [item for item in items if item not in choices]
+    if invalid:
+        raise ValidationError('Must be a comma-separated list of: {}.'.format(', '.join(choices)), name)
+
+    # Remove the duplicates, keeping the order.
+    return list(dict.fromkeys(items))
@@ -1,5 +1,5 @@
 from marshmallow import Schema, fields
-from marshmallow.validate import Equal, Length
+from marshmallow.validate import Length
 
 from app.schemas.question_schema import QuestionSchema
 
@@ -14,4 +14,11 @@ class QuestionnaireSchema(Schema):
     user_id = fields.String(required=True)
     
     # List of questions
-    questions = fields.List(fields.Nested(QuestionSchema(only=('_id',))))
\ No newline at end of file
+    questions = fields.List(fields.Nested(QuestionSchema(only=('_id',))))
+
+class QuestionnaireImportSchema(QuestionnaireSchema):
+    # User ID (Taken from the user sending the request)
+    user_id = fields.String()
+
+    # List of questions, with all their information
+    questions = fields.List(fields.Nested(QuestionSchema(exclude=('_id', 'questionnaire_id'))), required=True)
\ No newline at end of file
@@ -0,0 +1,8 @@
+from marshmallow import Schema, fields
+from marshmallow.validate import Length
+
+from app.schemas.answer_schema import AnswerSchema
+
+class ResponseSchema(Schema):
+    # Answers of the filled-out questionnaire
+    answers = fields.List(fields.Nested(AnswerSchema(only=('question_id', 'value'))), required=True, validate=Length(min=1))
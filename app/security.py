@@ -3,7 +3,9 @@ import jwt
 from functools import wraps
 from functools import wraps
 
-from app.db import get_user
+from bson.objectid import ObjectId
+
+from app.db import get_cached_user, is_token_revoked
 
 
 def token_required(f):
@@ -31,8 +33,18 @@ def token_required(f):
             # Decode the token using the applications Secret Key.
             data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms="HS256")
 
-            # Store the username on Flask's global variable.
-            g._current_user = get_user(username=data['username'])
+            # In stateless mode, the user is built from the claims of the token,
+            # which is only rejected if it has been revoked by sign_out_all().
+            if current_app.config.get('STATELESS_ACCESS_TOKENS', False) and 'user_id' in data:
+                if is_token_revoked(data['username'], data.get('iat')):
+                    return {'message': 'invalid token', 'token': token}, 403
+
+                g._current_user = {'_id': ObjectId(data['user_id']), 'username': data['username']}
+
+            else:
+                # Store the user on Flask's global variable. The user is loaded
+                # from the user cache when possible.
+                g._current_user = get_cached_user(data['username'])
 
         except Exception as e:
             # Return an error message if the token is invalid.
@@ -0,0 +1,17 @@
+import os
+import re
+
+from quart_cors import cors
+
+from app.aio import create_async_app
+
+# Get the configuration file from the settings module
+# that should be used for this environment
+settings_module = os.getenv('APP_SETTINGS_MODULE')
+
+# Create the async app with the given settings.
+# Run it with an ASGI server: hypercorn asgi:app
+app = create_async_app(settings_module)
+
+# Enable CORS for all origins and resources
+app = cors(app, allow_origin=[re.compile(r'.*')], allow_credentials=True)
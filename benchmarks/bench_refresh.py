@@ -0,0 +1,127 @@
+"""
+Benchmark of the Refresh Token rotation done by every refresh.
+
+It runs the refreshes of many sessions from many threads against a MongoDB
+server, first with the previous three round trips (find the session, delete
+it and insert the new one), then with the single find_one_and_update() of
+app.db.rotate_session(), and reports the refreshes per second.
+
+It uses (and drops) the "bench_refresh" database of the given server.
+
+Usage: python -m benchmarks.bench_refresh [refreshes] [threads] [mongo uri]
+"""
+
+import secrets
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import jwt
+from pymongo import MongoClient
+
+from app.common.sessions import new_session, rotation_update, session_filter
+
+# Key used to sign the Refresh Tokens of the benchmark.
+KEY = 'benchmark key'
+
+
+def new_token(username):
+    return jwt.encode(
+        {'username': username, 'exp': datetime.utcnow() + timedelta(days=1), 'jti': secrets.token_hex(8)},
+        KEY,
+        algorithm="HS256"
+    )
+
+
+def three_round_trips(sessions, username, refresh_token):
+    """
+    Function to rotate a Refresh Token like Refresh.get() did before:
+    get_user_with_rt(), sign_out_session() and add_session().
+    """
+
+    session = sessions.find_one(session_filter(refresh_token))
+    assert session is not None
+
+    sessions.delete_one(dict(session_filter(refresh_token), username=username))
+
+    new_refresh_token = new_token(username)
+    sessions.insert_one(new_session(username, session.get('user_id'), new_refresh_token))
+
+    return new_refresh_token
+
+
+def single_round_trip(sessions, username, refresh_token):
+    """
+    Function to rotate a Refresh Token like rotate_session().
+    """
+
+    new_refresh_token = new_token(username)
+
+    session = sessions.find_one_and_update(
+        dict(session_filter(refresh_token), username=username),
+        rotation_update(new_refresh_token),
+        {'username': 1, 'user_id': 1}
+    )
+    assert session is not None
+
+    return new_refresh_token
+
+
+def run(sessions, rotate, refreshes, threads):
+    """
+    Function to run the given number of 'refreshes' with 'rotate', spread over
+    one session per thread.
+
+    Returns the elapsed time in seconds.
+    """
+
+    sessions.delete_many({})
+
+    # Every thread refreshes its own session, like a client would.
+    tokens = []
+    for thread in range(threads):
+        username = 'user{}'.format(thread)
+        refresh_token = new_token(username)
+        sessions.insert_one(new_session(username, thread, refresh_token))
+        tokens.append((username, refresh_token))
+
+    def client(thread):
+        username, refresh_token = tokens[thread]
+        for _ in range(refreshes // threads):
+            refresh_token = rotate(sessions, username, refresh_token)
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(client, range(threads)))
+
+    return time.perf_counter() - start
+
+
+def main():
+    refreshes = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    uri = sys.argv[3] if len(sys.argv) > 3 else 'mongodb://localhost:27017'
+
+    client = MongoClient(uri)
+    sessions = client.bench_refresh.sessions
+    sessions.create_index('token', unique=True, sparse=True)
+
+    print('{} refreshes from {} threads on {}'.format(refreshes, threads, uri))
+
+    try:
+        results = {
+            'three round trips': run(sessions, three_round_trips, refreshes, threads),
+            'single round trip': run(sessions, single_round_trip, refreshes, threads),
+        }
+    finally:
+        client.drop_database('bench_refresh')
+
+    for name, total in results.items():
+        print('{:<18} {:8.1f} refreshes/s  {:6.3f} ms/refresh'.format(
+            name, refreshes / total, total / refreshes * threads * 1000))
+
+
+if __name__ == '__main__':
+    main()
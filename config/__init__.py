@@ -17,4 +17,72 @@ APP_ENV_TESTING = 'testing'
 APP_ENV_DEVELOPMENT = 'development'
 APP_ENV_STAGING = 'staging'
 APP_ENV_PRODUCTION = 'production'
-APP_ENV = ''
\ No newline at end of file
+APP_ENV = ''
+
+# Database connection pool configuration (one client per worker process)
+QUEST_DB_MAX_POOL_SIZE = int(getenv("QUEST_DB_MAX_POOL_SIZE", 100))
+QUEST_DB_MAX_IDLE_TIME_MS = int(getenv("QUEST_DB_MAX_IDLE_TIME_MS", 60000))
+QUEST_DB_SERVER_SELECTION_TIMEOUT_MS = int(getenv("QUEST_DB_SERVER_SELECTION_TIMEOUT_MS", 5000))
+
+# Create the missing indexes when the app starts (see app/indexes.py)
+QUEST_DB_ENSURE_INDEXES = getenv("QUEST_DB_ENSURE_INDEXES", "false").lower() == "true"
+
+# Pagination of list endpoints
+QUEST_PAGE_SIZE = int(getenv("QUEST_PAGE_SIZE", 20))
+QUEST_MAX_PAGE_SIZE = int(getenv("QUEST_MAX_PAGE_SIZE", 100))
+
+# Number of documents fetched per batch when streaming responses
+QUEST_STREAM_BATCH_SIZE = int(getenv("QUEST_STREAM_BATCH_SIZE", 100))
+
+# Cache of the authenticated users (size and time to live in seconds)
+USER_CACHE_SIZE = int(getenv("USER_CACHE_SIZE", 1024))
+USER_CACHE_TTL = float(getenv("USER_CACHE_TTL", 5))
+
+# Store the questions embedded in their questionnaire document
+# (run "flask migrate embed-questions" before enabling it)
+QUEST_EMBEDDED_QUESTIONS = getenv("QUEST_EMBEDDED_QUESTIONS", "false").lower() == "true"
+
+# Answers read per batch, and rows per Parquet row group, when exporting
+QUEST_EXPORT_BATCH_SIZE = int(getenv("QUEST_EXPORT_BATCH_SIZE", 1000))
+QUEST_EXPORT_ROW_GROUP_SIZE = int(getenv("QUEST_EXPORT_ROW_GROUP_SIZE", 50000))
+
+# Instrument the Mongo commands and the requests, and serve them at "/metrics"
+QUEST_METRICS_ENABLED = getenv("QUEST_METRICS_ENABLED", "true").lower() == "true"
+
+# Password hashing, done in the request threads: passwords hashed at the same time
+# (0 for no limit), and passwords that may wait for their turn before new ones are
+# rejected with a 503. A pool of processes was measured with benchmarks/bench_hashing.py
+# and was no faster than the request threads, since the hashing releases the GIL.
+PASSWORD_HASH_WORKERS = int(getenv("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_QUEUE_DEPTH = int(getenv("PASSWORD_HASH_QUEUE_DEPTH", 16))
+PASSWORD_HASH_RETRY_AFTER = int(getenv("PASSWORD_HASH_RETRY_AFTER", 1))
+
+# Parameters of the new password hashes (see werkzeug.security.generate_password_hash)
+PASSWORD_HASH_METHOD = getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256")
+PASSWORD_SALT_LENGTH = int(getenv("PASSWORD_SALT_LENGTH", 16))
+
+# Cache of the questionnaire and question definitions: in-process tier (size and
+# time to live in seconds), and optional tier shared by all the workers of a host,
+# stored in a SQLite file that should be in a memory-backed file system
+DEFINITION_CACHE_SIZE = int(getenv("DEFINITION_CACHE_SIZE", 4096))
+DEFINITION_CACHE_TTL = float(getenv("DEFINITION_CACHE_TTL", 2))
+DEFINITION_CACHE_SHARED_PATH = getenv("DEFINITION_CACHE_SHARED_PATH", "")  # e.g. /dev/shm/quest-definitions.db
+DEFINITION_CACHE_SHARED_TTL = float(getenv("DEFINITION_CACHE_SHARED_TTL", 60))
+
+# Purge of the deleted questionnaires: seconds between runs of the background purger
+# of every worker (0 disables it, use "flask questionnaires purge" instead), documents
+# deleted per batch, and seconds a purger holds a questionnaire without progress
+QUEST_PURGE_INTERVAL = float(getenv("QUEST_PURGE_INTERVAL", 0))
+QUEST_PURGE_BATCH_SIZE = int(getenv("QUEST_PURGE_BATCH_SIZE", 1000))
+QUEST_PURGE_LEASE_SECONDS = int(getenv("QUEST_PURGE_LEASE_SECONDS", 60))
+
+# Cache of the compiled validators of the answers, keyed by question ID: size and
+# time to live in seconds
+ANSWER_VALIDATOR_CACHE_SIZE = int(getenv("ANSWER_VALIDATOR_CACHE_SIZE", 4096))
+ANSWER_VALIDATOR_CACHE_TTL = float(getenv("ANSWER_VALIDATOR_CACHE_TTL", 300))
+
+# Stateless Access Tokens: token_required() takes the user from the claims of the
+# token instead of loading it, and checks it against the list of revoked tokens,
+# which is reloaded from the database every "REVOCATION_SYNC_INTERVAL" seconds
+STATELESS_ACCESS_TOKENS = getenv("STATELESS_ACCESS_TOKENS", "false").lower() == "true"
+REVOCATION_SYNC_INTERVAL = float(getenv("REVOCATION_SYNC_INTERVAL", 5))